@@ -0,0 +1,167 @@
+"""This module contains a local HTTP server standing in for the vendor websites during benchmarks
+
+Listing pages are served at /<vendor slug>/<case> and product pages at
+/<vendor slug>/product/<index>/<status>, built by fixtures.py. Best Buy's and Amazon's availability APIs are
+answered at /<vendor slug>/<API path>, for the listings on their fixture pages. Responses carry an ETag so conditional
+requests get a 304 as they would from a vendor, and every request is counted per vendor.
+
+Classes:
+    FixtureServer
+"""
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import hashlib
+import json
+import threading
+from benchmarks.fixtures import vendor_slug, listing_page, product_page, availability_response, vendor_names
+
+
+# The path of each availability API under its vendor's slug, as in availability_api.py
+_api_paths = {
+    "best buy": "ecomm-api/availability/products",
+    "amazon": "paapi5/getitems",
+}
+
+
+class FixtureServer:
+    """Serves the vendor fixtures on 127.0.0.1 from a background thread"""
+
+    def __init__(self, port=0):
+        """
+        :param port: the port to listen on, any free port if 0
+        """
+        self._vendor_keys = {vendor_slug(vendor_key): vendor_key for vendor_key in vendor_names}
+        self._pages = {}
+        self._requests = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _handler_for(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fixture-server", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def url(self, vendor_key, case):
+        """Returns the URL of a vendor's listing page for a case
+
+        :param vendor_key: a lower case vendor name
+        :param case: a key of fixtures.fixture_cases
+        :return: the absolute URL
+        """
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/{vendor_slug(vendor_key)}/{case}"
+
+    def api_url(self, vendor_key):
+        """Returns the URL of a vendor's availability API, to point availability_api.py at
+
+        :param vendor_key: "best buy" or "amazon"
+        :return: the absolute URL
+        """
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/{vendor_slug(vendor_key)}/{_api_paths[vendor_key]}"
+
+    def request_count(self, vendor_key):
+        """Returns how many requests for a vendor's pages have been served so far, including 304s"""
+        with self._lock:
+            return self._requests[vendor_key]
+
+    def page(self, request_path):
+        """Finds the page for a request path, building it on first use
+
+        :param request_path: the path part of the request URL
+        :return: (vendor_key, HTML, ETag), or (vendor_key, None, None) if there is no such page
+        """
+        parts = request_path.split("?")[0].strip("/").split("/")
+        vendor_key = self._vendor_keys.get(parts[0])
+        with self._lock:
+            self._requests[vendor_key] += 1
+            if request_path not in self._pages:
+                page_html = None
+                if vendor_key is not None and len(parts) == 2:
+                    page_html = listing_page(vendor_key, parts[1])
+                elif vendor_key is not None and len(parts) == 4 and parts[1] == "product":
+                    page_html = product_page(vendor_key, int(parts[2]), parts[3].replace("_", " "))
+                etag = None
+                if page_html is not None:
+                    etag = '"' + hashlib.sha1(page_html.encode("utf-8")).hexdigest() + '"'
+                self._pages[request_path] = (page_html, etag)
+            page_html, etag = self._pages[request_path]
+        return vendor_key, page_html, etag
+
+
+    def availability(self, request_path, body=None):
+        """Answers an availability API request
+
+        :param request_path: the path and query of the request URL
+        :param body: the request body, for Amazon's POST requests
+        :return: the response JSON, None if request_path is not an availability API
+        """
+        request_URL = urlsplit(request_path)
+        slug, _, api_path = request_URL.path.strip("/").partition("/")
+        vendor_key = self._vendor_keys.get(slug)
+        if vendor_key is None or _api_paths.get(vendor_key) != api_path:
+            return None
+        with self._lock:
+            self._requests[vendor_key] += 1
+        if vendor_key == "best buy":
+            skus = parse_qs(request_URL.query)["skus"][0].split("|")
+        else:
+            skus = json.loads(body)["ItemIds"]
+        return availability_response(vendor_key, skus)
+
+
+def _handler_for(fixture_server):
+    class FixtureRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Otherwise the body waits on a delayed ACK for the headers, adding ~40 ms to every response
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            try:
+                response_json = fixture_server.availability(self.path)
+                if response_json is not None:
+                    self._respond(200, response_json.encode("utf-8"), content_type="application/json")
+                    return
+                vendor_key, page_html, etag = fixture_server.page(self.path)
+            except (KeyError, ValueError):
+                page_html = None
+            if page_html is None:
+                self._respond(404, b"Not found")
+                return
+            if self.headers.get("If-None-Match") == etag:
+                self._respond(304, b"", etag)
+                return
+            self._respond(200, page_html.encode("utf-8"), etag)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                response_json = fixture_server.availability(self.path, body)
+            except (KeyError, ValueError):
+                response_json = None
+            if response_json is None:
+                self._respond(404, b"Not found")
+                return
+            self._respond(200, response_json.encode("utf-8"), content_type="application/json")
+
+        def _respond(self, status, body, etag=None, content_type="text/html; charset=utf-8"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if etag is not None:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Benchmarks print their own summary instead of a line per request
+            pass
+
+    return FixtureRequestHandler
@@ -0,0 +1,344 @@
+"""This module contains the vendor page fixtures the benchmarks are run against
+
+Each fixture reproduces the parts of a vendor's listing or product page that the selectors in
+scraping_functions.py read, so every scraper can be run offline against known stock. Pages are built for
+each case in fixture_cases, and the number of items each should report in stock is known in advance.
+
+Best Buy and Amazon listings link to product pages by SKU, and availability_response() answers their
+availability APIs for those SKUs with the same stock as the listing page.
+
+A real page saved as snapshots/<vendor slug>/<case>.html is served instead of the built one, e.g. to check a
+scraper against a vendor's changed markup. Saved pages are not checked for how many items are in stock.
+
+Functions:
+    vendor_slug()
+    listing_statuses()
+    expected_in_stock()
+    listing_page()
+    product_page()
+    fixture_sku()
+    availability_response()
+    saved_snapshot()
+"""
+
+import html
+import json
+import os
+from scraping.scraping_functions import memory_express_stores_to_check, canada_computers_stores_to_check
+
+
+# Stock states of the listings on each case's page
+fixture_cases = {
+    "in_stock": ["in stock", "out of stock", "in stock", "out of stock"],
+    "out_of_stock": ["out of stock"] * 4,
+    "backorder": ["backorder"] * 4,
+    "many_listings": ["in stock", "out of stock", "backorder"] * 40,
+}
+
+# Vendor names as written in main.py, keyed by lower case vendor name
+vendor_names = {
+    "newegg": "Newegg",
+    "best buy": "Best Buy",
+    "memory express": "Memory Express",
+    "canada computers": "Canada Computers",
+    "amazon": "Amazon",
+    "pc canada": "PC Canada",
+}
+
+# Listing states each vendor's scraper reports as buyable, keyed by lower case vendor name.
+# Best Buy and Amazon both still sell items on backorder, the others do not.
+buyable_statuses = {
+    "newegg": {"in stock"},
+    "best buy": {"in stock", "backorder"},
+    "memory express": {"in stock"},
+    "canada computers": {"in stock"},
+    "amazon": {"in stock", "backorder"},
+    "pc canada": {"in stock"},
+}
+
+# Listing states in the order they are encoded in fixture SKUs
+_sku_statuses = ["in stock", "out of stock", "backorder"]
+
+snapshot_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots")
+
+_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>.d-none {{ display: none; }}</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+
+def vendor_slug(vendor_key):
+    """Turns a lower case vendor name into the path it is served under, e.g. "best buy" to "best-buy"
+
+    :param vendor_key: a lower case vendor name
+    :return: the slug
+    """
+    return vendor_key.replace(" ", "-")
+
+
+def listing_statuses(case):
+    """Returns the stock state of each listing on a case's page
+
+    :param case: a key of fixture_cases
+    :return: a list of "in stock", "out of stock" or "backorder"
+    """
+    return fixture_cases[case]
+
+
+def expected_in_stock(vendor_key, case):
+    """Counts the items a vendor's scraper should report in stock for a case's page
+
+    :param vendor_key: a lower case vendor name
+    :param case: a key of fixture_cases
+    :return: the number of items, None if the case is served from a saved snapshot
+    """
+    if saved_snapshot(vendor_key, case) is not None:
+        return None
+    return len([status for status in listing_statuses(case) if status in buyable_statuses[vendor_key]])
+
+
+def item_name(vendor_key, index):
+    """Names the item of a listing. Names end in a digit since some scrapers strip trailing title characters."""
+    return f"{vendor_names[vendor_key]} GeForce RTX 3080 Model {index}"
+
+
+def product_path(vendor_key, index, status):
+    """Returns the path a listing links to, with a SKU its vendor's availability_api recognizes if it has one"""
+    if vendor_key == "best buy":
+        return f"/{vendor_slug(vendor_key)}/product/{fixture_sku(vendor_key, index, status)}"
+    if vendor_key == "amazon":
+        return f"/{vendor_slug(vendor_key)}/dp/{fixture_sku(vendor_key, index, status)}"
+    return f"/{vendor_slug(vendor_key)}/product/{index}/{status.replace(' ', '_')}"
+
+
+def listing_page(vendor_key, case):
+    """Builds a vendor's listing page for a case
+
+    :param vendor_key: a lower case vendor name
+    :param case: a key of fixture_cases
+    :return: the page HTML
+    """
+    snapshot = saved_snapshot(vendor_key, case)
+    if snapshot is not None:
+        return snapshot
+
+    build_listing = _listing_builders[vendor_key]
+    listings = [build_listing(vendor_key, index, status) for index, status in enumerate(listing_statuses(case))]
+    return _PAGE.format(title=f"{vendor_names[vendor_key]} - {case}", body="\n".join(listings))
+
+
+def product_page(vendor_key, index, status):
+    """Builds a vendor's product page, for the vendors whose store inventory is only on product pages
+
+    :param vendor_key: "memory express" or "canada computers"
+    :param index: the listing's position on its listing page
+    :param status: the listing's stock state
+    :return: the page HTML, None if the vendor has no product page fixture
+    """
+    build_product = _product_builders.get(vendor_key)
+    if build_product is None:
+        return None
+    return build_product(vendor_key, index, status)
+
+
+def fixture_sku(vendor_key, index, status):
+    """Makes up a listing's SKU, encoding its stock state so availability_response() can answer for it
+
+    :param vendor_key: "best buy" or "amazon"
+    :param index: the listing's position on its listing page
+    :param status: the listing's stock state
+    :return: an 8 digit Best Buy SKU or a 10 character ASIN
+    """
+    if vendor_key == "best buy":
+        return str(10000000 + _sku_statuses.index(status) * 10000 + index)
+    return f"B0{_sku_statuses.index(status)}{index:07d}"
+
+
+def availability_response(vendor_key, skus):
+    """Builds a vendor's availability API response for SKUs made by fixture_sku()
+
+    :param vendor_key: "best buy" or "amazon"
+    :param skus: a list of SKUs
+    :return: the response JSON
+    """
+    statuses = {}
+    for sku in skus:
+        status_code = (int(sku) - 10000000) // 10000 if vendor_key == "best buy" else int(sku[2])
+        statuses[sku] = _sku_statuses[status_code]
+
+    if vendor_key == "best buy":
+        shipping_statuses = {"in stock": "InStock", "out of stock": "SoldOutOnline", "backorder": "BackOrder"}
+        return json.dumps({"availabilities": [{
+            "sku": sku,
+            "shipping": {"status": shipping_statuses[status], "purchasable": status != "out of stock"},
+            "pickup": {"status": "NotAvailable", "purchasable": False},
+        } for sku, status in statuses.items()]})
+
+    items = []
+    for sku, status in statuses.items():
+        item = {"ASIN": sku}
+        if status != "out of stock":
+            availability_type = "Now" if status == "in stock" else "Backorderable"
+            item["Offers"] = {"Listings": [{"Availability": {"Type": availability_type},
+                                            "Price": {"DisplayAmount": "$1,199.99"}}]}
+        items.append(item)
+    return json.dumps({"ItemsResult": {"Items": items}})
+
+
+def saved_snapshot(vendor_key, case):
+    """Reads a saved copy of a real vendor page, if there is one
+
+    :param vendor_key: a lower case vendor name
+    :param case: a key of fixture_cases
+    :return: the page HTML, None if no snapshot was saved
+    """
+    snapshot_path = os.path.join(snapshot_directory, vendor_slug(vendor_key), f"{case}.html")
+    if not os.path.exists(snapshot_path):
+        return None
+    with open(snapshot_path, encoding="utf-8") as snapshot_file:
+        return snapshot_file.read()
+
+
+def _newegg_listing(vendor_key, index, status):
+    promo = {"in stock": "", "out of stock": "OUT OF STOCK", "backorder": ""}[status]
+    button = {"in stock": "Add to cart", "out of stock": "Auto Notify", "backorder": "Auto Notify"}[status]
+    return f"""<div class="item-cell">
+  <div class="item-container">
+    <a class="item-title" href="{product_path(vendor_key, index, status)}">{html.escape(item_name(vendor_key, index))}</a>
+    <p class="item-promo">{promo}</p>
+    <ul class="price"><li class="price-current">$<strong>1,199</strong><sup>.99</sup></li></ul>
+    <div class="item-button-area"><button class="btn">{button}</button></div>
+  </div>
+</div>"""
+
+
+def _bestbuy_listing(vendor_key, index, status):
+    availability = {
+        "in stock": "Available to ship",
+        "out of stock": "Sold out online",
+        "backorder": "Available for backorder",
+    }[status]
+    return f"""<div class="x-productListItem">
+  <a itemprop="url" href="{product_path(vendor_key, index, status)}">
+    <div class="productItemName_3IZ3c">{html.escape(item_name(vendor_key, index))}</div>
+    <div class="price_FHDfG">$1,199.99</div>
+    <p class="availability">{availability}</p>
+  </a>
+</div>"""
+
+
+def _memory_express_listing(vendor_key, index, status):
+    button_title = {"in stock": "Buy this item", "out of stock": "Out of stock", "backorder": "Backorder this item"}[status]
+    return f"""<div class="c-shca-list-item">
+  <div class="c-shca-icon-item__body">
+    <div class="c-shca-icon-item__body-image"></div>
+    <div class="c-shca-icon-item__body-details">
+      <div class="c-shca-icon-item__body-ref">Ref #{index}</div>
+      <div class="c-shca-icon-item__body-name"><a href="{product_path(vendor_key, index, status)}">{html.escape(item_name(vendor_key, index))}</a></div>
+    </div>
+  </div>
+  <div class="c-shca-icon-item__summary">
+    <div class="c-shca-icon-item__summary-buttons">
+      <button class="c-shca-add-product-button" title="{button_title}">Add to cart</button>
+    </div>
+  </div>
+</div>"""
+
+
+def _memory_express_product(vendor_key, index, status):
+    online_stock = {"in stock": "5", "out of stock": "Out of Stock", "backorder": "Backorder"}[status]
+    store_stock = {"in stock": "3+", "out of stock": "Out of Stock", "backorder": "Backorder"}[status]
+    # The online store is always shown, local stores only once the dropdown is opened
+    rows = "\n".join(_memory_express_store_row(store, store_stock) for store in memory_express_stores_to_check)
+    body = f"""<div class="c-capr-inventory">
+  <ul>
+{_memory_express_store_row("Online Store", online_stock)}
+  </ul>
+  <div class="c-capr-inventory-selector__toggle">All stores</div>
+  <div class="c-capr-inventory-selector__dropdown-container d-none">
+    <ul>
+{rows}
+    </ul>
+  </div>
+</div>"""
+    return _PAGE.format(title=f"{html.escape(item_name(vendor_key, index))} - Memory Express Inc.", body=body)
+
+
+def _memory_express_store_row(store, stock):
+    return (f'      <li class="c-capr-inventory-store"><span class="c-capr-inventory-store__name">{store}:</span>'
+            f'<span class="c-capr-inventory-store__availability">{stock}</span></li>')
+
+
+def _canada_computers_listing(vendor_key, index, status):
+    stock_status = {"in stock": "Online In Stock", "out of stock": "", "backorder": "Back Order"}[status]
+    stock_element = f'<div class="pq-hdr-bolder">{stock_status}</div>' if stock_status else ""
+    return f"""<div class="col-12 productTemplate">
+  <div class="stocklevel-pop d-none">Stock levels</div>
+  <div class="productInfoSearch">
+    <div class="productImageSearch"><a href="{product_path(vendor_key, index, status)}">{html.escape(item_name(vendor_key, index))}</a></div>
+    {stock_element}
+  </div>
+</div>"""
+
+
+def _canada_computers_product(vendor_key, index, status):
+    availability = {
+        "in stock": "Online In Stock Available In Stores",
+        "out of stock": "Not Available Online",
+        "backorder": "Back Order",
+    }[status]
+    store_stock = "5+" if status == "in stock" else "-"
+    rows = "\n".join(f"""    <div class="row">
+      <div class="col-9"><p><a href="#">{store}</a></p></div>
+      <div class="col-3"><div class="item__avail"><p><span>{store_stock}</span></p></div></div>
+    </div>""" for store in canada_computers_stores_to_check)
+    body = f"""<div class="pi-prod-availability">{availability}</div>
+<div class="stocklevel-pop d-none">
+{rows}
+</div>"""
+    return _PAGE.format(title=f"{html.escape(item_name(vendor_key, index))} | Canada Computers & Electronics", body=body)
+
+
+def _amazon_listing(vendor_key, index, status):
+    price = ""
+    if status != "out of stock":
+        price = '<span class="style__whole__3EZEk">1,199</span><span class="style__fraction__ndKQN">99</span>'
+    return f"""<div class="ProductGridItem__itemOuter__5ow0w">
+  <a class="ProductGridItem__overlay__1ncmn" href="{product_path(vendor_key, index, status)}"></a>
+  <div class="ProductGridItem__title__2C1kS">{html.escape(item_name(vendor_key, index))}</div>
+  <div class="ProductGridItem__price__2H_kW">{price}</div>
+</div>"""
+
+
+def _pc_canada_listing(vendor_key, index, status):
+    shipping = {"in stock": "In Stock", "out of stock": "", "backorder": "On Backorder"}[status]
+    return f"""<div class="product-listing">
+  <div class="image"></div>
+  <div class="badges"></div>
+  <div class="ratings"></div>
+  <div class="shipping"><div><div><p class="text-theme-shipping">{shipping}</p></div></div></div>
+  <div class="details"><div class="name"><p><a href="{product_path(vendor_key, index, status)}">{html.escape(item_name(vendor_key, index))}</a></p></div></div>
+</div>"""
+
+
+_listing_builders = {
+    "newegg": _newegg_listing,
+    "best buy": _bestbuy_listing,
+    "memory express": _memory_express_listing,
+    "canada computers": _canada_computers_listing,
+    "amazon": _amazon_listing,
+    "pc canada": _pc_canada_listing,
+}
+
+_product_builders = {
+    "memory express": _memory_express_product,
+    "canada computers": _canada_computers_product,
+}
@@ -0,0 +1,83 @@
+"""Measures how long a fresh interpreter takes to import main.py, the start-up cost of every --once run.
+
+Each measurement imports main in a new Python process, so nothing is already cached in memory. Also checks
+that importing main leaves out the libraries only some vendors or notifiers need, so a regression that
+imports one of them at the top of a module fails straight away instead of slowly adding to start-up time.
+
+Usage, from the repository root:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --runs 20 --budget 400
+
+With --budget, the exit status is 1 if the median import takes longer than that many milliseconds,
+or if any of the lazily imported libraries was imported.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from benchmarks.run_benchmarks import percentile
+
+
+# Libraries only imported once a vendor needs a webdriver or a notifier needs them
+lazy_modules = ["selenium.webdriver", "discord", "aiohttp", "dotenv", "beepy", "psutil", "winsound"]
+
+# Run in each new process, printing how long the import took and which lazy libraries it loaded
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({"import_ms": elapsed * 1000, "loaded": [name for name in %r if name in sys.modules]}))
+"""
+
+
+def measure_import(repository_root):
+    """Imports main.py in a new interpreter
+
+    :param repository_root: the directory main.py is in
+    :return: (milliseconds the import took, the list of lazy_modules it loaded)
+    """
+    completed = subprocess.run([sys.executable, "-c", _IMPORT_SCRIPT % (lazy_modules,)], cwd=repository_root,
+                               capture_output=True, text=True, check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    return result["import_ms"], result["loaded"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measures the time a fresh interpreter takes to import main.py.")
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters to time the import in")
+    parser.add_argument("--budget", type=float, help="median import time in milliseconds that counts as a regression")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    repository_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    import_times = []
+    loaded = set()
+    for _ in range(arguments.runs):
+        import_ms, run_loaded = measure_import(repository_root)
+        import_times.append(import_ms)
+        loaded.update(run_loaded)
+
+    print(f"import main: median {percentile(import_times, 50):.1f} ms, p90 {percentile(import_times, 90):.1f} ms, "
+          f"max {max(import_times):.1f} ms over {arguments.runs} runs")
+
+    regressions = []
+    if len(loaded) != 0:
+        regressions.append(f"imported before they were needed: {', '.join(sorted(loaded))}")
+    if arguments.budget is not None and percentile(import_times, 50) > arguments.budget:
+        regressions.append(f"median {percentile(import_times, 50):.1f} ms, over the {arguments.budget:.0f} ms budget")
+    if len(regressions) != 0:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(regression)
+        sys.exit(1)
+    print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Runs every vendor scraper against local page fixtures and reports how long it took and what it cost.
+
+Each vendor's scraping function is run for every fixture case through the webdriver path and, for vendors
+that support them, the HTTP path and the availability API path. The API path polls the SKUs found on the
+listing page, which is scraped for them in the untimed warm-up only, as it is once per sku_refresh_interval
+when scraping for real. Reported per vendor, case and path:
+    latency percentiles of a whole scrape, from loading the listing page to the finished stock dictionary
+    requests served by the fixture server per scrape, including product pages
+    webdriver commands per scrape, each one an HTTP round trip to chromedriver
+    peak resident memory of this process and every process under it, e.g. chromedriver and Chrome
+    items found in stock, against how many the fixture has
+
+Usage, from the repository root:
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --paths http --vendors newegg "pc canada" --iterations 50
+    python -m benchmarks.run_benchmarks --paths api --vendors "best buy" amazon
+    python -m benchmarks.run_benchmarks --save results.json
+    python -m benchmarks.run_benchmarks --baseline results.json
+
+With --baseline, results are compared with a previous --save and the exit status is 1 if any scrape got
+slower than the tolerance allows, made more requests or webdriver commands, or found the wrong stock.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import threading
+import time
+import psutil
+from scraping import availability_api
+from benchmarks.fixtures import fixture_cases, vendor_names, expected_in_stock
+from benchmarks.fixture_server import FixtureServer
+from scraping.http_fetch import fetch_page
+from scraping.metrics import count_webdriver_commands
+from scraping.page_cache import page_cache
+from scraping.readiness import wait_until_ready
+from scraping.stock_records import observations_from_stock_dict
+from scraping.scraping_functions import (scrape_listing_page, scrape_listing_page_http, scrape_availability_api,
+                                         initialize_webdriver)
+from scraping.vendor_registry import vendor_plan
+
+
+# Slower than the baseline by more than this fraction of its median counts as a regression
+default_tolerance = 0.2
+# Seconds between peak memory samples
+rss_sample_interval = 0.05
+
+
+class PeakRSS:
+    """Samples the combined resident memory of this process and its children from a background thread"""
+
+    def __init__(self):
+        self.peak_mb = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample_forever, name="rss-sampler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample_forever(self):
+        process = psutil.Process()
+        while True:
+            rss = 0
+            for tree_process in [process] + process.children(recursive=True):
+                try:
+                    rss += tree_process.memory_info().rss
+                except psutil.NoSuchProcess:
+                    pass
+            self.peak_mb = max(self.peak_mb, rss / (1024 * 1024))
+            if self._stopped.wait(rss_sample_interval):
+                return
+
+
+def scrape_once(path, vendor_key, URL, driver=None):
+    """Runs one vendor scrape the same way scraping_functions does, without reporting or alerting on it
+
+    :param path: "browser", "http" or "api"
+    :param vendor_key: a lower case vendor name
+    :param URL: the fixture listing page
+    :param driver: an initialized webdriver, for the browser path
+    :return: the stock dictionary
+    """
+    vendor_name = vendor_names[vendor_key]
+    plan = vendor_plan(vendor_key)
+    if path == "api":
+        listings_by_sku = availability_api.sku_catalog.listings(URL)
+        if listings_by_sku is None:
+            # The listing page's SKUs, found without a browser since the fixture pages need no JavaScript
+            return scrape_listing_page_http(plan, URL, fetch_page(URL), vendor_name)[0]
+        return scrape_availability_api(plan, listings_by_sku)[0]
+    if path == "http":
+        return scrape_listing_page_http(plan, URL, fetch_page(URL), vendor_name)[0]
+    driver.get(URL)
+    wait_until_ready(driver, vendor_key, *plan.ready_when)
+    return scrape_listing_page(plan, URL, driver, vendor_name)[0]
+
+
+def benchmark(server, path, vendor_key, case, iterations, driver=None, verbose=False):
+    """Times repeated scrapes of one fixture case
+
+    :param server: a running FixtureServer
+    :param path: "browser", "http" or "api"
+    :param vendor_key: a lower case vendor name
+    :param case: a key of fixture_cases
+    :param iterations: the number of timed scrapes, after one untimed warm-up scrape
+    :param driver: a webdriver wrapped by count_webdriver_commands, for the browser path
+    :param verbose: True to show what the scrapers print
+    :return: a dictionary of results
+    """
+    URL = server.url(vendor_key, case)
+    latencies = []
+    requests_served = 0
+    commands_sent = 0
+    in_stock = None
+    output = sys.stdout if verbose else io.StringIO()
+    # The warm-up scrape finds the SKUs the API path polls
+    availability_api.sku_catalog.clear()
+
+    with PeakRSS() as peak_rss, contextlib.redirect_stdout(output):
+        for iteration in range(iterations + 1):
+            # Every scrape starts cold, rather than reusing the previous iteration's results
+            page_cache.clear()
+            requests_before = server.request_count(vendor_key)
+            commands_before = driver.commands_sent if driver is not None else 0
+
+            start = time.perf_counter()
+            stock_dict = scrape_once(path, vendor_key, URL, driver)
+            elapsed = time.perf_counter() - start
+
+            if iteration == 0:
+                continue
+            latencies.append(elapsed)
+            requests_served += server.request_count(vendor_key) - requests_before
+            if driver is not None:
+                commands_sent += driver.commands_sent - commands_before
+            observations = observations_from_stock_dict(vendor_names[vendor_key], stock_dict)
+            in_stock = len([observation for observation in observations.values() if observation.in_stock])
+
+    return {
+        "vendor": vendor_key,
+        "case": case,
+        "path": path,
+        "iterations": iterations,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "requests_per_scrape": requests_served / iterations,
+        "webdriver_commands_per_scrape": commands_sent / iterations if driver is not None else None,
+        "peak_rss_mb": peak_rss.peak_mb,
+        "in_stock": in_stock,
+        "expected_in_stock": expected_in_stock(vendor_key, case),
+    }
+
+
+def percentile(values, percent):
+    """Returns a percentile of values by the nearest rank, as in readiness.LoadTimes"""
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def print_results(results):
+    print(f"{'vendor':<17}{'case':<15}{'path':<9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+          f"{'requests':>10}{'commands':>10}{'peak MB':>9}  in stock")
+    for result in results:
+        commands = result["webdriver_commands_per_scrape"]
+        commands = "-" if commands is None else f"{commands:.1f}"
+        expected = result["expected_in_stock"]
+        in_stock = f"{result['in_stock']}" if expected is None else f"{result['in_stock']}/{expected}"
+        if expected is not None and result["in_stock"] != expected:
+            in_stock += " WRONG"
+        print(f"{result['vendor']:<17}{result['case']:<15}{result['path']:<9}{result['p50_ms']:>9.1f}"
+              f"{result['p90_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['requests_per_scrape']:>10.1f}"
+              f"{commands:>10}{result['peak_rss_mb']:>9.0f}  {in_stock}")
+
+
+def find_regressions(results, baseline, tolerance):
+    """Compares results with a previous run's
+
+    :param results: this run's results
+    :param baseline: a previous run's results, from --save
+    :param tolerance: the fraction the median latency may grow by
+    :return: a list of strings describing each regression
+    """
+    previous_results = {(result["vendor"], result["case"], result["path"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        name = f"{result['vendor']} {result['case']} {result['path']}"
+        if result["expected_in_stock"] is not None and result["in_stock"] != result["expected_in_stock"]:
+            regressions.append(f"{name}: found {result['in_stock']} in stock, expected {result['expected_in_stock']}")
+        previous = previous_results.get((result["vendor"], result["case"], result["path"]))
+        if previous is None:
+            continue
+        if result["p50_ms"] > previous["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: median {result['p50_ms']:.1f} ms, was {previous['p50_ms']:.1f} ms")
+        if result["requests_per_scrape"] > previous["requests_per_scrape"]:
+            regressions.append(f"{name}: {result['requests_per_scrape']:.1f} requests, "
+                               f"was {previous['requests_per_scrape']:.1f}")
+        if (result["webdriver_commands_per_scrape"] is not None
+                and previous["webdriver_commands_per_scrape"] is not None
+                and result["webdriver_commands_per_scrape"] > previous["webdriver_commands_per_scrape"]):
+            regressions.append(f"{name}: {result['webdriver_commands_per_scrape']:.1f} webdriver commands, "
+                               f"was {previous['webdriver_commands_per_scrape']:.1f}")
+    return regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmarks the vendor scrapers against local page fixtures.")
+    parser.add_argument("--vendors", nargs="+", default=list(vendor_names), choices=list(vendor_names),
+                        help="lower case vendor names to benchmark")
+    parser.add_argument("--cases", nargs="+", default=list(fixture_cases), choices=list(fixture_cases))
+    parser.add_argument("--paths", nargs="+", default=["http", "api", "browser"],
+                        choices=["http", "api", "browser"])
+    parser.add_argument("--iterations", type=int, default=10, help="timed scrapes per vendor, case and path")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by an earlier --save")
+    parser.add_argument("--tolerance", type=float, default=default_tolerance,
+                        help="fraction the median latency may grow by before it counts as a regression")
+    parser.add_argument("--verbose", action="store_true", help="show what the scrapers print")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    results = []
+    driver = None
+    with FixtureServer() as server:
+        availability_api.bestbuy_availability_url = server.api_url("best buy")
+        availability_api.amazon_offers_url = server.api_url("amazon")
+        # The fixture server does not check signatures, but Amazon's client needs credentials to sign with
+        availability_api.amazon_access_key = availability_api.amazon_access_key or "benchmark"
+        availability_api.amazon_secret_key = availability_api.amazon_secret_key or "benchmark"
+        availability_api.amazon_partner_tag = availability_api.amazon_partner_tag or "benchmark-20"
+        try:
+            for path in arguments.paths:
+                if path == "browser":
+                    driver = count_webdriver_commands(initialize_webdriver())
+                for vendor_key in arguments.vendors:
+                    if path == "http" and not vendor_plan(vendor_key).http_fetch:
+                        continue
+                    if path == "api" and vendor_plan(vendor_key).api_client is None:
+                        continue
+                    for case in arguments.cases:
+                        results.append(benchmark(server, path, vendor_key, case, arguments.iterations,
+                                                 driver if path == "browser" else None, arguments.verbose))
+        finally:
+            if driver is not None:
+                driver.quit()
+
+    print_results(results)
+
+    if arguments.save is not None:
+        with open(arguments.save, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), arguments.tolerance)
+        if len(regressions) != 0:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(regression)
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
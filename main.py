@@ -1,66 +1,297 @@
 """Scrapes computer part supplier websites for detecting stock of desired item.
 Generates and sends email with link and details to in-stock item when detected.
+
+Usage:
+    python main.py
+    python main.py --once --vendors newegg "best buy" --notifiers discord --json
+
+By default every vendor is scanned forever on its schedule. With --once, each vendor is scanned a single time and
+the exit status is 1 if any failed, e.g. for cron jobs or serverless functions. Selenium, discord.py and the other
+heavy libraries are only imported once a vendor or notifier needs them, to keep start-up short.
 """
 
-import random
+import argparse
+import contextlib
 import datetime
-import time
+import json
 import os
-from scraping.scraping_functions import scrape_vendors, initialize_webdriver
-
-# Comment/uncomment vendors and change URLs as needed, but keep the same webpage structure for each vendor.
-vendors_to_scrape = {
-    "Newegg": "https://www.newegg.ca/p/pl?d=Rtx+3080&N=50001402%2050001312%2050001315%2050012150%2050001314%20601357282%20100007708&LeftPriceRange=0+1300",
-    "Best Buy": "https://www.bestbuy.ca/en-ca/collection/rtx-30-series-graphic-cards/316108?path=category%253AComputers%2B%2526%2BTablets%253Bcategory%253APC%2BComponents%253Bcategory%253AGraphics%2BCards%253Bcustom0graphicscardtype%253AGeForce%2BRTX%2B3080",
-    "Memory Express": "https://www.memoryexpress.com/Category/VideoCards?FilterID=fdd27ae5-da44-3d27-95bc-3076cc5fc8f3",
-    "Canada Computers": "https://www.canadacomputers.com/index.php?cPath=43_557_559&sf=:3_5&mfr=&pr=",
-    "Amazon": "https://www.amazon.ca/stores/GeForce/RTX3080_GEFORCERTX30SERIES/page/6B204EA4-AAAC-4776-82B1-D7C3BD9DDC82",
-    "PC Canada": "https://www.pc-canada.com/p/go/go.asp?CATID=10074&OPTID=111116290%2C1596338%7C%2C111114984%2C19789374",
+import sys
+from scraping.concurrency import scrape_all_vendors, scrape_on_schedule
+from scraping.coordination import SQLiteCoordinator, ShardedWorker, coordination_db_path, default_worker_id
+from scraping.driver_pool import DriverPool
+from scraping.hot_watch import HotWatcher
+from scraping.observation_store import ObservationStore
+from scraping.notifications import get_dispatcher, close_dispatcher, set_enabled_channels
+from scraping.scraping_functions import report_stock, select_stores
+from scraping.scheduler import Scheduler, VendorSchedule
+from scraping.metrics import start_metrics_server
+from scraping.stock_records import observation_to_json
+from scraping.vendor_registry import VendorConfigError, vendor_config_directory, vendor_plans
+from scraping.watches import WatchIndex, watches_from_config, vendor_urls
+
+# Products or searches to alert on. The name is used in alert subject lines. A listing matches a watch if its name
+# contains every word of every keyword, none of the exclude keywords, and it costs no more than max_price.
+# Comment/uncomment vendors and change URLs as needed, but keep the same webpage structure for each vendor. Each
+# vendor can have a URL or a list of URLs, and a URL listed under several watches is only scraped once per scan.
+watches_to_check = [
+    {
+        "name": "RTX 3080",
+        "keywords": ["3080"],
+        "exclude": ["3080 ti"],
+        "max_price": None,
+        "vendors": {
+            "Newegg": "https://www.newegg.ca/p/pl?d=Rtx+3080&N=50001402%2050001312%2050001315%2050012150%2050001314%20601357282%20100007708&LeftPriceRange=0+1300",
+            "Best Buy": "https://www.bestbuy.ca/en-ca/collection/rtx-30-series-graphic-cards/316108?path=category%253AComputers%2B%2526%2BTablets%253Bcategory%253APC%2BComponents%253Bcategory%253AGraphics%2BCards%253Bcustom0graphicscardtype%253AGeForce%2BRTX%2B3080",
+            "Memory Express": "https://www.memoryexpress.com/Category/VideoCards?FilterID=fdd27ae5-da44-3d27-95bc-3076cc5fc8f3",
+            "Canada Computers": "https://www.canadacomputers.com/index.php?cPath=43_557_559&sf=:3_5&mfr=&pr=",
+            "Amazon": "https://www.amazon.ca/stores/GeForce/RTX3080_GEFORCERTX30SERIES/page/6B204EA4-AAAC-4776-82B1-D7C3BD9DDC82",
+            "PC Canada": "https://www.pc-canada.com/p/go/go.asp?CATID=10074&OPTID=111116290%2C1596338%7C%2C111114984%2C19789374",
+        },
+    },
+    # {
+    #     "name": "RTX 3070 under $900",
+    #     "keywords": ["3070"],
+    #     "exclude": ["3070 ti"],
+    #     "max_price": 900,
+    #     "vendors": {
+    #         # Same page as the RTX 3080 watch, so it is only scraped once
+    #         "Canada Computers": "https://www.canadacomputers.com/index.php?cPath=43_557_559&sf=:3_5&mfr=&pr=",
+    #     },
+    # },
+]
+
+# Seconds between the start of two scans of each vendor, plus up to jitter random seconds. When more vendors are
+# due than there are workers, higher priority vendors go first. Intervals halve for a while after stock is found
+# and inside drop windows, and grow after errors. Drop windows are (weekday, "HH:MM", "HH:MM") in local time,
+# with weekday 0 for Monday to 6 for Sunday, or None for every day.
+vendor_schedules = {
+    "Newegg": {"interval": 20, "jitter": 10, "priority": 2, "drop_windows": []},
+    "Best Buy": {"interval": 15, "jitter": 10, "priority": 3, "drop_windows": []},
+    "Memory Express": {"interval": 30, "jitter": 15, "priority": 1, "drop_windows": []},
+    "Canada Computers": {"interval": 30, "jitter": 15, "priority": 1, "drop_windows": []},
+    "Amazon": {"interval": 45, "jitter": 15, "priority": 0, "drop_windows": []},
+    "PC Canada": {"interval": 45, "jitter": 15, "priority": 0, "drop_windows": []},
 }
 
-# Used for email subject line only. URLs in vendors_to_scrape must be updated to actually scrape for it.
-item = "RTX 3080"
+# Vendors kept open in a browser tab of their own and polled from inside the page, to see stock change within
+# seconds instead of once per interval. Only vendors whose listing pages are rendered server-side, like Newegg and
+# PC Canada, or whose availability API their pages can call, like Best Buy, can be hot watched. Not used with
+# --once or when sharing vendors between workers. Overridable with the HOT_WATCH environment variable, e.g.
+# HOT_WATCH="Newegg,Best Buy".
+hot_watch_vendors = []
+
+# Notification channels that can be chosen with --notifiers
+notifier_names = ["beep", "discord", "email"]
+
 
 def main():
-    # Initial email message states. Prevents email spamming later.
-    email_bodies = {
-        "Newegg": "",
-        "Best Buy": "",
-        "Memory Express": "",
-        "Canada Computers": "",
-        "Amazon": "",
-        "PC Canada": "",
-    }
+    watches = watches_from_config(watches_to_check)
+    vendors_to_scrape = vendor_urls(watches)
+    arguments = parse_arguments(list(vendors_to_scrape))
+    if arguments.vendors is not None:
+        vendors_to_scrape = {vendor_name: URLs for vendor_name, URLs in vendors_to_scrape.items()
+                             if vendor_name.lower() in arguments.vendors}
+    if arguments.notifiers is not None:
+        set_enabled_channels(arguments.notifiers)
+
+    # With --json, standard output only carries the results, so everything else printed goes to standard error
+    with contextlib.redirect_stdout(sys.stderr if arguments.json else sys.stdout):
+        results = run(vendors_to_scrape, watches, arguments.once)
+    if results is None:
+        return
+    if arguments.json:
+        print(json.dumps(results, indent=2))
+    if len(results["errors"]) != 0:
+        sys.exit(1)
+
+
+def run(vendors_to_scrape, watches, once=False):
+    """Scans vendors forever, or a single time with once
+
+    :param vendors_to_scrape: a dictionary of vendor names and their listing page URLs
+    :param watches: a list of Watch to alert on
+    :param once: True to scan each vendor once and return
+    :return: with once, the scan's results from scan_once(), otherwise never returns
+    """
+    # Stock seen in the previous scan, keyed by vendor then SKU. Only changes from it are alerted.
+    last_observations = {vendor_name: {} for vendor_name in vendors_to_scrape}
+
+    # Compiles every vendor definition now, so a mistake in one stops the scraper here instead of failing its scans
+    plans = vendor_plans()
+    unknown_vendors = [vendor_name for vendor_name in vendors_to_scrape if vendor_name.lower().strip() not in plans]
+    if len(unknown_vendors) != 0:
+        raise VendorConfigError(f"no vendor definition in {vendor_config_directory} for {', '.join(unknown_vendors)}")
+
+    # Looks up the stores around STORE_POSTAL_CODE now, rather than from a scan
+    select_stores(list(vendors_to_scrape))
+
+    # Picks up where the last run left off, so a restart doesn't re-alert on everything in stock
+    store = ObservationStore()
+    for vendor_name, observations in store.last_known_state().items():
+        if vendor_name in last_observations:
+            last_observations[vendor_name] = observations
 
     userdefined_interval = os.getenv("INTERVAL")
     if userdefined_interval is not None:
-        print(f"Using user defined interval of {userdefined_interval} (+random 15) seconds .\n")
+        print(f"Using user defined interval of {userdefined_interval} (+random jitter) seconds for every vendor.\n")
+    scheduler = Scheduler([vendor_schedule(vendor_name, userdefined_interval) for vendor_name in vendors_to_scrape])
 
-    while True:
-        # Timestamp for scan
-        now = datetime.datetime.now()
-        print(now.strftime("%Y-%m-%d %H:%M:%S"))
-
-        try:
-            driver = initialize_webdriver()
-            # Scrapes all specified vendors
-            for vendor_name, URL in vendors_to_scrape.items():
-                email_body = scrape_vendors(vendor_name, URL, driver, item, email_bodies)
-                email_bodies[vendor_name] = email_body
-            driver.close()
-        except Exception as e:
-            print("Error: " + str(e))
-
-        random_interval = random.randrange(15, 30)
-        if userdefined_interval is None:
-            # Waits 15 to 30 seconds before attempting next scan
-            print(f"\nNext scan in {random_interval} seconds.\n")
-            time.sleep(random_interval)
+    # Number of vendors scraped at the same time, each with its own webdriver
+    userdefined_workers = os.getenv("WORKERS")
+    if userdefined_workers is None:
+        max_workers = 1
+    else:
+        max_workers = int(userdefined_workers)
+        print(f"Using user defined worker count of {max_workers}.\n")
+
+    # Serves per-vendor timings, errors and stock counts for Prometheus
+    userdefined_metrics_port = os.getenv("METRICS_PORT")
+    if userdefined_metrics_port is not None and not once:
+        start_metrics_server(int(userdefined_metrics_port))
+        print(f"Serving metrics on port {userdefined_metrics_port} at /metrics.\n")
+
+    userdefined_hot_watch = os.getenv("HOT_WATCH")
+    hot_vendors = hot_watch_vendors
+    if userdefined_hot_watch is not None:
+        hot_vendors = [vendor_name.strip() for vendor_name in userdefined_hot_watch.split(",") if vendor_name.strip()]
+        print(f"Using user defined hot watched vendors: {', '.join(hot_vendors) or 'none'}.\n")
+    hot_vendors = {vendor_name.lower() for vendor_name in hot_vendors}
+    vendors_to_hot_watch = {vendor_name: URLs for vendor_name, URLs in vendors_to_scrape.items()
+                            if vendor_name.lower() in hot_vendors}
+
+    # Browsers are kept open between scans and only restarted when they crash or grow too large
+    pool = DriverPool(size=max_workers)
+    try:
+        if once:
+            return scan_once(vendors_to_scrape, WatchIndex(watches), pool, store, last_observations, max_workers)
+        if coordination_db_path is not None:
+            print(f"Sharing vendors with other workers through {coordination_db_path}.\n")
+            if len(vendors_to_hot_watch) != 0:
+                print("Hot watching is not used when sharing vendors, scanning every vendor on its schedule.\n")
+            scan_sharded(vendors_to_scrape, WatchIndex(watches), pool, store, scheduler, last_observations, max_workers)
         else:
-            interval = int(userdefined_interval) + random_interval
-            print(f"\nNext scan in {interval} seconds.\n")
-            time.sleep(interval)
-        random.random()
+            scan_forever(vendors_to_scrape, WatchIndex(watches), pool, store, scheduler, last_observations, max_workers,
+                         vendors_to_hot_watch)
+    finally:
+        pool.close()
+        store.close()
+        close_dispatcher()
+
+
+def vendor_schedule(vendor_name, userdefined_interval=None):
+    """Builds a vendor's VendorSchedule from vendor_schedules, with defaults for vendors missing from it
+
+    :param vendor_name: a vendor name from watches_to_check
+    :param userdefined_interval: the INTERVAL environment variable, replacing every vendor's interval if set
+    :return: a VendorSchedule
+    """
+    settings = dict(vendor_schedules.get(vendor_name, {"interval": 30, "jitter": 15}))
+    if userdefined_interval is not None:
+        settings["interval"] = int(userdefined_interval)
+    return VendorSchedule(vendor_name, **settings)
+
+
+def parse_arguments(vendor_names):
+    """Reads the command line options
+
+    :param vendor_names: every vendor name in watches_to_check
+    :return: the options, with vendors as lower case names, or None for every vendor
+    """
+    parser = argparse.ArgumentParser(description="Scans computer part vendors for stock and alerts on new stock.")
+    parser.add_argument("--once", action="store_true", help="scan each vendor once and exit, e.g. from cron")
+    parser.add_argument("--vendors", nargs="+", metavar="VENDOR",
+                        help=f"only scan these vendors, any of: {', '.join(vendor_names)}")
+    parser.add_argument("--notifiers", nargs="+", choices=notifier_names + ["none"],
+                        help="alert through these channels instead of the ones turned on in scraping/notifications.py")
+    parser.add_argument("--json", action="store_true",
+                        help="print the stock found as JSON on standard output, and everything else on standard error")
+    arguments = parser.parse_args()
+
+    if arguments.vendors is not None:
+        arguments.vendors = [vendor_name.lower() for vendor_name in arguments.vendors]
+        unknown_vendors = set(arguments.vendors) - {vendor_name.lower() for vendor_name in vendor_names}
+        if len(unknown_vendors) != 0:
+            parser.error(f"unknown vendors: {', '.join(sorted(unknown_vendors))}, choose from: {', '.join(vendor_names)}")
+    if arguments.notifiers is not None and "none" in arguments.notifiers:
+        arguments.notifiers = []
+    if arguments.json and not arguments.once:
+        parser.error("--json needs --once")
+    return arguments
+
+
+def scan_once(vendors_to_scrape, watch_index, pool, store, last_observations, max_workers):
+    """Scans every vendor a single time, alerting on and storing what changed since the last run
+
+    :return: a dictionary with each scanned vendor's observations under "vendors",
+        and each failed vendor's error under "errors"
+    """
+    errors = {}
+    new_observations = scrape_all_vendors(vendors_to_scrape, watch_index, last_observations, pool, max_workers, errors)
+    store.record_cycle(new_observations)
+    print(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+          + f" Scanned {len(new_observations)} of {len(vendors_to_scrape)} vendors")
+    return {
+        "vendors": {vendor_name: [observation_to_json(observation) for observation in observations.values()]
+                    for vendor_name, observations in new_observations.items()},
+        "errors": {vendor_name: str(error) for vendor_name, error in errors.items()},
+    }
+
+
+def scan_forever(vendors_to_scrape, watch_index, pool, store, scheduler, last_observations, max_workers,
+                 vendors_to_hot_watch=None):
+    """Scans each vendor whenever it is due, and each hot watched vendor whenever its pages see a change
+
+    :param vendors_to_hot_watch: a dictionary of the vendor names to hot watch and their listing page URLs
+    """
+    def on_scan_finished(vendor_name, observations):
+        # Timestamp for scan
+        print(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + f" {vendor_name} scanned")
+        store.record_cycle({vendor_name: observations})
+        # This vendor's alerts are sent now, rather than waiting out the coalescing window
+        get_dispatcher().end_scan()
+
+    # Hot watched vendors are held out of the schedule while their pages are being polled
+    hot_watcher = HotWatcher(vendors_to_hot_watch or {}, watch_index, last_observations, scheduler, on_scan_finished)
+    hot_watcher.start()
+    try:
+        # Scrapes each specified vendor whenever it is due
+        scrape_on_schedule(vendors_to_scrape, watch_index, last_observations, pool, scheduler, on_scan_finished,
+                           max_workers)
+    finally:
+        hot_watcher.stop()
+
+
+def scan_sharded(vendors_to_scrape, watch_index, pool, store, scheduler, last_observations, max_workers):
+    """Scans only the vendors this worker holds leases on, and reports each scan to the leader.
+    Only the leader, which may be this worker, compares scans, stores them and sends alerts.
+    """
+    # The leader's copy of every vendor's last scan, reloaded from the store whenever this worker takes over
+    leader_observations = {}
+
+    def on_leadership_changed(is_leader):
+        leader_observations.clear()
+        if is_leader:
+            store.flush()
+            leader_observations.update(store.last_known_state())
+
+    def on_report(vendor_name, observations, observed_at):
+        # Timestamp for scan
+        print(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + f" {vendor_name} scanned")
+        report_stock(watch_index, vendor_name, observations, leader_observations.get(vendor_name, {}))
+        leader_observations[vendor_name] = observations
+        store.record_cycle({vendor_name: observations}, observed_at)
+        get_dispatcher().end_scan()
+
+    worker = ShardedWorker(SQLiteCoordinator(), default_worker_id(), list(vendors_to_scrape), scheduler.set_active,
+                           on_leadership_changed, on_report)
+    # Nothing is scanned until the first lease is taken
+    scheduler.set_active([])
+    worker.start()
+    try:
+        scrape_on_schedule(vendors_to_scrape, None, last_observations, pool, scheduler,
+                           lambda vendor_name, observations: worker.report(vendor_name, observations), max_workers)
+    finally:
+        worker.stop()
 
 
 if __name__ == "__main__":
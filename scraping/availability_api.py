@@ -0,0 +1,269 @@
+"""This module contains the JSON availability APIs used to poll vendors without loading their listing pages
+
+Best Buy and Amazon render their listing pages with JavaScript, so scraping them takes a webdriver and a full
+page load. Both also answer availability for many SKUs in a single JSON request. A vendor with an
+availability_api in its definition has its SKUs discovered from its rendered listing page as usual, remembered
+in sku_catalog, and then polled through its API in batches of batch_size until the SKUs are sku_refresh_interval
+seconds old, when the listing page is scraped again to pick up new products. If the API fails, the listing
+page is scraped instead and the API is left alone for api_retry_interval seconds.
+
+Each client reports the same channels as its vendor's stock_rules, and the vendor's other conditions, like a
+price limit, are applied to the API's price through its availability_api stock_rules, so an item reads the same
+whichever way it was checked.
+
+Amazon's Product Advertising API needs the AMAZON_ACCESS_KEY, AMAZON_SECRET_KEY and AMAZON_PARTNER_TAG
+environment variables of an Amazon Associates account. Without them, Amazon is always scraped from its page.
+
+Classes:
+    SkuCatalog
+    AvailabilityClient
+    BestBuyAvailability
+    AmazonOffers
+
+Functions:
+    availability_client()
+    poll_availability()
+"""
+
+from abc import ABC, abstractmethod
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+from scraping.http_fetch import fetch_json
+
+
+# Seconds discovered SKUs are polled for before the listing page is scraped again for new products
+sku_refresh_interval = 1800
+# Seconds the API is left alone after it fails, scraping the listing page instead
+api_retry_interval = 300
+
+# Endpoints, replaced by the fixture server's in the benchmarks
+bestbuy_availability_url = "https://www.bestbuy.ca/ecomm-api/availability/products"
+amazon_offers_url = "https://webservices.amazon.ca/paapi5/getitems"
+
+amazon_access_key = os.getenv("AMAZON_ACCESS_KEY")
+amazon_secret_key = os.getenv("AMAZON_SECRET_KEY")
+amazon_partner_tag = os.getenv("AMAZON_PARTNER_TAG")
+# The Product Advertising API region serving amazon.ca
+amazon_region = "us-east-1"
+
+
+class SkuCatalog:
+    """A thread-safe record of the listings discovered on each listing page, keyed by URL then SKU"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def remember(self, URL, listings_by_sku):
+        """Replaces the listings discovered on a listing page
+
+        :param URL: the listing page URL
+        :param listings_by_sku: a dictionary of SKUs to the listing's dictionary of field values
+        """
+        with self._lock:
+            self._entries[URL] = {"listings": listings_by_sku, "discovered_at": time.monotonic(), "paused_until": 0}
+
+    def renew(self, URL):
+        """Keeps a listing page's SKUs for another sku_refresh_interval, e.g. once the page is seen to be unchanged"""
+        with self._lock:
+            if URL in self._entries:
+                self._entries[URL]["discovered_at"] = time.monotonic()
+
+    def pause(self, URL):
+        """Stops a listing page's SKUs being polled through the API for api_retry_interval, e.g. after it failed"""
+        with self._lock:
+            if URL in self._entries:
+                self._entries[URL]["paused_until"] = time.monotonic() + api_retry_interval
+
+    def listings(self, URL):
+        """Looks up the listings to poll for a listing page
+
+        :param URL: the listing page URL
+        :return: a dictionary of SKUs to listings, None if the page has to be scraped first
+        """
+        with self._lock:
+            entry = self._entries.get(URL)
+            now = time.monotonic()
+            if entry is None or now - entry["discovered_at"] > sku_refresh_interval or now < entry["paused_until"]:
+                return None
+            return entry["listings"]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+sku_catalog = SkuCatalog()
+
+
+class AvailabilityClient(ABC):
+    """Fetches the availability of a batch of SKUs from a vendor's JSON API. Clients implement fetch(), and
+    those that set items_key also implement request_url() and read_items() for hot_watch.py.
+    """
+    # For APIs the vendor's own pages can call, where each SKU's entry is in the response, for hot_watch.py
+    items_key = None
+    sku_key = None
+
+    @property
+    def enabled(self):
+        """False if the client is missing something it needs, e.g. credentials"""
+        return True
+
+    def request_url(self, skus):
+        """Returns the URL a vendor's page can fetch() a batch of SKUs' availability from, with its own cookies
+
+        :param skus: a list of the vendor's SKUs, at most the vendor's batch_size
+        :return: the URL, None if the API cannot be called from the page, e.g. it needs signed requests
+        """
+        return None
+
+    def read_items(self, items):
+        """Reads the availability of each SKU from its entry in the response to request_url()
+
+        :param items: a list of the response's entries under items_key
+        :return: a dictionary of SKUs to availability, as fetch() returns, None if the client has no items_key
+        """
+        return None
+
+    @abstractmethod
+    def fetch(self, skus):
+        """Looks up a batch of SKUs
+
+        :param skus: a list of the vendor's SKUs, at most the vendor's batch_size
+        :return: a dictionary of SKUs to dictionaries of "online", "in_store" and "backorder" True or False for
+            the channels the API reports, and optionally a "price" string. SKUs the API does not know are left out.
+        """
+
+
+class BestBuyAvailability(AvailabilityClient):
+    """Best Buy's availability endpoint, which takes SKUs separated by "|" and reports shipping and pickup"""
+    items_key = "availabilities"
+    sku_key = "sku"
+
+    def fetch(self, skus):
+        return self.read_items(fetch_json(self.request_url(skus))[self.items_key])
+
+    def request_url(self, skus):
+        return (f"{bestbuy_availability_url}?accept=application%2Fvnd.bestbuy.standardproduct.v1%2Bjson"
+                f"&accept-language=en-CA&skus={'%7C'.join(skus)}")
+
+    def read_items(self, items):
+        availability = {}
+        for product in items:
+            shipping_status = product["shipping"]["status"].lower()
+            shippable = product["shipping"]["purchasable"]
+            availability[product["sku"]] = {
+                "online": shippable and shipping_status not in ("backorder", "preorder"),
+                "backorder": shippable and shipping_status in ("backorder", "preorder"),
+                "in_store": product["pickup"]["purchasable"],
+            }
+        return availability
+
+
+class AmazonOffers(AvailabilityClient):
+    """Amazon's Product Advertising API GetItems operation, signed with AWS Signature Version 4"""
+
+    @property
+    def enabled(self):
+        return None not in (amazon_access_key, amazon_secret_key, amazon_partner_tag)
+
+    def fetch(self, skus):
+        body = json.dumps({
+            "ItemIds": skus,
+            "Resources": ["Offers.Listings.Availability.Type", "Offers.Listings.Price"],
+            "PartnerTag": amazon_partner_tag,
+            "PartnerType": "Associates",
+            "Marketplace": "www.amazon.ca",
+        }).encode("utf-8")
+        response = fetch_json(amazon_offers_url, body, _amazon_signed_headers(amazon_offers_url, body))
+        if "ItemsResult" not in response:
+            errors = response.get("Errors") or [{"Message": "no ItemsResult"}]
+            raise ValueError(errors[0]["Message"])
+
+        availability = {}
+        for item in response["ItemsResult"].get("Items", []):
+            offers = item.get("Offers", {}).get("Listings", [])
+            # As on the listing page, where anything with a price can be bought, now or on backorder
+            buyable = any(offer.get("Availability", {}).get("Type") in ("Now", "Backorderable", "Preorderable")
+                          for offer in offers)
+            availability[item["ASIN"]] = {"online": buyable}
+            if len(offers) != 0 and "Price" in offers[0]:
+                availability[item["ASIN"]]["price"] = offers[0]["Price"]["DisplayAmount"]
+        return availability
+
+
+availability_clients = {
+    "best buy": BestBuyAvailability(),
+    "amazon": AmazonOffers(),
+}
+
+
+def availability_client(name):
+    """Returns the client named in a vendor's availability_api
+
+    :param name: a key of availability_clients
+    :return: an AvailabilityClient, None if it is not enabled
+    """
+    client = availability_clients[name]
+    return client if client.enabled else None
+
+
+def poll_availability(client, skus, batch_size):
+    """Looks up every SKU in as few requests as the API allows
+
+    :param client: an AvailabilityClient
+    :param skus: a list of SKUs
+    :param batch_size: the most SKUs the API takes in one request
+    :return: a dictionary of SKUs to availability, as AvailabilityClient.fetch() returns
+    """
+    availability = {}
+    for batch_start in range(0, len(skus), batch_size):
+        availability.update(client.fetch(skus[batch_start:batch_start + batch_size]))
+    return availability
+
+
+def _amazon_signed_headers(URL, body):
+    """Signs a Product Advertising API request with AWS Signature Version 4
+
+    :return: the headers to send with it, including Authorization
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    date = now.strftime("%Y%m%d")
+    parts = urlparse(URL)
+    headers = {
+        "content-encoding": "amz-1.0",
+        "content-type": "application/json; charset=utf-8",
+        "host": parts.netloc,
+        "x-amz-date": amz_date,
+        "x-amz-target": "com.amazon.paapi5.v1.ProductAdvertisingAPIv1.GetItems",
+    }
+    signed_headers = ";".join(sorted(headers))
+    canonical_request = "\n".join([
+        "POST",
+        parts.path,
+        "",
+        "".join(f"{name}:{headers[name]}\n" for name in sorted(headers)),
+        signed_headers,
+        hashlib.sha256(body).hexdigest(),
+    ])
+    scope = f"{date}/{amazon_region}/ProductAdvertisingAPI/aws4_request"
+    string_to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope,
+                                hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()])
+
+    key = ("AWS4" + amazon_secret_key).encode("utf-8")
+    for scope_part in (date, amazon_region, "ProductAdvertisingAPI", "aws4_request"):
+        key = hmac.new(key, scope_part.encode("utf-8"), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    headers["Authorization"] = (f"AWS4-HMAC-SHA256 Credential={amazon_access_key}/{scope}, "
+                                f"SignedHeaders={signed_headers}, Signature={signature}")
+    # requests sets Host itself, from the URL signed above
+    del headers["host"]
+    return headers
@@ -0,0 +1,210 @@
+"""This module contains the functions necessary to read a whole listing page in a single webdriver call
+
+Every WebDriver find_element, .text and get_attribute call is a separate HTTP round trip to chromedriver.
+Instead, the listing and field selectors of each vendor's ExtractionPlan, from its definition in
+scraping/vendors/, are sent to the browser once, and one execute_script call returns every listing as a
+dictionary of field values.
+
+A hot watched page instead reads its own listings: an injected script re-downloads the listing pages or the
+vendor's availability API with fetch(), from inside the page and with its cookies, and queues only what changed
+since its last poll in window.__stockDeltas, for Python to collect without reloading or rendering anything.
+
+Functions:
+    extract_listings_in_browser()
+    region_html_in_browser()
+    install_stock_poller()
+    collect_stock_deltas()
+"""
+
+# Mirrors http_fetch.extract_listings() so both scraping paths return the same field values.
+# Selectors starting with "./", "/" or "following-sibling::" are XPaths, anything else is CSS.
+_LISTING_FUNCTIONS = """
+function selectElement(root, selector) {
+    if (selector === null) {
+        return root;
+    }
+    if (/^(\\.\\/|\\/|following-sibling::)/.test(selector)) {
+        // The listing's own document, which is not the page's when reading a downloaded copy of it
+        return root.ownerDocument.evaluate(selector, root, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    }
+    return root.querySelector(selector);
+}
+
+function readValue(element, attribute) {
+    if (element === null) {
+        return "";
+    }
+    if (attribute === "text") {
+        return element.innerText.trim();
+    }
+    // Properties like href are already resolved to absolute URLs, as with WebElement.get_attribute()
+    var value = element[attribute];
+    if (value === undefined || value === null) {
+        value = element.getAttribute(attribute);
+    }
+    return value === null ? "" : String(value);
+}
+
+function readListings(root, listingSelector, fields) {
+    var listings = [];
+    root.querySelectorAll(listingSelector).forEach(function (listing) {
+        var values = {};
+        Object.keys(fields).forEach(function (field) {
+            values[field] = readValue(selectElement(listing, fields[field][0]), fields[field][1]);
+        });
+        listings.push(values);
+    });
+    return listings;
+}
+"""
+
+_EXTRACT_LISTINGS_SCRIPT = _LISTING_FUNCTIONS + """
+return readListings(document, arguments[0], arguments[1]);
+"""
+
+# Polls until a poll fails, then queues the error and stops, leaving it to Python to reload the page.
+# The first poll queues everything it read, later ones only what changed.
+_STOCK_POLLER_SCRIPT = _LISTING_FUNCTIONS + """
+var config = arguments[0];
+if (window.__stockWatch !== undefined) {
+    clearTimeout(window.__stockWatch.timer);
+}
+var watch = {previous: {}, polls: 0, timer: null};
+window.__stockWatch = watch;
+window.__stockDeltas = [];
+
+function httpError(response) {
+    var error = new Error("HTTP " + response.status + " from " + response.url);
+    error.status = response.status;
+    error.retryAfter = response.headers.get("Retry-After");
+    return error;
+}
+
+function download(url, index) {
+    var headers = config.source === "api" ? {"Accept": "application/json"} : {};
+    return fetch(url, {credentials: "include", cache: "no-store", headers: headers}).then(function (response) {
+        if (!response.ok) {
+            throw httpError(response);
+        }
+        return config.source === "api" ? response.json() : response.text();
+    }).then(function (body) {
+        if (config.source === "api") {
+            return body[config.itemsKey].map(function (item) { return [String(item[config.skuKey]), item]; });
+        }
+        var page = new DOMParser().parseFromString(body, "text/html");
+        var listings = readListings(page, config.listingSelector, config.fields);
+        // Later pages can run out of listings, but the first one only does behind a bot check
+        if (index === 0 && listings.length === 0) {
+            var error = new Error("no listings in " + url);
+            error.title = page.title;
+            throw error;
+        }
+        return listings.map(function (listing) { return [listing[config.keyField], listing]; });
+    });
+}
+
+function poll() {
+    Promise.all(config.urls.map(download)).then(function (responses) {
+        if (window.__stockWatch !== watch) {
+            return;
+        }
+        var current = {};
+        var changed = {};
+        responses.forEach(function (entries) {
+            entries.forEach(function (entry) {
+                if (entry[0] in current) {
+                    return;
+                }
+                current[entry[0]] = JSON.stringify(entry[1]);
+                if (watch.previous[entry[0]] !== current[entry[0]]) {
+                    changed[entry[0]] = entry[1];
+                }
+            });
+        });
+        var removed = Object.keys(watch.previous).filter(function (key) { return !(key in current); });
+        watch.previous = current;
+        watch.polls += 1;
+        if (watch.polls === 1 || Object.keys(changed).length !== 0 || removed.length !== 0) {
+            window.__stockDeltas.push({changed: changed, removed: removed, detected_at: Date.now() / 1000});
+        }
+        watch.timer = setTimeout(poll, config.intervalMs);
+    }).catch(function (error) {
+        if (window.__stockWatch === watch) {
+            window.__stockDeltas.push({error: String(error.message || error), status: error.status || null,
+                                       retry_after: error.retryAfter || null, title: error.title || null});
+        }
+    });
+}
+poll();
+"""
+
+_COLLECT_DELTAS_SCRIPT = """
+if (window.__stockWatch === undefined) {
+    return null;
+}
+return window.__stockDeltas.splice(0);
+"""
+
+_REGION_HTML_SCRIPT = """
+var selector = arguments[0];
+var elements = [];
+if (/^(\\.\\/|\\/|following-sibling::)/.test(selector)) {
+    var snapshot = document.evaluate(selector, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (var i = 0; i < snapshot.snapshotLength; i++) {
+        elements.push(snapshot.snapshotItem(i));
+    }
+} else {
+    elements = Array.prototype.slice.call(document.querySelectorAll(selector));
+}
+return elements.map(function (element) { return element.outerHTML; }).join("");
+"""
+
+
+def extract_listings_in_browser(driver, listing_selector, fields):
+    """Reads every listing on the currently loaded page into a dictionary of field values,
+    in a single round trip to the browser
+
+    :param driver: an initialized webdriver with the listing page loaded
+    :param listing_selector: a CSS selector matching one element per listing
+    :param fields: a dictionary of field names to (selector, attribute) pairs. The selector is relative to
+        the listing, None for the listing itself. The attribute is "text" for the element's visible text.
+    :return: a list of dictionaries of field names to values, "" for fields that are missing
+    """
+    return driver.execute_script(_EXTRACT_LISTINGS_SCRIPT, listing_selector, fields)
+
+
+def region_html_in_browser(driver, selector):
+    """Serializes the part of the loaded page a scraper reads, for hashing
+
+    :param driver: an initialized webdriver with the page loaded
+    :param selector: a CSS selector or XPath matching the elements of the region
+    :return: the HTML of every matching element joined together
+    """
+    return driver.execute_script(_REGION_HTML_SCRIPT, selector)
+
+
+def install_stock_poller(driver, config):
+    """Starts polling for stock changes from inside the page loaded in the webdriver's current tab, replacing
+    any poller already running in it. The poller stops when the page is navigated away from or reloaded.
+
+    :param driver: an initialized webdriver with the page the poller runs in loaded
+    :param config: a dictionary of how to poll:
+        "source": "page" to download and read listing pages, "api" to download a JSON availability API
+        "urls": the URLs downloaded in each poll
+        "intervalMs": milliseconds from the end of one poll to the start of the next
+        "listingSelector", "fields" and "keyField": for "page", how to read each listing and the field naming it
+        "itemsKey" and "skuKey": for "api", the response's list of items and the key of each item's SKU
+    """
+    driver.execute_script(_STOCK_POLLER_SCRIPT, config)
+
+
+def collect_stock_deltas(driver):
+    """Takes the changes the poller in the webdriver's current tab has queued since the last call
+
+    :param driver: an initialized webdriver with a poller installed in its current tab
+    :return: a list of deltas, oldest first, None if the poller is gone, e.g. the page reloaded. Each delta is
+        a dictionary of "changed", every listing or API item that is new or different by its key, "removed",
+        the keys no longer there, and "detected_at", the Unix time of the poll. A failed poll, after which the
+        poller stops, is queued as a dictionary of "error", "status", "retry_after" and "title" instead.
+    """
+    return driver.execute_script(_COLLECT_DELTAS_SCRIPT)
@@ -0,0 +1,93 @@
+"""This module contains the circuit breakers that stop scanning a vendor while it keeps failing
+
+A vendor's breaker is closed while its scans work. After failure_threshold failed scans in a row it opens,
+and the vendor is skipped for open_seconds, doubling each time it opens again without a scan working in
+between, up to max_open_seconds. Once that is over the breaker is half open: the next scan is a trial that
+closes it if it works, and opens it again for longer if it fails. A broken vendor therefore costs a trial
+scan every few minutes instead of a worker and a webdriver every interval, and never delays the others.
+
+Classes:
+    CircuitBreaker
+"""
+
+import time
+from scraping.metrics import circuit_state, circuit_opens
+
+
+# Failed scans in a row that open a vendor's breaker
+failure_threshold = 3
+# Seconds a breaker stays open the first time, doubling each time it opens again in a row
+open_seconds = 60
+max_open_seconds = 1800
+
+CLOSED = "closed"
+HALF_OPEN = "half open"
+OPEN = "open"
+
+# The values published for each state
+_state_values = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Counts a vendor's failed scans in a row and decides when the vendor is worth scanning again.
+    Not thread-safe on its own: the Scheduler only uses it with its lock held.
+    """
+
+    def __init__(self, vendor_name):
+        """
+        :param vendor_name: the vendor the breaker is for
+        """
+        self.vendor_name = vendor_name
+        self.state = CLOSED
+        # The time.monotonic() an open breaker turns half open
+        self.open_until = 0
+        self._failures_in_a_row = 0
+        self._opens_in_a_row = 0
+        self._set_state(CLOSED)
+
+    def check(self, now=None):
+        """Turns an open breaker half open once its time is up
+
+        :param now: the current time.monotonic(), read if not given
+        :return: the breaker's state, CLOSED, HALF_OPEN or OPEN
+        """
+        now = time.monotonic() if now is None else now
+        if self.state == OPEN and now >= self.open_until:
+            self._set_state(HALF_OPEN)
+        return self.state
+
+    def record_success(self):
+        """Closes the breaker after a scan that worked"""
+        if self.state != CLOSED:
+            print(f"{self.vendor_name} is working again, scanning it on its schedule.")
+        self._failures_in_a_row = 0
+        self._opens_in_a_row = 0
+        self.open_until = 0
+        self._set_state(CLOSED)
+
+    def record_failure(self, now=None):
+        """Counts a failed scan, opening the breaker after failure_threshold in a row or a failed trial
+
+        :param now: the current time.monotonic(), read if not given
+        :return: the seconds the breaker is open for, 0 if it is not open
+        """
+        now = time.monotonic() if now is None else now
+        self._failures_in_a_row += 1
+        if self.state == OPEN:
+            # A scan that started before the breaker opened
+            return max(0, self.open_until - now)
+        if self.state == CLOSED and self._failures_in_a_row < failure_threshold:
+            return 0
+
+        seconds = min(max_open_seconds, open_seconds * 2 ** self._opens_in_a_row)
+        self._opens_in_a_row += 1
+        self.open_until = now + seconds
+        self._set_state(OPEN)
+        circuit_opens.inc(self.vendor_name)
+        print(f"{self.vendor_name} failed {self._failures_in_a_row} scans in a row, "
+              f"skipping it for {seconds:.0f} seconds.")
+        return seconds
+
+    def _set_state(self, state):
+        self.state = state
+        circuit_state.set(_state_values[state], self.vendor_name)
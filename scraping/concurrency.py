@@ -0,0 +1,193 @@
+"""This module contains the functions necessary to scrape several vendors at the same time
+
+Functions:
+    scrape_all_vendors()
+    scrape_on_schedule()
+    scrape_vendor_with_driver()
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+from scraping.scraping_functions import scrape_vendors, scrape_vendor_http, scrape_vendor_api, report_stock
+from scraping.readiness import RateLimited
+from scraping.circuit_breaker import OPEN
+from scraping.metrics import record_scan, record_partial_error
+
+
+# Longest wait, in seconds, before checking again for due vendors while a worker is free. Vendors can become
+# active at any time when running sharded, so the next deadline alone is not enough.
+idle_poll_interval = 1
+
+
+def scrape_all_vendors(vendors_to_scrape, watch_index, last_observations, pool, max_workers=1, errors=None):
+    """Scrapes every vendor in vendors_to_scrape, up to max_workers vendors at a time.
+    Each worker borrows a webdriver from the pool, so at most pool.size browsers run at once.
+
+    :param vendors_to_scrape: a dictionary of vendor names and their listing page URLs, from watches.vendor_urls()
+    :param watch_index: a WatchIndex of every watch, to alert on
+    :param last_observations: each vendor's observations from the previous scan, keyed by vendor name then SKU
+    :param pool: a DriverPool shared across scans
+    :param max_workers: the maximum number of vendors to scrape concurrently
+    :param errors: if given, a dictionary filled with the name of each vendor that failed and its exception
+    :return: a dictionary of vendor names and their new observations, to be merged into last_observations
+    """
+    max_workers = max(1, min(max_workers, len(vendors_to_scrape)))
+
+    # Workers only read their own vendor's previous observations, so each gets a snapshot rather than the live dict
+    previous_observations = dict(last_observations)
+
+    new_observations = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            vendor_name: executor.submit(scrape_vendor_with_driver, vendor_name, URLs, pool, watch_index,
+                                         previous_observations)
+            for vendor_name, URLs in vendors_to_scrape.items()
+        }
+        # Results are merged back in vendors_to_scrape order, regardless of which vendor finished first
+        for vendor_name, future in futures.items():
+            try:
+                new_observations[vendor_name] = future.result()
+            except Exception as e:
+                print(f"Error scraping {vendor_name}: {e}")
+                if errors is not None:
+                    errors[vendor_name] = e
+
+    return new_observations
+
+
+def scrape_on_schedule(vendors_to_scrape, watch_index, last_observations, pool, scheduler, on_scan_finished,
+                       max_workers=1):
+    """Scrapes each vendor whenever the scheduler says it is due, up to max_workers vendors at a time. Runs forever.
+    A vendor is never scraped twice at once, and a slow vendor does not hold up the others.
+
+    :param vendors_to_scrape: a dictionary of vendor names and their listing page URLs, from watches.vendor_urls()
+    :param watch_index: a WatchIndex of every watch, to alert on. None to leave alerting to on_scan_finished.
+    :param last_observations: each vendor's observations from the previous scan, keyed by vendor name then SKU.
+        Updated as each vendor finishes.
+    :param pool: a DriverPool shared across scans
+    :param scheduler: a Scheduler with a VendorSchedule for every vendor in vendors_to_scrape
+    :param on_scan_finished: called with (vendor_name, observations) after each successful scan
+    :param max_workers: the maximum number of vendors to scrape concurrently
+    """
+    max_workers = max(1, min(max_workers, len(vendors_to_scrape)))
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            # Only as many vendors as there are free workers are started, so a due vendor that has to wait
+            # keeps its place by priority instead of queueing behind vendors that became due after it
+            for vendor_name in scheduler.due_vendors():
+                if len(running) >= max_workers:
+                    break
+                running_vendors = [vendor for vendor, _ in running.values()]
+                if vendor_name in running_vendors:
+                    continue
+                scheduler.start_scan(vendor_name)
+                future = executor.submit(scrape_vendor_with_driver, vendor_name, vendors_to_scrape[vendor_name],
+                                         pool, watch_index, last_observations)
+                running[future] = (vendor_name, time.monotonic())
+
+            timeout = None
+            if len(running) < max_workers:
+                timeout = scheduler.seconds_until_next_due(exclude=[vendor for vendor, _ in running.values()])
+                timeout = idle_poll_interval if timeout is None else min(timeout, idle_poll_interval)
+            if len(running) == 0:
+                time.sleep(timeout)
+                continue
+            finished, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                vendor_name, started_at = running.pop(future)
+                try:
+                    observations = future.result()
+                except Exception as e:
+                    print(f"Error scraping {vendor_name}: {e}")
+                    interval = scheduler.record_scan(vendor_name, started_at, error=True,
+                                                     rate_limited=isinstance(e, RateLimited))
+                else:
+                    last_observations[vendor_name] = observations
+                    try:
+                        on_scan_finished(vendor_name, observations)
+                    except Exception as e:
+                        # e.g. the observation store failing, which must not stop every other vendor being scanned
+                        print(f"Error recording {vendor_name} scan: {e}")
+                    found_stock = any(observation.in_stock for observation in observations.values())
+                    interval = scheduler.record_scan(vendor_name, started_at, found_stock=found_stock)
+                next_scan_in = max(0, started_at + interval - time.monotonic())
+                if scheduler.breaker_state(vendor_name) == OPEN:
+                    print(f"Next {vendor_name} scan in {next_scan_in:.0f} seconds, its circuit breaker is open.")
+                else:
+                    print(f"Next {vendor_name} scan in {next_scan_in:.0f} seconds.")
+
+
+def scrape_vendor_with_driver(vendor_name, URLs, pool, watch_index, last_observations):
+    """Scrapes every listing page of a single vendor through its availability API or over plain HTTP if it supports
+    either. Pages that cannot be read that way share one webdriver borrowed from the pool, returned once they are all
+    scraped. A page that fails keeps its previous results without failing the others, and the vendor only fails if
+    every page did. Alerts on anything new once the whole vendor has been scraped.
+
+    :param vendor_name: a given vendor name, specified in main.py
+    :param URLs: the vendor's distinct listing page URLs
+    :param pool: a DriverPool shared between workers
+    :param watch_index: a WatchIndex of every watch, to alert on. None to leave alerting to the caller,
+        e.g. a sharded worker that reports its observations to the leader instead.
+    :param last_observations: each vendor's observations from the previous scan, keyed by vendor name then SKU
+    :return: the observations for vendor_name, keyed by SKU
+    :raises Exception: the first page's error, if every page failed
+    """
+    previous_observations = last_observations.get(vendor_name, {})
+    with record_scan(vendor_name) as scan:
+        page_observations = {}
+        page_errors = {}
+        # Each page is read the cheapest way that works: the vendor's availability API, then plain HTTP
+        browser_URLs = []
+        for URL in URLs:
+            try:
+                observations = scrape_vendor_api(vendor_name, URL, previous_observations)
+                if observations is None:
+                    observations = scrape_vendor_http(vendor_name, URL, previous_observations)
+            except RateLimited:
+                # The whole vendor backs off, rather than trying its other pages
+                raise
+            except Exception as e:
+                page_errors[URL] = e
+                continue
+            if observations is None:
+                browser_URLs.append(URL)
+            else:
+                page_observations[URL] = observations
+
+        if len(browser_URLs) != 0:
+            try:
+                with pool.lease() as driver:
+                    scan.watch_driver(driver)
+                    for URL in browser_URLs:
+                        page_observations[URL] = scrape_vendors(vendor_name, URL, driver, previous_observations)
+            except RateLimited:
+                raise
+            except Exception as e:
+                # The webdriver may be left in an unknown state, so the lease hands it back to be recycled, and
+                # the pages it had not read yet fail with the one that raised
+                for URL in browser_URLs:
+                    if URL not in page_observations:
+                        page_errors[URL] = e
+
+        if len(page_errors) == len(URLs):
+            raise next(iter(page_errors.values()))
+        for URL, e in page_errors.items():
+            print(f"Error scraping {vendor_name} page {URL}, keeping its previous results: {e}")
+            record_partial_error(vendor_name, "page")
+
+        # Items on a page that was not ready or failed keep their previous results until it can be read again
+        if len(page_errors) != 0 or any(observations is None for observations in page_observations.values()):
+            observations = dict(previous_observations)
+        else:
+            observations = {}
+        for new_observations in page_observations.values():
+            if new_observations is not None:
+                observations.update(new_observations)
+
+        if watch_index is not None:
+            report_stock(watch_index, vendor_name, observations, previous_observations)
+        scan.observations = observations
+    return observations
@@ -0,0 +1,299 @@
+"""This module contains the coordination that lets several scraper processes share the vendors between them
+
+When running sharded, every worker process takes leases on a share of the vendors and only scans those, so no
+vendor is scanned by two workers and each vendor's request rate is still set by its one schedule. Workers
+report their observations through the coordination backend, and exactly one of them, the leader, diffs them
+against the previous scans, stores them and sends the alerts, so alerts are deduplicated in one place. A report
+is only removed once the leader has handled it, so one that fails is retried rather than lost.
+
+Leases last lease_seconds and are renewed by a heartbeat three times per lease. The vendors of a worker that
+stops heartbeating are leased to the others once its leases expire, and another worker takes over as leader
+the same way. Vendors are rebalanced as workers join and leave.
+
+The default backend is a SQLite database that every worker opens, which works for any number of processes or
+containers on one machine sharing a volume. Workers on several hosts need a backend implementing Coordinator
+on a shared server instead, since SQLite locking is not reliable over network filesystems.
+
+Classes:
+    Coordinator
+    SQLiteCoordinator
+    ShardedWorker
+
+Functions:
+    default_worker_id()
+"""
+
+from contextlib import closing
+import json
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+from scraping.stock_records import observation_to_json, observation_from_json
+
+
+# Coordination database file, overridable with the COORDINATION_DB environment variable. Not sharded if not set.
+coordination_db_path = os.getenv("COORDINATION_DB")
+
+# Seconds a lease lasts without being renewed, so how long a failed worker's vendors wait for another worker
+lease_seconds = 30
+# Seconds between the leader's checks for reported observations
+report_poll_interval = 1
+# Times the leader tries to handle a report before giving up on it, so one bad report can't hold up the rest
+max_report_attempts = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shard_leases (
+    shard TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leader (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    worker_id TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    vendor TEXT NOT NULL,
+    observed_at REAL NOT NULL,
+    observations TEXT NOT NULL
+);
+"""
+
+
+class Coordinator:
+    """The operations a coordination backend provides. Each one must be atomic across every worker."""
+
+    def heartbeat(self, worker_id, shards, lease_seconds=lease_seconds):
+        """Marks a worker as alive, renews its leases, takes or gives up shards so every live worker has its
+        share, and takes the leader lease if no live worker holds it
+
+        :param worker_id: the calling worker's unique name
+        :param shards: every shard, e.g. every vendor name, the same list on every worker
+        :param lease_seconds: how long the leases taken or renewed last
+        :return: (the shards now leased to the worker, True if the worker is the leader)
+        """
+        raise NotImplementedError
+
+    def report(self, worker_id, vendor_name, observations, observed_at=None):
+        """Queues a scan's observations for the leader
+
+        :param worker_id: the reporting worker's unique name
+        :param vendor_name: the vendor that was scanned
+        :param observations: the scan's observations, keyed by SKU
+        :param observed_at: the scan's Unix timestamp, now if not given
+        """
+        raise NotImplementedError
+
+    def pending_reports(self, limit=100):
+        """Returns the oldest queued reports, leaving them queued until acknowledge_report(). Only the leader should
+        call this.
+
+        :param limit: the most reports to return
+        :return: a list of (report_id, vendor_name, observations keyed by SKU, observed_at), oldest first
+        """
+        raise NotImplementedError
+
+    def acknowledge_report(self, report_id):
+        """Removes a report the leader has handled from the queue
+
+        :param report_id: the report's id, from pending_reports()
+        """
+        raise NotImplementedError
+
+    def release(self, worker_id):
+        """Gives up a worker's leases straight away, e.g. on a clean shutdown, so others need not wait for them to expire"""
+        raise NotImplementedError
+
+
+class SQLiteCoordinator(Coordinator):
+    """Coordinates workers through a SQLite database file they all open"""
+
+    def __init__(self, path=coordination_db_path):
+        """
+        :param path: the SQLite database file, created if it does not exist
+        """
+        self.path = path
+        with closing(self._connect()) as connection:
+            connection.executescript(_SCHEMA)
+
+    def heartbeat(self, worker_id, shards, lease_seconds=lease_seconds):
+        now = time.time()
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("INSERT OR REPLACE INTO workers (worker_id, heartbeat_at) VALUES (?, ?)",
+                                   (worker_id, now))
+                connection.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - lease_seconds,))
+                connection.execute("DELETE FROM shard_leases WHERE expires_at < ?", (now,))
+                live_workers = [row[0] for row in connection.execute("SELECT worker_id FROM workers")]
+                leases = dict(connection.execute("SELECT shard, worker_id FROM shard_leases"))
+
+                # Every live worker computes the same share, so shards given up here are taken by the worker
+                # that is short of its share on its next heartbeat
+                fair_share = math.ceil(len(shards) / len(live_workers))
+                leased = [shard for shard in shards if leases.get(shard) == worker_id]
+                for shard in leased[fair_share:]:
+                    connection.execute("DELETE FROM shard_leases WHERE shard = ?", (shard,))
+                leased = leased[:fair_share]
+                free_shards = [shard for shard in shards if shard not in leases]
+                leased += free_shards[:max(0, fair_share - len(leased))]
+                leased = [shard for shard in shards if shard in leased]
+                connection.executemany(
+                    "INSERT OR REPLACE INTO shard_leases (shard, worker_id, expires_at) VALUES (?, ?, ?)",
+                    [(shard, worker_id, now + lease_seconds) for shard in leased])
+
+                leader = connection.execute("SELECT worker_id, expires_at FROM leader WHERE id = 0").fetchone()
+                is_leader = leader is None or leader[0] == worker_id or leader[1] < now
+                if is_leader:
+                    connection.execute("INSERT OR REPLACE INTO leader (id, worker_id, expires_at) VALUES (0, ?, ?)",
+                                       (worker_id, now + lease_seconds))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return leased, is_leader
+
+    def report(self, worker_id, vendor_name, observations, observed_at=None):
+        observed_at = time.time() if observed_at is None else observed_at
+        observations_json = json.dumps([observation_to_json(observation) for observation in observations.values()])
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "INSERT INTO reports (worker_id, vendor, observed_at, observations) VALUES (?, ?, ?, ?)",
+                (worker_id, vendor_name, observed_at, observations_json))
+
+    def pending_reports(self, limit=100):
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT id, vendor, observed_at, observations FROM reports ORDER BY id LIMIT ?", (limit,)).fetchall()
+        reports = []
+        for report_id, vendor_name, observed_at, observations_json in rows:
+            observations = [observation_from_json(observation) for observation in json.loads(observations_json)]
+            reports.append((report_id, vendor_name, {observation.sku: observation for observation in observations},
+                            observed_at))
+        return reports
+
+    def acknowledge_report(self, report_id):
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM reports WHERE id = ?", (report_id,))
+
+    def release(self, worker_id):
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM shard_leases WHERE worker_id = ?", (worker_id,))
+            connection.execute("DELETE FROM leader WHERE worker_id = ?", (worker_id,))
+            connection.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+            connection.execute("COMMIT")
+
+    def _connect(self):
+        # Transactions are started explicitly, so a heartbeat reads and writes the leases as one
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+
+class ShardedWorker:
+    """Keeps a worker's leases renewed from a background thread, and handles reports while it is the leader"""
+
+    def __init__(self, coordinator, worker_id, shards, on_shards_changed, on_leadership_changed, on_report):
+        """
+        :param coordinator: a Coordinator shared with the other workers
+        :param worker_id: this worker's unique name, e.g. from default_worker_id()
+        :param shards: every vendor name, the same list on every worker
+        :param on_shards_changed: called with the list of vendor names this worker now holds leases on
+        :param on_leadership_changed: called with True when this worker becomes the leader, False when it stops being it
+        :param on_report: called by the leader with (vendor_name, observations, observed_at) for each reported scan
+        """
+        self.coordinator = coordinator
+        self.worker_id = worker_id
+        self.shards = list(shards)
+        self.leased_shards = []
+        self.is_leader = False
+        self._leader_until = 0
+        self._leases_until = 0
+        self._on_shards_changed = on_shards_changed
+        self._on_leadership_changed = on_leadership_changed
+        self._on_report = on_report
+        # Failed attempts at each report still queued, keyed by report id
+        self._report_failures = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run_forever, name="sharded-worker", daemon=True)
+
+    def start(self):
+        """Takes this worker's first leases before returning, then keeps them renewed in the background"""
+        self._heartbeat()
+        self._thread.start()
+
+    def stop(self):
+        """Stops renewing leases and gives them up"""
+        self._stopped.set()
+        self._thread.join()
+        self.coordinator.release(self.worker_id)
+
+    def report(self, vendor_name, observations):
+        """Sends a finished scan's observations to the leader"""
+        self.coordinator.report(self.worker_id, vendor_name, observations)
+
+    def _run_forever(self):
+        next_heartbeat = time.monotonic() + lease_seconds / 3
+        while not self._stopped.wait(report_poll_interval):
+            try:
+                if time.monotonic() >= next_heartbeat:
+                    next_heartbeat = time.monotonic() + lease_seconds / 3
+                    self._heartbeat()
+                # A leader that could not renew its lease stops handling reports once another worker may have taken over
+                if self.is_leader and time.monotonic() < self._leader_until:
+                    self._handle_reports()
+            except Exception as e:
+                # A locked or unreachable backend is retried on the next round, while the leases still hold.
+                # Once they have expired other workers may have taken the vendors, so they are no longer scanned here.
+                print(f"Error coordinating with other workers: {e}")
+                if time.monotonic() >= self._leases_until and len(self.leased_shards) != 0:
+                    self.leased_shards = []
+                    self._on_shards_changed([])
+
+    def _handle_reports(self):
+        """Hands each queued report to on_report, oldest first, removing it from the queue once handled.
+        A report that fails is left with the ones after it for the next round, unless it failed too often."""
+        for report_id, vendor_name, observations, observed_at in self.coordinator.pending_reports():
+            try:
+                self._on_report(vendor_name, observations, observed_at)
+            except Exception as e:
+                failures = self._report_failures.get(report_id, 0) + 1
+                if failures < max_report_attempts:
+                    self._report_failures[report_id] = failures
+                    print(f"Error handling {vendor_name} report, retrying it: {e}")
+                    return
+                print(f"Error handling {vendor_name} report, giving up on it after {failures} attempts: {e}")
+            self.coordinator.acknowledge_report(report_id)
+            self._report_failures.pop(report_id, None)
+
+    def _heartbeat(self):
+        renewed_at = time.monotonic()
+        leased_shards, is_leader = self.coordinator.heartbeat(self.worker_id, self.shards, lease_seconds)
+        self._leases_until = renewed_at + lease_seconds
+        if is_leader:
+            self._leader_until = renewed_at + lease_seconds
+        if leased_shards != self.leased_shards:
+            self.leased_shards = leased_shards
+            print(f"Worker {self.worker_id} now scanning: {', '.join(leased_shards) or 'nothing'}")
+            self._on_shards_changed(leased_shards)
+        if is_leader != self.is_leader:
+            self.is_leader = is_leader
+            print(f"Worker {self.worker_id} {'is now' if is_leader else 'is no longer'} the leader")
+            self._on_leadership_changed(is_leader)
+
+
+def default_worker_id():
+    """Names this worker after its host and process, unique on every machine, overridable with WORKER_ID"""
+    return os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+
@@ -0,0 +1,164 @@
+"""This module contains the functions necessary to load several product pages from the same vendor at once
+
+Vendors like Memory Express and Canada Computers only show store inventory on each product's own page.
+Instead of loading those pages one after another, they are loaded side by side, either in extra tabs of
+the vendor's webdriver or over plain HTTP, with at most max_detail_pages_per_host pages per host in flight.
+Each page still waits its turn under the host's rate limit in rate_limits.
+
+A product page that fails is skipped without losing the pages that worked, and returned so its item can keep its
+previous results. Only a rate limit, or every page failing, fails the whole batch.
+
+Functions:
+    scrape_detail_pages_in_tabs()
+    scrape_detail_pages_http()
+    host_semaphore()
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import threading
+from scraping.http_fetch import fetch_response, parse_response
+from scraping.metrics import record_partial_error
+from scraping.page_cache import page_cache
+from scraping.rate_limits import wait_for_turn
+from scraping.readiness import RateLimited
+
+
+# Most product pages loaded from a single vendor at the same time, across all workers
+max_detail_pages_per_host = 4
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+# Held while a worker takes a whole batch of slots, so two workers never each hold part of what they need
+_batch_acquire_lock = threading.Lock()
+
+
+def host_semaphore(URL):
+    """Returns the semaphore limiting how many pages are loaded from URL's host at once
+
+    :param URL: any URL on the host
+    :return: a threading.BoundedSemaphore shared by every worker
+    """
+    host = urlparse(URL).netloc.lower()
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(max_detail_pages_per_host)
+        return _host_semaphores[host]
+
+
+def scrape_detail_pages_in_tabs(driver, URLs, parse_page, vendor_name):
+    """Loads product pages in batches of new tabs so the browser fetches them in parallel,
+    then parses each tab in turn and closes it
+
+    :param driver: an initialized webdriver, left on its original tab when done
+    :param URLs: the product page URLs to scrape
+    :param parse_page: a function taking (driver, URL) while the product page is the current tab and
+        returning a stock dictionary for that page
+    :param vendor_name: the vendor the pages belong to
+    :return: (stock_dict, unread_URLs), where stock_dict combines every page that could be read, in the order of
+        URLs, and unread_URLs lists the pages that were skipped
+    :raises RateLimited: if any page is rate limited
+    :raises Exception: the first page's error, if every page failed
+    """
+    stock_dict = {}
+    if len(URLs) == 0:
+        return stock_dict, []
+
+    page_errors = {}
+    original_tab = driver.current_window_handle
+    for batch_start in range(0, len(URLs), max_detail_pages_per_host):
+        batch = URLs[batch_start:batch_start + max_detail_pages_per_host]
+        semaphores = [host_semaphore(URL) for URL in batch]
+        with _batch_acquire_lock:
+            for semaphore in semaphores:
+                semaphore.acquire()
+        try:
+            # Every tab starts loading before any of them is read
+            tabs = []
+            for URL in batch:
+                wait_for_turn(URL)
+                open_tabs = set(driver.window_handles)
+                driver.execute_script("window.open(arguments[0], '_blank');", URL)
+                new_tab = [tab for tab in driver.window_handles if tab not in open_tabs][0]
+                tabs.append((URL, new_tab))
+                if hasattr(driver, "pages_loaded"):
+                    driver.pages_loaded += 1
+
+            for URL, tab in tabs:
+                driver.switch_to.window(tab)
+                try:
+                    stock_dict.update(parse_page(driver, URL))
+                except RateLimited:
+                    raise
+                except Exception as e:
+                    page_errors[URL] = e
+                finally:
+                    driver.close()
+        finally:
+            for semaphore in semaphores:
+                semaphore.release()
+            driver.switch_to.window(original_tab)
+
+    _skip_failed_pages(vendor_name, URLs, page_errors)
+    return stock_dict, list(page_errors)
+
+
+def scrape_detail_pages_http(URLs, parse_page, vendor_name, use_cache=False):
+    """Downloads product pages in parallel without a browser and parses each one
+
+    :param URLs: the product page URLs to scrape
+    :param parse_page: a function taking (tree, URL) for a downloaded product page and
+        returning a stock dictionary for that page
+    :param vendor_name: the vendor the pages belong to
+    :param use_cache: if True, pages are requested conditionally and a 304 reuses the last parsed result
+    :return: (stock_dict, unread_URLs), where stock_dict combines every page that could be read, in the order of
+        URLs, and unread_URLs lists the pages that were skipped
+    :raises RateLimited: if any page is rate limited
+    :raises Exception: the first page's error, if every page failed
+    """
+    stock_dict = {}
+    if len(URLs) == 0:
+        return stock_dict, []
+
+    def fetch_and_parse(URL):
+        try:
+            return parse(URL), None
+        except RateLimited:
+            raise
+        except Exception as e:
+            return {}, e
+
+    def parse(URL):
+        cached_page = page_cache.get(URL) if use_cache else None
+        headers = page_cache.conditional_headers(URL) if use_cache else None
+        with host_semaphore(URL):
+            response = fetch_response(URL, headers=headers)
+        if response.status_code == 304 and cached_page is not None:
+            return cached_page.stock_dict
+
+        page_stock_dict = parse_page(parse_response(response), URL)
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if use_cache and (etag is not None or last_modified is not None):
+            page_cache.store(URL, None, page_stock_dict, etag, last_modified)
+        return page_stock_dict
+
+    page_errors = {}
+    with ThreadPoolExecutor(max_workers=min(len(URLs), max_detail_pages_per_host)) as executor:
+        # map() returns results in the order of URLs, whichever page finishes first
+        for URL, (page_stock_dict, e) in zip(URLs, executor.map(fetch_and_parse, URLs)):
+            stock_dict.update(page_stock_dict)
+            if e is not None:
+                page_errors[URL] = e
+
+    _skip_failed_pages(vendor_name, URLs, page_errors)
+    return stock_dict, list(page_errors)
+
+
+def _skip_failed_pages(vendor_name, URLs, page_errors):
+    """Reports the product pages that were skipped, or raises the first error if none of them could be read"""
+    if len(page_errors) == len(URLs):
+        raise next(iter(page_errors.values()))
+    for URL, e in page_errors.items():
+        print(f"Skipped {vendor_name} product page {URL}: {e}")
+        record_partial_error(vendor_name, "product page")
@@ -0,0 +1,204 @@
+"""This module contains a pool of long-lived webdrivers that are reused across scans
+
+Browsers are kept warm between scans and recycled after too many page loads, once their memory use
+grows past a limit, or after a crash. Recycling always reaps chromedriver and every Chrome child process.
+
+Classes:
+    DriverPool
+"""
+
+from contextlib import contextmanager
+import queue
+import threading
+from selenium.common.exceptions import WebDriverException
+from scraping.scraping_functions import initialize_webdriver
+from scraping.rate_limits import next_browser_proxy
+from scraping.metrics import count_webdriver_commands
+
+
+# Defaults for when a browser is replaced by a fresh one
+max_pages_per_driver = 200
+max_rss_mb_per_driver = 1500
+
+
+class DriverPool:
+    """A bounded pool of webdrivers shared between scans and scraping workers"""
+
+    def __init__(self, size=1, max_pages=max_pages_per_driver, max_rss_mb=max_rss_mb_per_driver):
+        """
+        :param size: the maximum number of webdrivers alive at once
+        :param max_pages: the number of page loads after which a webdriver is recycled
+        :param max_rss_mb: the combined chromedriver and Chrome memory, in MB, after which a webdriver is recycled
+        """
+        self.size = size
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    @contextmanager
+    def lease(self):
+        """Lends a webdriver for the duration of a with block. The webdriver is recycled if the block raises
+        a WebDriverException, since the browser may have crashed or be left in an unknown state.
+        """
+        driver = self.acquire()
+        try:
+            yield driver
+        except WebDriverException:
+            self.release(driver, healthy=False)
+            raise
+        except BaseException:
+            self.release(driver)
+            raise
+        else:
+            self.release(driver)
+
+    def acquire(self):
+        """Takes an idle, healthy webdriver from the pool, starting a new one if the pool is not yet full.
+        Blocks while every webdriver is lent out.
+
+        :return: an initialized webdriver
+        """
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = self._start_driver_if_room()
+                if driver is None:
+                    driver = self._idle.get()
+            if driver is None:
+                # A recycled webdriver freed up a slot
+                continue
+
+            if self._is_healthy(driver):
+                return driver
+            self._recycle(driver)
+
+    def release(self, driver, healthy=True):
+        """Returns a lent webdriver to the pool, recycling it if it crashed or has reached its limits
+
+        :param driver: a webdriver previously returned by acquire()
+        :param healthy: False if the webdriver raised an error while it was lent out
+        """
+        if self._closed or not healthy or self._needs_recycling(driver):
+            self._recycle(driver)
+            # Wakes up a worker waiting in acquire() so it can start a replacement
+            self._idle.put(None)
+        else:
+            self._idle.put(driver)
+
+    def close(self):
+        """Quits every idle webdriver and reaps its processes. Lent webdrivers are reaped on release."""
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if driver is not None:
+                self._recycle(driver)
+
+    def _start_driver_if_room(self):
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        try:
+            driver = initialize_webdriver(next_browser_proxy())
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        self._count_page_loads(driver)
+        count_webdriver_commands(driver)
+        return driver
+
+    def _count_page_loads(self, driver):
+        """Wraps driver.get so the pool knows how many pages each webdriver has loaded.
+        Code that loads pages some other way, like opening tabs, adds to driver.pages_loaded itself.
+        """
+        driver.pages_loaded = 0
+        original_get = driver.get
+
+        def counting_get(url):
+            driver.pages_loaded += 1
+            return original_get(url)
+
+        driver.get = counting_get
+
+    def _is_healthy(self, driver):
+        try:
+            driver.current_url
+            return True
+        except WebDriverException:
+            print("Webdriver stopped responding, starting a new one.")
+            return False
+
+    def _needs_recycling(self, driver):
+        if driver.pages_loaded >= self.max_pages:
+            return True
+        rss_mb = _rss_mb(driver)
+        if rss_mb >= self.max_rss_mb:
+            print(f"Webdriver using {rss_mb:.0f} MB, starting a new one.")
+            return True
+        return False
+
+    def _recycle(self, driver):
+        """Quits a webdriver and makes sure chromedriver and all Chrome processes under it have exited"""
+        import psutil
+
+        processes = _process_tree(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+        for process in processes:
+            try:
+                process.terminate()
+            except psutil.NoSuchProcess:
+                pass
+        _, still_alive = psutil.wait_procs(processes, timeout=5)
+        for process in still_alive:
+            try:
+                process.kill()
+            except psutil.NoSuchProcess:
+                pass
+
+        with self._lock:
+            self._created -= 1
+
+
+def _process_tree(driver):
+    """Finds the chromedriver process of a webdriver and every process started under it
+
+    :param driver: an initialized webdriver
+    :return: a list of psutil.Process, empty if chromedriver has already exited
+    """
+    # Imported here, like selenium.webdriver, so runs that never start a webdriver never load it
+    import psutil
+
+    try:
+        chromedriver = psutil.Process(driver.service.process.pid)
+        return [chromedriver] + chromedriver.children(recursive=True)
+    except (AttributeError, psutil.NoSuchProcess):
+        return []
+
+
+def _rss_mb(driver):
+    """Adds up the resident memory of chromedriver and every Chrome process under it
+
+    :param driver: an initialized webdriver
+    :return: the combined resident memory in MB
+    """
+    import psutil
+
+    rss = 0
+    for process in _process_tree(driver):
+        try:
+            rss += process.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss / (1024 * 1024)
@@ -0,0 +1,346 @@
+"""This module contains the hot watch, which keeps vendor pages open and reports their stock changes within seconds
+
+A scheduled scan loads a vendor's listing page and reads it from scratch every time. A hot watched vendor
+instead has each of its listing pages loaded once, in a tab of a webdriver of its own, keeping the cookies
+and any bot check the page passed. A script injected into each tab polls the vendor with fetch() every
+hot_poll_interval seconds, or as often as the host's rate limit in rate_limits.py allows, and queues only
+what changed. A background thread collects the changes every collect_interval seconds and reports the
+vendor's stock as soon as one comes in. Nothing is navigated to or rendered between changes.
+
+Listing pages rendered by the vendor's server are polled by downloading them again, and vendors whose
+availability API their own pages can call have the SKUs on their page polled through it instead. Vendors
+whose stock is only on product pages, or whose listings need JavaScript without such an API, cannot be hot
+watched and stay on their schedule.
+
+A vendor is held out of the scheduler, after any scan of it already running, while its tabs are open. When a
+poll fails, e.g. the vendor blocks it, the vendor goes back on its schedule and its tabs are loaded again after
+retry_interval seconds. Tabs are also loaded again every reload_interval seconds, to pick up new products and
+keep the session fresh.
+
+Classes:
+    PollerStopped
+    HotWatcher
+
+Functions:
+    hot_watch_source()
+"""
+
+import threading
+import time
+from scraping.availability_api import availability_clients
+from scraping.browser_extraction import extract_listings_in_browser, install_stock_poller, collect_stock_deltas
+from scraping.lean_browsing import block_vendor_requests
+from scraping.metrics import record_scan, hot_watch_changes, hot_watch_delay, hot_watch_stops
+from scraping.pagination import page_url
+from scraping.rate_limits import wait_for_turn, report_success, report_blocked, host_governor, next_browser_proxy
+from scraping.readiness import wait_until_ready, looks_rate_limited, PageNotReady, RateLimited
+from scraping.stock_records import observations_from_stock_dict, keep_unread_observations
+from scraping import scraping_functions
+from scraping.scraping_functions import initialize_webdriver, report_stock, stock_dict_from_availability, title_line
+from scraping.vendor_registry import vendor_plan
+
+
+# Seconds between the polls of each page, raised for hosts whose rate limit does not allow that many
+hot_poll_interval = 1
+# Seconds between collecting the changes queued by every page
+collect_interval = 0.25
+# Seconds a vendor is left on its schedule after its hot watch stopped, before its pages are loaded again
+retry_interval = 120
+# Seconds before a hot watched vendor's pages are loaded again
+reload_interval = 1800
+
+
+class PollerStopped(Exception):
+    """A hot watched page stopped polling, because a poll failed or the page was reloaded"""
+
+
+def hot_watch_source(plan):
+    """Works out how a vendor's own pages can poll it for stock changes
+
+    :param plan: the vendor's ExtractionPlan
+    :return: "api" to poll its availability API, "page" to download its listing pages again,
+        None if it cannot be hot watched
+    """
+    if plan is None or plan.detail_parser is not None:
+        return None
+    if plan.api_client is not None and availability_clients[plan.api_client].items_key is not None:
+        return "api"
+    if plan.http_fetch:
+        return "page"
+    return None
+
+
+class _HotTab:
+    """One listing page open in a hot watched vendor's webdriver, and the latest of what its poller reported"""
+
+    def __init__(self, URL, handle, listings_by_sku=None):
+        self.URL = URL
+        self.handle = handle
+        # For "api" pages, the listings on the page, keyed by the SKUs polled
+        self.listings_by_sku = listings_by_sku
+        # Listings by URL, or API items by SKU
+        self.entries = {}
+        # True once the first poll came in
+        self.ready = False
+
+
+class _HotVendor:
+    """A hot watched vendor's webdriver and tabs"""
+
+    def __init__(self, plan, source, URLs):
+        self.plan = plan
+        self.source = source
+        self.URLs = URLs
+        self.driver = None
+        self.tabs = []
+        self.opened_at = 0
+        self.open_at = 0
+        # The Unix time of the earliest change not reported yet, None if there is none
+        self.changed_at = None
+        self.changes = 0
+
+
+class HotWatcher:
+    """Hot watches vendors from a background thread, reporting each change to their stock as it comes in"""
+
+    def __init__(self, vendors_to_watch, watch_index, last_observations, scheduler, on_scan_finished):
+        """
+        :param vendors_to_watch: a dictionary of the vendor names to hot watch and their listing page URLs
+        :param watch_index: a WatchIndex of every watch, to alert on
+        :param last_observations: each vendor's observations from the previous scan, keyed by vendor name then
+            SKU. Updated as each change is reported.
+        :param scheduler: the Scheduler vendors are held out of while they are hot watched
+        :param on_scan_finished: called with (vendor_name, observations) after each change is reported
+        """
+        self._vendors = {}
+        for vendor_name, URLs in vendors_to_watch.items():
+            plan = vendor_plan(vendor_name)
+            source = hot_watch_source(plan)
+            if source is None:
+                print(f"{vendor_name} cannot be hot watched, scanning it on its schedule instead.")
+                continue
+            self._vendors[vendor_name] = _HotVendor(plan, source, list(URLs))
+        self._watch_index = watch_index
+        self._last_observations = last_observations
+        self._scheduler = scheduler
+        self._on_scan_finished = on_scan_finished
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._watch_forever, name="hot-watch", daemon=True)
+
+    def start(self):
+        """Starts loading and polling the vendors' pages, if any can be hot watched"""
+        if len(self._vendors) != 0:
+            self._thread.start()
+
+    def stop(self):
+        """Stops polling and closes every vendor's webdriver"""
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        for vendor in self._vendors.values():
+            _quit(vendor)
+
+    def _watch_forever(self):
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            for vendor_name, vendor in self._vendors.items():
+                if vendor.driver is None and now < vendor.open_at:
+                    continue
+                if vendor.driver is None or now - vendor.opened_at >= reload_interval:
+                    self._open(vendor_name, vendor)
+                else:
+                    self._collect(vendor_name, vendor)
+                if self._stopped.is_set():
+                    return
+            self._stopped.wait(collect_interval)
+
+    def _open(self, vendor_name, vendor):
+        """Loads every listing page of a vendor in a tab of its webdriver, starting one if it has none,
+        and starts polling them. The vendor is held out of the scheduler first, after any scan of it already
+        running, so a restock is never reported by both, and released again if the tabs can't be opened."""
+        self._scheduler.hold(vendor_name)
+        try:
+            if vendor.driver is None:
+                # Timers in the other tabs would otherwise be slowed down
+                vendor.driver = initialize_webdriver(next_browser_proxy(), background_tabs=len(vendor.URLs) > 1)
+                if scraping_functions.lean_browsing_enabled:
+                    block_vendor_requests(vendor.driver, vendor.plan.key)
+            vendor.tabs = self._load_tabs(vendor_name, vendor)
+            configs = [self._poller_config(vendor_name, vendor, tab) for tab in vendor.tabs]
+            interval = _poll_interval(configs)
+            for tab, config in zip(vendor.tabs, configs):
+                vendor.driver.switch_to.window(tab.handle)
+                install_stock_poller(vendor.driver, dict(config, intervalMs=int(interval * 1000)))
+        except Exception as e:
+            self._stop_watching(vendor_name, vendor, e)
+            return
+
+        vendor.opened_at = time.monotonic()
+        vendor.changed_at = None
+        vendor.changes = 0
+        print(f"Hot watching {vendor_name}, polling {len(vendor.tabs)} page(s) every {interval:.1f} seconds.")
+
+    def _load_tabs(self, vendor_name, vendor):
+        """Loads each of a vendor's listing pages in its own tab, reusing the tabs of a previous load
+
+        :return: a list of _HotTab, one per URL
+        """
+        driver = vendor.driver
+        handles = [tab.handle for tab in vendor.tabs] or [driver.current_window_handle]
+        tabs = []
+        for index, URL in enumerate(vendor.URLs):
+            if index < len(handles):
+                driver.switch_to.window(handles[index])
+            else:
+                open_tabs = set(driver.window_handles)
+                driver.execute_script("window.open('about:blank', '_blank');")
+                driver.switch_to.window([tab for tab in driver.window_handles if tab not in open_tabs][0])
+
+            wait_for_turn(URL)
+            try:
+                driver.get(URL)
+                wait_until_ready(driver, vendor.plan.key, *vendor.plan.ready_when)
+            except PageNotReady:
+                if looks_rate_limited(driver.title):
+                    report_blocked(URL)
+                    raise RateLimited(f"{vendor_name} showed '{driver.title}'")
+                raise
+            report_success(URL)
+
+            listings_by_sku = None
+            if vendor.source == "api":
+                listings = extract_listings_in_browser(driver, vendor.plan.listing_selector, vendor.plan.fields)
+                listings_by_sku = vendor.plan.api_skus(listings)
+                if len(listings_by_sku) == 0:
+                    raise PageNotReady(f"no {vendor_name} SKUs found on {URL}")
+            tabs.append(_HotTab(URL, driver.current_window_handle, listings_by_sku))
+        return tabs
+
+    def _poller_config(self, vendor_name, vendor, tab):
+        """Builds the configuration of a tab's poller, for install_stock_poller(), without its interval"""
+        plan = vendor.plan
+        if vendor.source == "api":
+            client = availability_clients[plan.api_client]
+            skus = list(tab.listings_by_sku)
+            return {
+                "source": "api",
+                "urls": [client.request_url(skus[batch_start:batch_start + plan.api_batch_size])
+                         for batch_start in range(0, len(skus), plan.api_batch_size)],
+                "itemsKey": client.items_key,
+                "skuKey": client.sku_key,
+            }
+
+        URLs = [tab.URL]
+        # Every page a scan could follow, since a listing only on a later page would otherwise look removed
+        if plan.paginated and plan.page_parameter is not None:
+            URLs = [page_url(tab.URL, plan.page_parameter, page_number) for page_number in range(1, plan.max_pages + 1)]
+        return {
+            "source": "page",
+            "urls": URLs,
+            "listingSelector": plan.listing_selector,
+            "fields": plan.fields,
+            "keyField": plan.item_fields["url"],
+        }
+
+    def _collect(self, vendor_name, vendor):
+        """Collects the changes every tab of a vendor queued, and reports the vendor's stock if any came in"""
+        try:
+            for tab in vendor.tabs:
+                if len(vendor.tabs) > 1:
+                    vendor.driver.switch_to.window(tab.handle)
+                deltas = collect_stock_deltas(vendor.driver)
+                if deltas is None:
+                    raise PollerStopped(f"the {vendor_name} page at {tab.URL} was reloaded")
+                for delta in deltas:
+                    if "error" in delta:
+                        raise _poll_error(vendor_name, tab, delta)
+                    tab.entries.update(delta["changed"])
+                    for key in delta["removed"]:
+                        tab.entries.pop(key, None)
+                    tab.ready = True
+                    vendor.changes += len(delta["changed"]) + len(delta["removed"])
+                    if vendor.changed_at is None or delta["detected_at"] < vendor.changed_at:
+                        vendor.changed_at = delta["detected_at"]
+
+            # The first report waits for every page's first poll, so no page's items look removed
+            if vendor.changed_at is not None and all(tab.ready for tab in vendor.tabs):
+                self._report(vendor_name, vendor)
+        except Exception as e:
+            self._stop_watching(vendor_name, vendor, e)
+
+    def _report(self, vendor_name, vendor):
+        """Reports a vendor's stock from the latest of what each of its tabs reported, as a scan would"""
+        plan = vendor.plan
+        with record_scan(vendor_name) as scan:
+            scan.path = "hot"
+            title_line(vendor_name)
+            previous_observations = self._last_observations.get(vendor_name, {})
+            if vendor.source == "api":
+                client = availability_clients[plan.api_client]
+                stock_dict = {}
+                unread_URLs = []
+                for tab in vendor.tabs:
+                    availability = client.read_items(list(tab.entries.values()))
+                    tab_stock_dict, tab_unread_URLs = stock_dict_from_availability(plan, tab.listings_by_sku,
+                                                                                   availability)
+                    stock_dict.update(tab_stock_dict)
+                    unread_URLs += tab_unread_URLs
+            else:
+                stock_dict, unread_URLs = plan.read_stock(
+                    [listing for tab in vendor.tabs for listing in tab.entries.values()])
+            observations = keep_unread_observations(observations_from_stock_dict(vendor_name, stock_dict),
+                                                    previous_observations, unread_URLs)
+            report_stock(self._watch_index, vendor_name, observations, previous_observations)
+            scan.observations = observations
+
+        hot_watch_changes.inc(vendor_name, amount=vendor.changes)
+        hot_watch_delay.observe(max(0, time.time() - vendor.changed_at), vendor_name)
+        vendor.changed_at = None
+        vendor.changes = 0
+        self._last_observations[vendor_name] = observations
+        self._on_scan_finished(vendor_name, observations)
+
+    def _stop_watching(self, vendor_name, vendor, error):
+        """Closes a vendor's webdriver and puts the vendor back on its schedule until retry_interval is over"""
+        hot_watch_stops.inc(vendor_name, "rate_limited" if isinstance(error, RateLimited) else "error")
+        print(f"Stopped hot watching {vendor_name}, scanning it on its schedule for the next "
+              f"{retry_interval} seconds: {error}")
+        _quit(vendor)
+        vendor.changed_at = None
+        vendor.changes = 0
+        vendor.open_at = time.monotonic() + retry_interval
+        self._scheduler.release(vendor_name)
+
+
+def _poll_error(vendor_name, tab, delta):
+    """Turns a failed poll into the exception it stopped the hot watch with, cooling the host down if it was blocked"""
+    blocked = delta["status"] in (429, 503) or (delta["title"] is not None and looks_rate_limited(delta["title"]))
+    if not blocked:
+        return PollerStopped(f"{vendor_name} poll failed: {delta['error']}")
+    retry_after = delta["retry_after"]
+    report_blocked(tab.URL, int(retry_after) if retry_after is not None and retry_after.isdigit() else None)
+    return RateLimited(f"{vendor_name} blocked a poll: {delta['error']}")
+
+
+def _poll_interval(configs):
+    """Works out the seconds between polls of each of a vendor's pages, every page of which polls the same host
+
+    :param configs: every page's poller configuration
+    :return: hot_poll_interval, or longer if the host's rate limit does not allow polling that often
+    """
+    requests_per_poll = sum(len(config["urls"]) for config in configs)
+    rate = host_governor(configs[0]["urls"][0]).max_rate
+    if rate is None:
+        return hot_poll_interval
+    return max(hot_poll_interval, requests_per_poll / rate)
+
+
+def _quit(vendor):
+    """Closes a vendor's webdriver, if it has one"""
+    if vendor.driver is not None:
+        try:
+            vendor.driver.quit()
+        except Exception:
+            pass
+    vendor.driver = None
+    vendor.tabs = []
@@ -0,0 +1,221 @@
+"""This module contains the functions necessary to scrape server-rendered webpages without a browser
+
+Pages are downloaded over a pooled HTTP session per thread and proxy, and parsed with lxml. Every request
+waits for its host's rate limit, and a bot check or 429 answer raises RateLimited and cools the host down.
+Vendors whose listings only appear after JavaScript runs raise PageNeedsJavaScript so the caller can fall
+back to a webdriver.
+
+Functions:
+    get_session()
+    fetch_response()
+    fetch_json()
+    parse_response()
+    fetch_page()
+    region_html()
+    extract_listings()
+    iter_listings()
+    select_elements()
+    compile_selector()
+    is_xpath()
+"""
+
+import re
+import threading
+import lxml.etree
+import lxml.html
+from lxml.cssselect import CSSSelector
+import requests
+from requests.adapters import HTTPAdapter
+from scraping.rate_limits import wait_for_turn, report_success, report_blocked, proxy_for
+from scraping.readiness import looks_rate_limited, RateLimited
+from scraping.user_agents import user_agent_for
+
+
+# Seconds to wait for a vendor to respond before giving up on the HTTP path
+request_timeout = 10
+# Response statuses that mean the vendor is turning the scraper away
+blocked_statuses = (429, 503)
+
+_thread_local = threading.local()
+_compiled_selectors = {}
+
+
+class PageNeedsJavaScript(Exception):
+    """Raised when a page fetched over HTTP is missing the content the scraper expects,
+    usually because the vendor renders it with JavaScript or served a bot check instead
+    """
+
+
+def get_session(proxy=None):
+    """Returns this thread's HTTP session for a proxy, creating it on first use.
+    Sessions keep connections and cookies for each vendor between scans.
+
+    :param proxy: the proxy URL the session's requests go through, None to connect directly
+    :return: a requests.Session
+    """
+    sessions = getattr(_thread_local, "sessions", None)
+    if sessions is None:
+        sessions = _thread_local.sessions = {}
+    session = sessions.get(proxy)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "en-CA,en;q=0.9",
+        })
+        if proxy is not None:
+            session.proxies = {"http": proxy, "https": proxy}
+        sessions[proxy] = session
+    return session
+
+
+def fetch_response(URL, headers=None):
+    """Downloads a webpage, optionally as a conditional request, with the user agent and proxy of the vendor's
+    host once its rate limit allows
+
+    :param URL: the webpage to download
+    :param headers: extra request headers, e.g. from PageCache.conditional_headers()
+    :return: the requests.Response, whose status is 200 or 304
+    :raises RateLimited: if the host is cooling down, or answered with a bot check or a blocked status
+    """
+    return _send("GET", URL, headers)
+
+
+def fetch_json(URL, body=None, headers=None):
+    """Calls a vendor's JSON API the same way fetch_response() downloads a page, as a POST if there is a body
+
+    :param URL: the API endpoint, with any query string
+    :param body: the request body as bytes, None for a GET
+    :param headers: extra request headers, e.g. a signature
+    :return: the decoded JSON response
+    :raises RateLimited: if the host is cooling down, or answered with a bot check or a blocked status
+    """
+    headers = dict({"Accept": "application/json"}, **(headers or {}))
+    return _send("GET" if body is None else "POST", URL, headers, body).json()
+
+
+def parse_response(response):
+    """Parses a downloaded webpage into an lxml tree with absolute links
+
+    :param response: a requests.Response from fetch_response()
+    :return: the root lxml.html element of the page
+    """
+    tree = lxml.html.fromstring(response.content, base_url=response.url)
+    tree.make_links_absolute(response.url)
+    return tree
+
+
+def fetch_page(URL):
+    """Downloads a webpage and parses it into an lxml tree with absolute links
+
+    :param URL: the webpage to download
+    :return: the root lxml.html element of the page
+    """
+    return parse_response(fetch_response(URL))
+
+
+def region_html(tree, selector):
+    """Serializes the part of a page a scraper reads, for hashing
+
+    :param tree: the root lxml.html element of the page
+    :param selector: a CSS selector or XPath matching the elements of the region
+    :return: the HTML of every matching element joined together
+    """
+    return "".join(lxml.html.tostring(element, encoding="unicode") for element in select_elements(tree, selector))
+
+
+def select_elements(element, selector):
+    """Finds elements below element using a CSS selector, or an XPath if the selector starts with "./", "/"
+    or "following-sibling::"
+
+    :param element: an lxml element to search from
+    :param selector: a CSS selector or XPath
+    :return: a list of matching lxml elements
+    """
+    return compile_selector(selector)(element)
+
+
+def compile_selector(selector):
+    """Compiles a CSS selector or XPath once, reusing the compiled version for every later page
+
+    :param selector: a CSS selector or XPath
+    :return: a callable taking an lxml element and returning the list of matching elements
+    """
+    compiled = _compiled_selectors.get(selector)
+    if compiled is None:
+        compiled = lxml.etree.XPath(selector) if is_xpath(selector) else CSSSelector(selector)
+        _compiled_selectors[selector] = compiled
+    return compiled
+
+
+def is_xpath(selector):
+    """Tells XPaths apart from CSS selectors in vendor field definitions"""
+    return selector.startswith(("./", "/", "following-sibling::"))
+
+
+def extract_listings(tree, listing_selector, fields):
+    """Reads every listing on a page into a dictionary of field values
+
+    :param tree: the root lxml.html element of the page
+    :param listing_selector: a CSS selector matching one element per listing
+    :param fields: a dictionary of field names to (selector, attribute) pairs. The selector is relative to
+        the listing, None for the listing itself. The attribute is "text" for the element's text.
+    :return: a list of dictionaries of field names to values, "" for fields that are missing
+    """
+    return list(iter_listings(tree, listing_selector, fields))
+
+
+def iter_listings(tree, listing_selector, fields):
+    """Reads the listings on a page one at a time, as extract_listings() does, so a caller can act on the
+    first ones before the rest are read
+
+    :return: a generator of dictionaries of field names to values
+    """
+    for listing in select_elements(tree, listing_selector):
+        values = {}
+        for field, (selector, attribute) in fields.items():
+            if selector is None:
+                elements = [listing]
+            else:
+                elements = select_elements(listing, selector)
+            if len(elements) == 0:
+                values[field] = ""
+            elif attribute == "text":
+                values[field] = " ".join(elements[0].text_content().split())
+            else:
+                values[field] = elements[0].get(attribute, "")
+        yield values
+
+
+def _send(method, URL, headers=None, body=None):
+    """Sends a request with the user agent and proxy of the vendor's host once its rate limit allows,
+    cooling the host down if it answers with a block
+    """
+    wait_for_turn(URL)
+    headers = dict(headers or {}, **{"User-Agent": user_agent_for(URL)})
+    response = get_session(proxy_for(URL)).request(method, URL, headers=headers, data=body, timeout=request_timeout)
+    if response.status_code in blocked_statuses or (response.status_code == 200
+                                                     and looks_rate_limited(_page_title(response))):
+        report_blocked(URL, _retry_after(response))
+        raise RateLimited(f"{URL} answered {response.status_code} '{_page_title(response)}'")
+    report_success(URL)
+    if response.status_code != 304:
+        response.raise_for_status()
+    return response
+
+
+def _page_title(response):
+    """Reads a response's title without parsing the page, from the start of it where the title always is"""
+    match = re.search(rb"<title[^>]*>(.*?)</title>", response.content[:16384], re.IGNORECASE | re.DOTALL)
+    if match is None:
+        return ""
+    return match.group(1).decode(response.encoding or "utf-8", errors="replace").strip()
+
+
+def _retry_after(response):
+    """Reads the seconds to wait from a Retry-After header, None if there is none or it is a date"""
+    retry_after = response.headers.get("Retry-After", "")
+    return int(retry_after) if retry_after.isdigit() else None
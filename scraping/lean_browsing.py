@@ -0,0 +1,86 @@
+"""This module contains the functions necessary to make Chrome load only what the scrapers read
+
+Vendor pages spend most of their load time on product images, web fonts, video and ad/analytics scripts,
+none of which the scrapers look at. Pages are loaded with the eager strategy (returning once the DOM is
+ready), images are disabled in Chrome's preferences, and the DevTools Network domain blocks everything
+else by URL pattern, including hosts that only slow down a particular vendor.
+
+Functions:
+    lean_chrome_options()
+    lean_capabilities()
+    enable_request_blocking()
+    block_vendor_requests()
+"""
+
+
+# Blocked for every vendor, as DevTools URL patterns
+blocked_url_patterns = [
+    # Images and icons
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico",
+    # Fonts
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    # Media
+    "*.mp4", "*.webm", "*.m3u8", "*.mp3",
+    # Third-party ads, analytics and trackers
+    "*google-analytics.com*", "*googletagmanager.com*", "*googleadservices.com*", "*doubleclick.net*",
+    "*facebook.net*", "*connect.facebook.com*", "*bing.com/bat*", "*hotjar.com*", "*criteo.com*",
+    "*criteo.net*", "*taboola.com*", "*adsrvr.org*", "*quantserve.com*", "*scorecardresearch.com*",
+    "*newrelic.com*", "*nr-data.net*", "*pinterest.com*", "*tiktok.com*", "*clarity.ms*",
+]
+
+# Extra hosts blocked per vendor, keyed by lower case vendor name. Add hosts here when a vendor's page
+# is slowed down by something the scrapers never read.
+vendor_blocked_hosts = {
+    "newegg": ["*c1.neweggimages.com*", "*promotions.newegg.ca*"],
+    "best buy": ["*multimedia.bbycastatic.ca*", "*ugc.bazaarvoice.com*", "*apps.bazaarvoice.com*", "*cdn.optimizely.com*"],
+    "memory express": ["*media.memoryexpress.com*"],
+    "canada computers": ["*ccimg.canadacomputers.com*"],
+    "amazon": ["*m.media-amazon.com/images*", "*images-na.ssl-images-amazon.com*", "*fls-na.amazon.ca*", "*aax-us-east.amazon-adsystem.com*"],
+    "pc canada": ["*images.pc-canada.com*"],
+}
+
+
+def lean_chrome_options(chromeOptions):
+    """Turns off image loading in a set of Chrome options
+
+    :param chromeOptions: the selenium Options used to start Chrome
+    """
+    chromeOptions.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.default_content_setting_values.notifications": 2,
+        "profile.managed_default_content_settings.media_stream": 2,
+    })
+    chromeOptions.add_argument("--blink-settings=imagesEnabled=false")
+    chromeOptions.add_argument("--autoplay-policy=user-gesture-required")
+
+
+def lean_capabilities():
+    """Builds Chrome capabilities that make driver.get() return once the DOM is ready,
+    without waiting for images, stylesheets and subframes
+
+    :return: a desired capabilities dictionary for webdriver.Chrome()
+    """
+    from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+
+    capabilities = DesiredCapabilities.CHROME.copy()
+    capabilities["pageLoadStrategy"] = "eager"
+    return capabilities
+
+
+def enable_request_blocking(driver):
+    """Enables the DevTools Network domain and blocks blocked_url_patterns in a new webdriver
+
+    :param driver: an initialized webdriver
+    """
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_url_patterns})
+
+
+def block_vendor_requests(driver, vendor_key):
+    """Blocks blocked_url_patterns plus the vendor's own blocklist for the next page loads
+
+    :param driver: an initialized webdriver, set up with enable_request_blocking()
+    :param vendor_key: the lower case vendor name
+    """
+    urls = blocked_url_patterns + vendor_blocked_hosts.get(vendor_key, [])
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": urls})
@@ -0,0 +1,376 @@
+"""This module contains the metrics recorded while scraping, and the ways they are published
+
+Each vendor scan records how long its page load, extraction and detail pages took, how many WebDriver
+commands it sent, whether it failed or timed out, which of its pages or listings failed on their own, and how
+many items it saw and found in stock. Each vendor's circuit breaker records its state and how often it opened.
+Notification channels record the time from stock being detected to the alert being sent, loading the
+user agent file records how long it took, and each vendor host records its request rate, how long requests
+waited for it and how often the host blocked the scraper. Hot watched vendors record the changes their pages
+saw, how long each took to be reported and why their hot watch stopped; their updates count as scans with
+the "hot" path.
+
+Metrics are served in the Prometheus text format on /metrics when the METRICS_PORT environment variable is
+set, and every scan and notification is written as a JSON line to the file named by METRICS_LOG ("-" for
+standard output) when it is set.
+
+Classes:
+    Counter
+    Gauge
+    Histogram
+    ScanRecord
+
+Functions:
+    timed()
+    record_scan()
+    record_partial_error()
+    count_webdriver_commands()
+    log_event()
+    render_metrics()
+    start_metrics_server()
+"""
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import os
+import sys
+import threading
+import time
+from scraping.readiness import RateLimited
+
+
+# Structured log file, "-" for standard output, off if not set. Overridable with the METRICS_LOG environment variable
+metrics_log_path = os.getenv("METRICS_LOG")
+
+# Histogram bucket upper bounds, in seconds
+default_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+_metrics = []
+_thread_local = threading.local()
+_log_lock = threading.Lock()
+_log_file = None
+
+
+class Counter:
+    """A count that only goes up, kept separately for each combination of label values"""
+    type_name = "counter"
+
+    def __init__(self, name, description, labels=("vendor",)):
+        """
+        :param name: the metric name, as published
+        :param description: a one line description, as published
+        :param labels: the names of the labels every value is recorded with
+        """
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        """Adds amount to the count for the given label values, in the order of self.labels"""
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_label_text(self.labels, label_values)} {_number_text(value)}"
+                for label_values, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    """A value that is replaced each time it is set, e.g. the items seen in a vendor's latest scan"""
+    type_name = "gauge"
+
+    def set(self, value, *label_values):
+        """Sets the value for the given label values, in the order of self.labels"""
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram:
+    """Counts observations, e.g. durations, into buckets, kept separately for each combination of label values"""
+    type_name = "histogram"
+
+    def __init__(self, name, description, labels=("vendor",), buckets=default_buckets):
+        """
+        :param name: the metric name, as published
+        :param description: a one line description, as published
+        :param labels: the names of the labels every observation is recorded with
+        :param buckets: the bucket upper bounds, ending with math.inf
+        """
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        """Records one observation for the given label values, in the order of self.labels"""
+        with self._lock:
+            # [bucket counts, sum, count]
+            values = self._values.setdefault(label_values, [[0] * len(self.buckets), 0, 0])
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    values[0][index] += 1
+                    break
+            values[1] += value
+            values[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = {label_values: (list(counts), total, count)
+                      for label_values, (counts, total, count) in self._values.items()}
+        lines = []
+        for label_values, (bucket_counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                bucket_labels = _label_text(self.labels + ("le",), label_values + (_number_text(upper_bound),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, label_values)} {_number_text(total)}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, label_values)} {count}")
+        return lines
+
+
+# Per vendor scan
+scrape_duration = Histogram("scraper_scan_seconds", "Time to scan a vendor, from the first request to its observations",
+                            ("vendor", "path"))
+page_load_duration = Histogram("scraper_page_load_seconds", "Time to download or load and render a listing page")
+extraction_duration = Histogram("scraper_extraction_seconds", "Time to read the listings from a loaded page, including product pages")
+detail_pages_duration = Histogram("scraper_detail_pages_seconds", "Time to scrape every product page a listing page links to")
+webdriver_commands = Counter("scraper_webdriver_commands_total", "WebDriver commands sent, each a round trip to chromedriver")
+scans = Counter("scraper_scans_total", "Vendor scans finished", ("vendor", "path"))
+scan_errors = Counter("scraper_errors_total", "Vendor scans that failed", ("vendor", "kind"))
+page_timeouts = Counter("scraper_page_timeouts_total", "Listing pages that were not ready before their timeout")
+items_seen = Gauge("scraper_items_seen", "Items in the vendor's latest scan")
+items_in_stock = Gauge("scraper_items_in_stock", "Items in stock in the vendor's latest scan")
+partial_errors = Counter("scraper_partial_errors_total",
+                         "Listing pages, product pages and listings that failed without failing the vendor's scan",
+                         ("vendor", "part"))
+circuit_state = Gauge("scraper_circuit_state", "The vendor's circuit breaker: 0 closed, 1 half open, 2 open")
+circuit_opens = Counter("scraper_circuit_opens_total", "Times the vendor's circuit breaker opened after repeated failures")
+# Per hot watched vendor
+hot_watch_changes = Counter("scraper_hot_watch_changes_total", "Listings or SKUs a hot watched page saw change")
+hot_watch_delay = Histogram("scraper_hot_watch_delay_seconds",
+                            "Time from a hot watched page seeing a change to its observations being reported",
+                            ("vendor",), (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, math.inf))
+hot_watch_stops = Counter("scraper_hot_watch_stops_total", "Hot watches that stopped, handing the vendor back to its schedule",
+                          ("vendor", "kind"))
+# Per notification channel
+notification_latency = Histogram("scraper_notification_latency_seconds",
+                                 "Time from stock being detected to the alert being sent", ("channel",))
+notification_failures = Counter("scraper_notification_failures_total", "Alerts that could not be sent", ("channel",))
+# Per vendor host
+host_request_rate = Gauge("scraper_host_request_rate", "Requests per second currently allowed to the host", ("host",))
+host_blocks = Counter("scraper_host_blocks_total", "Bot check, 429 and 503 answers from the host", ("host",))
+host_wait_duration = Histogram("scraper_host_wait_seconds", "Time requests waited for the host's rate limit", ("host",),
+                               (0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, math.inf))
+# Per process
+user_agent_load_duration = Histogram("scraper_user_agent_load_seconds", "Time to load the user agent file", (),
+                                     (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, math.inf))
+
+
+class ScanRecord:
+    """Collects one vendor scan's timings and counts, for the metrics and the structured log"""
+
+    def __init__(self, vendor_name):
+        self.vendor_name = vendor_name
+        self.path = "http"
+        self.observations = {}
+        self.stages = {}
+        self.webdriver_commands = 0
+        self.partial_errors = 0
+        self._driver = None
+        self._commands_before = 0
+
+    def watch_driver(self, driver):
+        """Counts the WebDriver commands driver sends from now until the scan ends, and marks the scan as a browser scan
+
+        :param driver: a webdriver wrapped by count_webdriver_commands()
+        """
+        self.path = "browser"
+        self._driver = driver
+        self._commands_before = getattr(driver, "commands_sent", 0)
+
+    def add_stage(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    def finish(self, seconds, observations=None, error=None):
+        """Publishes the scan once it is over
+
+        :param seconds: how long the whole scan took
+        :param observations: the scan's observations keyed by SKU, None if it failed
+        :param error: the exception the scan failed with, if it did
+        """
+        if self._driver is not None:
+            self.webdriver_commands = getattr(self._driver, "commands_sent", 0) - self._commands_before
+            webdriver_commands.inc(self.vendor_name, amount=self.webdriver_commands)
+
+        event = {"vendor": self.vendor_name, "path": self.path, "seconds": round(seconds, 3)}
+        event.update({f"{stage}_seconds": round(stage_seconds, 3) for stage, stage_seconds in self.stages.items()})
+        if self._driver is not None:
+            event["webdriver_commands"] = self.webdriver_commands
+        if self.partial_errors != 0:
+            event["partial_errors"] = self.partial_errors
+
+        if error is None:
+            scrape_duration.observe(seconds, self.vendor_name, self.path)
+            scans.inc(self.vendor_name, self.path)
+            in_stock = len([observation for observation in observations.values() if observation.in_stock])
+            items_seen.set(len(observations), self.vendor_name)
+            items_in_stock.set(in_stock, self.vendor_name)
+            event.update({"items_seen": len(observations), "items_in_stock": in_stock})
+        else:
+            kind = "rate_limited" if isinstance(error, RateLimited) else "error"
+            scan_errors.inc(self.vendor_name, kind)
+            event.update({"error": kind, "message": str(error)})
+        log_event("scan", **event)
+
+
+@contextmanager
+def timed(histogram, vendor_name):
+    """Times a with block into a histogram labelled with vendor_name, and into the current scan's stages.
+    The time is recorded even if the block raises.
+
+    :param histogram: a Histogram labelled by vendor only
+    :param vendor_name: the vendor being scanned
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        seconds = time.monotonic() - start
+        histogram.observe(seconds, vendor_name)
+        scan = getattr(_thread_local, "scan", None)
+        if scan is not None:
+            scan.add_stage(histogram.name[len("scraper_"):-len("_seconds")], seconds)
+
+
+@contextmanager
+def record_scan(vendor_name):
+    """Records a whole vendor scan. The with block sets the yielded ScanRecord's observations attribute
+    to the scan's observations; a block that raises counts as a failed scan.
+
+    :param vendor_name: the vendor being scanned
+    :return: a ScanRecord, also reachable by timed() from the same thread
+    """
+    scan = ScanRecord(vendor_name)
+    _thread_local.scan = scan
+    start = time.monotonic()
+    try:
+        yield scan
+    except Exception as e:
+        scan.finish(time.monotonic() - start, error=e)
+        raise
+    else:
+        scan.finish(time.monotonic() - start, scan.observations)
+    finally:
+        _thread_local.scan = None
+
+
+def record_partial_error(vendor_name, part):
+    """Counts a part of a vendor scan that failed without failing the rest of it, e.g. one product page
+
+    :param vendor_name: the vendor being scanned
+    :param part: what failed: "page", "product page" or "listing"
+    """
+    partial_errors.inc(vendor_name, part)
+    scan = getattr(_thread_local, "scan", None)
+    if scan is not None and scan.vendor_name == vendor_name:
+        scan.partial_errors += 1
+
+
+def count_webdriver_commands(driver):
+    """Wraps driver.execute so every command sent to chromedriver is counted in driver.commands_sent
+
+    :param driver: an initialized webdriver
+    :return: the same webdriver
+    """
+    execute = driver.execute
+    driver.commands_sent = 0
+
+    def counting_execute(driver_command, params=None):
+        driver.commands_sent += 1
+        return execute(driver_command, params)
+
+    driver.execute = counting_execute
+    return driver
+
+
+def log_event(event, **fields):
+    """Writes one JSON line to the structured log, if METRICS_LOG is set
+
+    :param event: what happened, e.g. "scan" or "notification"
+    :param fields: the event's details
+    """
+    global _log_file
+    if metrics_log_path is None:
+        return
+    line = json.dumps(dict({"time": round(time.time(), 3), "event": event}, **fields))
+    with _log_lock:
+        if _log_file is None:
+            _log_file = sys.stdout if metrics_log_path == "-" else open(metrics_log_path, "a", buffering=1)
+        _log_file.write(line + "\n")
+
+
+def render_metrics():
+    """Formats every metric in the Prometheus text exposition format
+
+    :return: the text, ending with a newline
+    """
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port):
+    """Serves render_metrics() on /metrics from a background thread
+
+    :param port: the port to listen on, on every interface
+    :return: the ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer(("", port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _label_text(labels, label_values):
+    if len(labels) == 0:
+        return ""
+    pairs = []
+    for label, value in zip(labels, label_values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{label}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number_text(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
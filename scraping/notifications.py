@@ -0,0 +1,315 @@
+"""This module contains the functions necessary to send stock alerts without holding up the scrapers
+
+Alerts are queued and sent from background threads, one per channel (beep, Discord, email), so a slow SMTP
+server never delays the next vendor's scrape. Credentials are loaded once, the SMTP connection and Discord
+webhook session are kept open between alerts, and failed sends are retried with exponential backoff.
+Alerts for the same watch from several vendors in the same scan are coalesced into one message per channel. Each channel's
+sender, and its library, is only set up by the channel's thread when its first message is sent, so a run that
+never alerts never loads discord.py, and a channel that can't be set up, e.g. without the discord package or
+DISCORD_WEBHOOK, only fails its own messages. Nothing in a channel ever raises into the scrapers.
+
+Classes:
+    NotificationDispatcher
+
+Functions:
+    get_dispatcher()
+    close_dispatcher()
+    set_enabled_channels()
+    send_email()
+    send_discord_message()
+    make_beep_noise()
+"""
+
+from email.mime.text import MIMEText
+import queue
+import smtplib
+import sys
+import threading
+import time
+import os
+import requests
+from scraping.metrics import notification_latency, notification_failures, log_event
+
+
+# Set to True to turn on, or choose with set_enabled_channels()
+discord_message_enabled = True
+email_enabled = False
+beep_enabled = True
+
+# Seconds to wait for more vendors' alerts before sending, unless the scan finishes sooner
+coalesce_window = 3
+# Attempts per message and channel, waiting 1, 2, 4... seconds between them
+max_send_attempts = 5
+
+
+class NotificationDispatcher:
+    """Collects alerts from scraping workers and sends them from background threads"""
+
+    def __init__(self):
+        self._pending = []
+        self._scan_finished = False
+        self._condition = threading.Condition()
+        self._channels = []
+        if beep_enabled:
+            self._channels.append(_Channel("beep", lambda: lambda subject, body: make_beep_noise()))
+        if discord_message_enabled:
+            self._channels.append(_Channel("discord", lambda: _DiscordSender().send))
+        if email_enabled:
+            self._channels.append(_Channel("email", lambda: _EmailSender().send))
+        self._coalescer = threading.Thread(target=self._coalesce_forever, name="notification-coalescer", daemon=True)
+        self._coalescer.start()
+
+    def submit(self, item, vendor_name, subject, email_body):
+        """Queues an alert. Returns immediately.
+
+        :param item: the name of the item being checked for
+        :param vendor_name: the vendor the stock was found at
+        :param subject: the alert's subject line
+        :param email_body: the alert's message body
+        """
+        with self._condition:
+            self._pending.append((item, vendor_name, subject, email_body, time.time()))
+            self._condition.notify()
+
+    def end_scan(self):
+        """Sends any alerts still waiting for the coalescing window straight away, since no more are coming"""
+        with self._condition:
+            self._scan_finished = True
+            self._condition.notify()
+
+    def close(self):
+        """Sends everything queued, then waits for every channel to finish"""
+        self.end_scan()
+        with self._condition:
+            while len(self._pending) != 0:
+                self._condition.wait(0.1)
+        for channel in self._channels:
+            channel.close()
+
+    def _coalesce_forever(self):
+        while True:
+            with self._condition:
+                while len(self._pending) == 0:
+                    self._scan_finished = False
+                    self._condition.wait()
+                send_at = self._pending[0][4] + coalesce_window
+                while not self._scan_finished and time.time() < send_at:
+                    self._condition.wait(send_at - time.time())
+                alerts = self._pending
+                self._pending = []
+                self._scan_finished = False
+                self._condition.notify_all()
+
+            for subject, email_body, detected_at in _combine_alerts(alerts):
+                for channel in self._channels:
+                    channel.put(subject, email_body, detected_at)
+
+
+class _Channel:
+    """A single notification channel with its own queue and sending thread"""
+
+    def __init__(self, name, make_sender):
+        """
+        :param name: the channel's name in metrics and logs
+        :param make_sender: a function returning the function taking (subject, email_body) that sends a message,
+            called from the channel's thread until it succeeds
+        """
+        self.name = name
+        self._make_sender = make_sender
+        self._send = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._send_forever, name=f"notification-{name}", daemon=True)
+        self._thread.start()
+
+    def put(self, subject, email_body, detected_at):
+        self._queue.put((subject, email_body, detected_at))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _send_forever(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            subject, email_body, detected_at = message
+            for attempt in range(max_send_attempts):
+                try:
+                    if self._send is None:
+                        self._send = self._make_sender()
+                    self._send(subject, email_body)
+                except Exception as e:
+                    if attempt == max_send_attempts - 1:
+                        print(f"Error with sending {self.name} message: {e}")
+                        notification_failures.inc(self.name)
+                        log_event("notification", channel=self.name, subject=subject, error=str(e))
+                    else:
+                        time.sleep(2 ** attempt)
+                else:
+                    # Measured from the first alert in the message being detected
+                    latency = time.time() - detected_at
+                    notification_latency.observe(latency, self.name)
+                    log_event("notification", channel=self.name, subject=subject, attempts=attempt + 1,
+                              latency_seconds=round(latency, 3))
+                    break
+
+
+class _EmailSender:
+    """Keeps one logged-in SMTP connection open between emails, reconnecting when the server drops it"""
+
+    def __init__(self):
+        # Load sensitive login data from local .env file
+        _load_dotenv()
+        self.login = os.getenv('EMAIL')
+        self.password = os.getenv('PASSWORD')
+        self.recipients = []
+        if os.getenv("RECIPIENT1") is not None:
+            self.recipients.append(os.getenv("RECIPIENT1"))
+        if os.getenv("RECIPIENT2") is not None:
+            self.recipients.append(os.getenv("RECIPIENT2"))
+        self._server = None
+
+    def send(self, subject, email_body):
+        msg = MIMEText(email_body)
+        msg['Subject'] = subject
+        try:
+            self._connected_server().sendmail(self.login, self.recipients, msg.as_string())
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # The server closes idle connections; the retry reconnects
+            self._server = None
+            raise
+
+    def _connected_server(self):
+        if self._server is not None:
+            try:
+                if self._server.noop()[0] == 250:
+                    return self._server
+            except (smtplib.SMTPServerDisconnected, OSError):
+                pass
+        self._server = smtplib.SMTP('smtp.gmail.com', 587)
+        self._server.ehlo()
+        self._server.starttls()
+        self._server.ehlo()
+        self._server.login(self.login, self.password)
+        return self._server
+
+
+class _DiscordSender:
+    """Builds the Discord webhook once, on a session that keeps its HTTPS connection open"""
+
+    def __init__(self):
+        from discord import Webhook, RequestsWebhookAdapter
+
+        _load_dotenv()
+        webhook_url = os.getenv('DISCORD_WEBHOOK')
+        self._webhook = Webhook.from_url(webhook_url, adapter=RequestsWebhookAdapter(session=requests.Session()))
+
+    def send(self, subject, email_body):
+        from discord import Embed
+
+        embed = Embed(title=subject, description=email_body)
+        self._webhook.send(embed=embed, tts=True)
+
+
+def _combine_alerts(alerts):
+    """Merges alerts from one scan into one subject and body per watch
+
+    :param alerts: a list of (item, vendor_name, subject, email_body, detected_at)
+    :return: a list of (subject, email_body, detected_at), one per item, in the order each was first alerted on
+    """
+    alerts_by_item = {}
+    for alert in alerts:
+        alerts_by_item.setdefault(alert[0], []).append(alert)
+
+    messages = []
+    for item, item_alerts in alerts_by_item.items():
+        detected_at = min(alert[4] for alert in item_alerts)
+        if len(item_alerts) == 1:
+            messages.append((item_alerts[0][2], item_alerts[0][3], detected_at))
+            continue
+        vendors = list(dict.fromkeys(alert[1] for alert in item_alerts))
+        subject = f"{item} in Stock at {', '.join(vendors)}"
+        email_body = "".join(alert[3] for alert in item_alerts)
+        messages.append((subject, email_body, detected_at))
+    return messages
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Returns the shared NotificationDispatcher, starting it on first use"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher()
+        return _dispatcher
+
+
+def close_dispatcher():
+    """Sends everything queued and stops the shared NotificationDispatcher, if it was ever started"""
+    with _dispatcher_lock:
+        dispatcher = _dispatcher
+    if dispatcher is not None:
+        dispatcher.close()
+
+
+def set_enabled_channels(channel_names):
+    """Turns on exactly the given channels, replacing the settings at the top of this module.
+    Only affects a dispatcher started afterwards.
+
+    :param channel_names: any of "beep", "discord" and "email"
+    """
+    global beep_enabled, discord_message_enabled, email_enabled
+    beep_enabled = "beep" in channel_names
+    discord_message_enabled = "discord" in channel_names
+    email_enabled = "email" in channel_names
+
+
+def send_email(subject, email_body):
+    """Sends a single email containing the in-stock item details and link to the desired recipients,
+    outside of the dispatcher
+
+    :param subject: a string containing the in-stock status type and which website
+    :param email_body: a string containing in-stock model details and website link
+    :return: none
+    """
+    sender = _EmailSender()
+    sender.send(subject, email_body)
+    sender._server.close()
+
+
+def send_discord_message(subject, email_body):
+    """Sends a single embedded message to your specific discord channel, outside of the dispatcher
+
+    :param subject: the subject line of an email message
+    :param email_body: the email body of an email message
+    """
+    _DiscordSender().send(subject, email_body)
+
+
+def make_beep_noise():
+    """Makes an audible beep sound. Supports Windows and Linux."""
+    if beep_enabled:
+        # Beep style based on system type
+        if sys.platform == "win32":
+            import winsound
+
+            duration = 1000
+            freq = 1000
+            winsound.Beep(freq, duration)
+        elif sys.platform == "linux":
+            from beepy import beep
+
+            # Documentation here: https://docs.python.org/3/library/sys.html#sys.platform
+            beep(sound=1)
+        else:
+            print("Platform not supported for make_beep_noise().")
+
+
+def _load_dotenv():
+    import dotenv
+
+    dotenv.load_dotenv()
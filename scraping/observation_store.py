@@ -0,0 +1,189 @@
+"""This module contains a persistent SQLite store of every scan's stock observations
+
+Each vendor scan is written as one row in cycles plus one row per observed item in observations. Writes are
+queued and committed in batches by a background thread, so the scrape loop never waits on the disk. The
+database runs in WAL mode so history can be queried while scans are being written.
+
+Classes:
+    ObservationStore
+"""
+
+from contextlib import closing
+import os
+import queue
+import sqlite3
+import threading
+import time
+from scraping.stock_records import Availability, StockObservation
+
+
+# Database file, overridable with the OBSERVATION_DB environment variable
+observation_db_path = os.getenv("OBSERVATION_DB", "observations.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cycles (
+    id INTEGER PRIMARY KEY,
+    vendor TEXT NOT NULL,
+    observed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS observations (
+    cycle_id INTEGER NOT NULL REFERENCES cycles(id),
+    vendor TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    price REAL,
+    online TEXT NOT NULL,
+    in_store TEXT NOT NULL,
+    backorder TEXT NOT NULL,
+    store_locations TEXT NOT NULL,
+    observed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cycles_vendor_time ON cycles (vendor, observed_at);
+CREATE INDEX IF NOT EXISTS idx_observations_vendor_sku_time ON observations (vendor, sku, observed_at);
+CREATE INDEX IF NOT EXISTS idx_observations_cycle ON observations (cycle_id);
+"""
+
+_OBSERVATION_COLUMNS = "vendor, sku, name, url, price, online, in_store, backorder, store_locations"
+
+
+class ObservationStore:
+    """Stores scan results in SQLite and answers questions about past stock"""
+
+    def __init__(self, path=observation_db_path):
+        """
+        :param path: the SQLite database file, created if it does not exist
+        """
+        self.path = path
+        self._pending = queue.Queue()
+        with closing(self._connect()) as connection:
+            connection.executescript(_SCHEMA)
+        self._writer = threading.Thread(target=self._write_forever, name="observation-writer", daemon=True)
+        self._writer.start()
+
+    def record_cycle(self, observations_by_vendor, observed_at=None):
+        """Queues one scan's observations to be written. Returns immediately.
+
+        :param observations_by_vendor: a dictionary of vendor names to their observations, keyed by SKU
+        :param observed_at: the scan's Unix timestamp, now if not given
+        """
+        if observed_at is None:
+            observed_at = time.time()
+        for vendor_name, observations in observations_by_vendor.items():
+            self._pending.put((vendor_name, observed_at, list(observations.values())))
+
+    def flush(self):
+        """Blocks until every queued scan has been written"""
+        self._pending.join()
+
+    def close(self):
+        """Writes any queued scans and stops the writer thread"""
+        self._pending.put(None)
+        self._writer.join()
+
+    def last_known_state(self):
+        """Rebuilds each vendor's observations from its most recent scan, e.g. to avoid re-alerting after a restart
+
+        :return: a dictionary of vendor names to their observations, keyed by SKU
+        """
+        state = {}
+        with closing(self._connect()) as connection:
+            latest_cycles = connection.execute("SELECT vendor, MAX(id) FROM cycles GROUP BY vendor").fetchall()
+            for vendor_name, cycle_id in latest_cycles:
+                rows = connection.execute(
+                    f"SELECT {_OBSERVATION_COLUMNS} FROM observations WHERE cycle_id = ?", (cycle_id,))
+                state[vendor_name] = {row[1]: _observation_from_row(row) for row in rows}
+        return state
+
+    def restock_history(self, vendor_name, sku=None, since=None):
+        """Finds every time an item came into stock: when a scan saw it in stock and the vendor's
+        previous scan did not
+
+        :param vendor_name: the vendor to look at
+        :param sku: only report this SKU, all SKUs if None
+        :param since: only report restocks after this Unix timestamp, all of history if None
+        :return: a list of (observed_at, StockObservation) in time order
+        """
+        since = since if since is not None else 0
+        with closing(self._connect()) as connection:
+            cycles = connection.execute(
+                "SELECT id, observed_at FROM cycles WHERE vendor = ? AND observed_at >= ? ORDER BY observed_at, id",
+                (vendor_name, since)).fetchall()
+            query = f"SELECT cycle_id, {_OBSERVATION_COLUMNS} FROM observations WHERE vendor = ? AND observed_at >= ?"
+            parameters = [vendor_name, since]
+            if sku is not None:
+                query += " AND sku = ?"
+                parameters.append(sku)
+            observations_by_cycle = {}
+            for row in connection.execute(query, parameters):
+                observation = _observation_from_row(row[1:])
+                if observation.in_stock:
+                    observations_by_cycle.setdefault(row[0], {})[observation.sku] = observation
+
+        restocks = []
+        previously_in_stock = set()
+        for cycle_id, observed_at in cycles:
+            in_stock = observations_by_cycle.get(cycle_id, {})
+            for observation_sku, observation in in_stock.items():
+                if observation_sku not in previously_in_stock:
+                    restocks.append((observed_at, observation))
+            previously_in_stock = set(in_stock)
+        return restocks
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _write_forever(self):
+        """Writes queued scans, committing everything that is waiting in a single transaction"""
+        connection = self._connect()
+        stopping = False
+        while not stopping:
+            batch = [self._pending.get()]
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            scans = [scan for scan in batch if scan is not None]
+            stopping = len(scans) != len(batch)
+            try:
+                with connection:
+                    for vendor_name, observed_at, observations in scans:
+                        cycle_id = connection.execute("INSERT INTO cycles (vendor, observed_at) VALUES (?, ?)",
+                                                      (vendor_name, observed_at)).lastrowid
+                        connection.executemany(
+                            f"INSERT INTO observations (cycle_id, {_OBSERVATION_COLUMNS}, observed_at) "
+                            f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            [(cycle_id,) + _row_from_observation(observation) + (observed_at,)
+                             for observation in observations])
+            except sqlite3.Error as e:
+                print(f"Error saving observations: {e}")
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+        connection.close()
+
+
+def _row_from_observation(observation):
+    return (observation.vendor, observation.sku, observation.name, observation.url, observation.price,
+            observation.online.value, observation.in_store.value, observation.backorder.value,
+            ", ".join(observation.store_locations))
+
+
+def _observation_from_row(row):
+    vendor_name, sku, name, url, price, online, in_store, backorder, store_locations = row
+    return StockObservation(
+        vendor=vendor_name,
+        sku=sku,
+        name=name,
+        url=url,
+        price=price,
+        online=Availability(online),
+        in_store=Availability(in_store),
+        backorder=Availability(backorder),
+        store_locations=tuple(store_locations.split(", ")) if store_locations else (),
+    )
@@ -0,0 +1,118 @@
+"""This module contains a cache of parsed vendor pages, used to skip pages that have not changed since the last scan
+
+Each entry remembers a page's ETag and Last-Modified headers, a hash of the part of the page the scraper reads,
+and the stock dictionary parsed from it. A 304 response or a matching hash means the previous stock dictionary
+is still correct, so parsing and product page loads can be skipped. Entries expire after a TTL so store
+inventory on product pages is still re-checked regularly, and the oldest entries are evicted past a size limit.
+
+Classes:
+    CachedPage
+    PageCache
+
+Functions:
+    content_hash()
+"""
+
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+
+# Seconds a parsed page is reused for before it is scraped in full again
+page_cache_ttl = 120
+# Most pages remembered at once, oldest evicted first
+page_cache_max_entries = 256
+
+
+class CachedPage:
+    """What is remembered about a single URL"""
+
+    __slots__ = ("content_hash", "stock_dict", "etag", "last_modified", "stored_at")
+
+    def __init__(self, content_hash, stock_dict, etag=None, last_modified=None):
+        self.content_hash = content_hash
+        self.stock_dict = stock_dict
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = time.monotonic()
+
+
+class PageCache:
+    """A thread-safe, size-bounded cache of CachedPage entries keyed by URL"""
+
+    def __init__(self, ttl=page_cache_ttl, max_entries=page_cache_max_entries):
+        """
+        :param ttl: seconds an entry stays valid
+        :param max_entries: the number of entries kept before the least recently stored is evicted
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, URL):
+        """Looks up a URL, dropping its entry if it has expired
+
+        :param URL: the page URL
+        :return: the CachedPage for URL, or None
+        """
+        with self._lock:
+            entry = self._entries.get(URL)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.stored_at > self.ttl:
+                del self._entries[URL]
+                return None
+            return entry
+
+    def store(self, URL, content_hash, stock_dict, etag=None, last_modified=None):
+        """Remembers the parsed result of a page, replacing any previous entry for URL
+
+        :param URL: the page URL
+        :param content_hash: the hash of the page region the scraper reads, from content_hash()
+        :param stock_dict: the stock dictionary parsed from the page
+        :param etag: the ETag response header, if any
+        :param last_modified: the Last-Modified response header, if any
+        """
+        with self._lock:
+            self._entries.pop(URL, None)
+            self._entries[URL] = CachedPage(content_hash, stock_dict, etag, last_modified)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def conditional_headers(self, URL):
+        """Builds the If-None-Match and If-Modified-Since headers for a conditional request
+
+        :param URL: the page URL
+        :return: a dictionary of request headers, empty if URL is not cached
+        """
+        entry = self.get(URL)
+        headers = {}
+        if entry is not None:
+            if entry.etag is not None:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified is not None:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def clear(self):
+        """Forgets every entry"""
+        with self._lock:
+            self._entries.clear()
+
+
+def content_hash(html):
+    """Hashes a page region with whitespace normalized, so re-indented but otherwise identical markup matches
+
+    :param html: the HTML of the page region
+    :return: a hex digest, or None if the region is empty
+    """
+    normalized = " ".join(html.split())
+    if normalized == "":
+        return None
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+# Shared by every worker and both scraping paths
+page_cache = PageCache()
@@ -0,0 +1,148 @@
+"""This module contains the functions necessary to read a vendor's listings past the first page of results
+
+Listings are yielded as each page is read, following the vendor's pagination until max_pages, a page with
+nothing available or matching stop_when, or a page with no listings that were not already on an earlier one.
+Over HTTP, the next page starts downloading as soon as a listing shows it is worth reading, while the rest
+of the current page is still being parsed, so following a page costs little more than parsing it. A page that
+turns out to be the last never has the one after it requested. A webdriver has one tab to load pages in, so
+its pages are loaded in turn.
+
+Functions:
+    iter_listings_http()
+    iter_listings_in_browser()
+    page_url()
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import re
+import requests
+from scraping.browser_extraction import extract_listings_in_browser
+from scraping.detail_pages import host_semaphore
+from scraping.http_fetch import fetch_page, extract_listings
+from scraping.rate_limits import wait_for_turn
+from scraping.readiness import wait_until_ready, PageNotReady
+
+
+# Listing pages downloaded ahead at the same time, across all workers
+max_prefetched_pages = 4
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=max_prefetched_pages, thread_name_prefix="page-prefetch")
+
+
+def iter_listings_http(plan, URL, tree, vendor_name):
+    """Yields every listing of a vendor's listing page downloaded without a browser, then of the pages after it
+    while they are worth reading
+
+    :param plan: the vendor's ExtractionPlan
+    :param URL: the first page's URL
+    :param tree: the first page, from fetch_page()
+    :param vendor_name: the name of the webpage vendor
+    :return: a generator of dictionaries of field values
+    """
+    seen_listings = set()
+    page_number = 1
+    while True:
+        next_URL = None
+        next_page = None
+        looked_for_next_page = page_number >= plan.max_pages
+        for listing in _new_listings(plan, plan.iter_http(tree), seen_listings):
+            if not looked_for_next_page and plan.worth_next_page(listing):
+                looked_for_next_page = True
+                next_URL = _next_page_url(plan, URL, page_number,
+                                          lambda selector, fields: extract_listings(tree, selector, fields))
+                if next_URL is not None:
+                    next_page = _prefetch_executor.submit(_fetch_listing_page, next_URL)
+            yield listing
+
+        if next_page is None:
+            return
+        try:
+            tree = next_page.result()
+        except requests.RequestException as e:
+            print(f"Stopped following {vendor_name} pages at page {page_number + 1}: {e}")
+            return
+        URL = next_URL
+        page_number += 1
+
+
+def iter_listings_in_browser(plan, URL, driver, vendor_name):
+    """Yields every listing of a vendor's listing page loaded in the webdriver, then of the pages after it
+    while they are worth reading. The webdriver is left on the last page read.
+
+    :param plan: the vendor's ExtractionPlan
+    :param URL: the first page's URL
+    :param driver: an initialized webdriver with the first page loaded
+    :param vendor_name: the name of the webpage vendor
+    :return: a generator of dictionaries of field values
+    """
+    seen_listings = set()
+    page_number = 1
+    while True:
+        worth_next_page = False
+        for listing in _new_listings(plan, extract_listings_in_browser(driver, plan.listing_selector, plan.fields),
+                                     seen_listings):
+            worth_next_page = worth_next_page or plan.worth_next_page(listing)
+            yield listing
+
+        if page_number >= plan.max_pages or not worth_next_page:
+            return
+        next_URL = _next_page_url(plan, URL, page_number,
+                                  lambda selector, fields: extract_listings_in_browser(driver, selector, fields))
+        if next_URL is None:
+            return
+        try:
+            wait_for_turn(next_URL)
+            driver.get(next_URL)
+            wait_until_ready(driver, plan.key, *plan.ready_when)
+        except PageNotReady as e:
+            print(f"Stopped following {vendor_name} pages at page {page_number + 1}: {e}")
+            return
+        URL = next_URL
+        page_number += 1
+
+
+def page_url(URL, parameter, page_number):
+    """Sets the page number in a listing page URL, leaving the rest of the query as it is
+
+    :param URL: the listing page URL, with or without the page parameter
+    :param parameter: the name of the query parameter holding the page number, e.g. "page"
+    :param page_number: the page wanted, starting from 1
+    :return: the URL of that page
+    """
+    pattern = re.compile(r"([?&]" + re.escape(parameter) + r"=)[^&#]*")
+    if pattern.search(URL) is not None:
+        return pattern.sub(lambda match: match.group(1) + str(page_number), URL, count=1)
+    URL, _, fragment = URL.partition("#")
+    URL += ("&" if "?" in URL else "?") + f"{parameter}={page_number}"
+    return URL + ("#" + fragment if fragment else "")
+
+
+def _next_page_url(plan, URL, page_number, extract):
+    """Finds the URL of the page after page_number, from the page number or else the current page's next page link
+
+    :param extract: a function taking (listing_selector, fields) and reading them from the current page,
+        as extract_listings() does
+    :return: the URL, or None if the current page has no next page link
+    """
+    if plan.page_parameter is not None:
+        return page_url(URL, plan.page_parameter, page_number + 1)
+    selector, attribute = plan.next_page
+    links = extract(selector, {"url": (None, attribute)})
+    if len(links) == 0 or links[0]["url"] == "":
+        return None
+    return links[0]["url"]
+
+
+def _fetch_listing_page(URL):
+    with host_semaphore(URL):
+        return fetch_page(URL)
+
+
+def _new_listings(plan, listings, seen_listings):
+    """Yields the listings not already on an earlier page, some vendors repeating the last page past the end"""
+    for listing in listings:
+        listing_key = listing[plan.item_fields["url"]] or listing[plan.item_fields["name"]]
+        if listing_key in seen_listings:
+            continue
+        seen_listings.add(listing_key)
+        yield listing
@@ -0,0 +1,220 @@
+"""This module contains the request governor that keeps each vendor host under the rate it tolerates
+
+Every request to a vendor, over HTTP or as a webdriver page load or tab, first takes a token from its host's
+token bucket, which refills at the host's rate in host_rate_limits and holds up to its burst. A host that
+answers with HTTP 429 or 503 or a bot check page is cooled down: requests to it raise RateLimited straight away
+for cooldown_seconds, doubling with each block in a row up to max_cooldown_seconds, or for as long as its
+Retry-After header asks. Each block also halves the host's rate, and every recovery_requests requests that
+go through without one raise it again by a step, up to the configured rate, so each vendor settles near the
+highest rate it allows.
+
+With proxies set, each host is given one proxy and keeps it, so a vendor sees one consistent client, until
+the host blocks it and moves on to the next. Webdrivers are given a proxy each when they start.
+
+Classes:
+    HostGovernor
+
+Functions:
+    host_governor()
+    wait_for_turn()
+    report_success()
+    report_blocked()
+    proxy_for()
+    next_browser_proxy()
+"""
+
+import itertools
+import os
+import threading
+import time
+from urllib.parse import urlparse
+from scraping.metrics import host_request_rate, host_blocks, host_wait_duration
+from scraping.readiness import RateLimited
+
+
+# Requests per second and burst size for each vendor host, without "www."
+host_rate_limits = {
+    "amazon.ca": (0.2, 2),
+    "bestbuy.ca": (0.5, 3),
+    "newegg.ca": (1, 4),
+    "memoryexpress.com": (1, 4),
+    "canadacomputers.com": (1, 4),
+    "pc-canada.com": (1, 4),
+}
+# For hosts missing from host_rate_limits
+default_rate_limit = (1, 4)
+# Never limited, e.g. the benchmark fixture server
+unlimited_hosts = {"127.0.0.1", "localhost"}
+
+# Seconds a host is left alone after its first block in a row, doubling with each one after it
+cooldown_seconds = 60
+max_cooldown_seconds = 900
+# A blocked host's rate is halved, but never below this fraction of its configured rate
+min_rate_fraction = 0.1
+# Requests in a row without a block before a slowed host's rate goes up by rate_step of its configured rate
+recovery_requests = 20
+rate_step = 0.1
+
+# Proxy URLs, e.g. "http://10.0.0.2:3128", comma separated in the PROXIES environment variable. None to connect
+# directly. Chrome ignores credentials in a proxy URL, so proxies used by webdrivers must allow the scraper's IP.
+proxies = [proxy.strip() for proxy in os.getenv("PROXIES", "").split(",") if proxy.strip()] or None
+
+_governors = {}
+_governors_lock = threading.Lock()
+# Hands out proxies in turn, to new hosts and new webdrivers
+_next_proxy = itertools.count()
+
+
+class HostGovernor:
+    """The token bucket, cool-down and proxy of a single vendor host"""
+
+    def __init__(self, host, rate, burst, proxy_index=0):
+        """
+        :param host: the host name, without "www."
+        :param rate: the most requests per second, None for no limit
+        :param burst: the most requests sent back to back after a quiet spell
+        :param proxy_index: the index in proxies of the host's first proxy
+        """
+        self.host = host
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.proxy_index = proxy_index
+        self._tokens = burst
+        self._refilled_at = time.monotonic()
+        self._cooldown_until = 0
+        self._blocks_in_a_row = 0
+        self._successes = 0
+        self._lock = threading.Lock()
+        if rate is not None:
+            host_request_rate.set(rate, host)
+
+    def acquire(self):
+        """Blocks until the host's rate allows another request
+
+        :raises RateLimited: if the host is cooling down after a block
+        """
+        if self.max_rate is None:
+            return
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._cooldown_until:
+                    raise RateLimited(f"{self.host} is cooling down for {self._cooldown_until - now:.0f} more seconds")
+                self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+                self._refilled_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    host_wait_duration.observe(now - start, self.host)
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def record_success(self):
+        """Counts a request the host answered normally, raising a slowed host's rate after enough of them"""
+        if self.max_rate is None:
+            return
+        with self._lock:
+            self._blocks_in_a_row = 0
+            if self.rate >= self.max_rate:
+                return
+            self._successes += 1
+            if self._successes >= recovery_requests:
+                self._successes = 0
+                self.rate = min(self.max_rate, self.rate + self.max_rate * rate_step)
+                host_request_rate.set(self.rate, self.host)
+
+    def record_block(self, retry_after=None):
+        """Cools the host down, halves its rate and moves it to the next proxy
+
+        :param retry_after: the seconds the host asked to wait, from its Retry-After header, if any
+        :return: the seconds the host is cooling down for
+        """
+        host_blocks.inc(self.host)
+        if self.max_rate is None:
+            return 0
+        with self._lock:
+            cooldown = min(max_cooldown_seconds, cooldown_seconds * 2 ** self._blocks_in_a_row)
+            if retry_after is not None:
+                cooldown = max(cooldown, retry_after)
+            self._blocks_in_a_row += 1
+            self._cooldown_until = time.monotonic() + cooldown
+            self._tokens = 0
+            self._successes = 0
+            self.rate = max(self.max_rate * min_rate_fraction, self.rate / 2)
+            if proxies is not None:
+                self.proxy_index = (self.proxy_index + 1) % len(proxies)
+        host_request_rate.set(self.rate, self.host)
+        print(f"{self.host} is blocking requests, pausing it for {cooldown:.0f} seconds "
+              f"and slowing it to {self.rate:.2f} requests per second.")
+        return cooldown
+
+    @property
+    def proxy(self):
+        """The proxy URL requests to the host go through, None to connect directly"""
+        if proxies is None:
+            return None
+        return proxies[self.proxy_index % len(proxies)]
+
+
+def host_governor(URL):
+    """Returns the HostGovernor of URL's host, shared by every worker
+
+    :param URL: any URL on the host
+    :return: a HostGovernor
+    """
+    host = urlparse(URL).hostname or ""
+    if host.startswith("www."):
+        host = host[len("www."):]
+    with _governors_lock:
+        if host not in _governors:
+            rate, burst = (None, None) if host in unlimited_hosts else host_rate_limits.get(host, default_rate_limit)
+            _governors[host] = HostGovernor(host, rate, burst, next(_next_proxy))
+        return _governors[host]
+
+
+def wait_for_turn(URL):
+    """Blocks until another request to URL's host is allowed. Call before every request or page load.
+
+    :param URL: the URL about to be requested
+    :raises RateLimited: if the host is cooling down after a block
+    """
+    host_governor(URL).acquire()
+
+
+def report_success(URL):
+    """Records that URL's host answered a request normally
+
+    :param URL: the URL that was requested
+    """
+    host_governor(URL).record_success()
+
+
+def report_blocked(URL, retry_after=None):
+    """Records that URL's host answered a request with a block, cooling it down
+
+    :param URL: the URL that was requested
+    :param retry_after: the seconds the host asked to wait, if it said
+    :return: the seconds the host is cooling down for
+    """
+    return host_governor(URL).record_block(retry_after)
+
+
+def proxy_for(URL):
+    """Returns the proxy requests to URL's host go through, the same one until the host blocks it
+
+    :param URL: any URL on the host
+    :return: the proxy URL, None to connect directly
+    """
+    return host_governor(URL).proxy
+
+
+def next_browser_proxy():
+    """Picks the proxy for a new webdriver, taking each proxy in turn
+
+    :return: the proxy URL, None to connect directly
+    """
+    if proxies is None:
+        return None
+    return proxies[next(_next_proxy) % len(proxies)]
@@ -0,0 +1,124 @@
+"""This module contains the functions necessary to wait for a vendor page to be ready to scrape
+
+Each vendor declares what a ready page looks like, e.g. at least one listing element, instead of relying
+on a blanket implicit wait. How long to wait adapts to how long that vendor's pages took to become ready
+recently, and a page that never gets there raises PageNotReady rather than looking like "no stock".
+A bot check or "too many requests" page raises RateLimited instead, so the scheduler can back off.
+
+Classes:
+    PageNotReady
+    RateLimited
+    LoadTimes
+
+Functions:
+    wait_until_ready()
+    looks_rate_limited()
+"""
+
+from collections import deque
+import threading
+import time
+
+
+# Used until a vendor has enough recorded load times to adapt to
+default_ready_timeout = 10
+# Bounds for the adaptive timeout, in seconds
+min_ready_timeout = 3
+max_ready_timeout = 30
+# The adaptive timeout is this many times the recent 95th percentile load time
+timeout_multiplier = 2
+# Number of recent load times remembered per vendor
+load_time_history = 50
+# Page title fragments, in lower case, of the pages vendors show instead of listings when they block a scraper
+rate_limit_title_markers = ["robot check", "captcha", "access denied", "too many requests", "are you a human"]
+
+_COUNT_SCRIPT = "return document.querySelectorAll(arguments[0]).length;"
+
+
+class PageNotReady(Exception):
+    """Raised when a page does not meet its readiness condition before the timeout"""
+
+
+class RateLimited(Exception):
+    """Raised when a vendor answers with a bot check or "too many requests" page instead of its listings"""
+
+
+class LoadTimes:
+    """Thread-safe record of recent page ready times for each vendor or page type"""
+
+    def __init__(self):
+        self._times = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        """Remembers how long a page took to become ready
+
+        :param key: the vendor or page type, e.g. "newegg" or "memory express product"
+        :param seconds: the time from the end of driver.get() until the page was ready
+        """
+        with self._lock:
+            if key not in self._times:
+                self._times[key] = deque(maxlen=load_time_history)
+            self._times[key].append(seconds)
+
+    def percentile(self, key, percent):
+        """Returns a percentile of the recent load times for key, or None with fewer than 5 recorded"""
+        with self._lock:
+            times = sorted(self._times.get(key, ()))
+        if len(times) < 5:
+            return None
+        index = min(len(times) - 1, int(round(percent / 100 * (len(times) - 1))))
+        return times[index]
+
+    def timeout(self, key):
+        """Picks how long to wait for a page of this vendor or type to become ready
+
+        :param key: the vendor or page type
+        :return: the timeout in seconds
+        """
+        p95 = self.percentile(key, 95)
+        if p95 is None:
+            return default_ready_timeout
+        return min(max_ready_timeout, max(min_ready_timeout, p95 * timeout_multiplier))
+
+
+# Shared by every worker
+load_times = LoadTimes()
+
+
+def wait_until_ready(driver, key, selector, min_count=1):
+    """Waits until the loaded page has at least min_count elements matching selector
+
+    :param driver: an initialized webdriver that has just loaded the page
+    :param key: the vendor or page type, used to adapt the timeout
+    :param selector: a CSS selector for the elements that show the page is ready
+    :param min_count: how many matching elements a ready page has at least
+    :return: the seconds it took for the page to become ready
+    """
+    # Imported here so runs that never start a webdriver never load selenium.webdriver
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    timeout = load_times.timeout(key)
+    start = time.monotonic()
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.1).until(
+            lambda d: d.execute_script(_COUNT_SCRIPT, selector) >= min_count)
+    except TimeoutException:
+        # Counts as a slow load, so a vendor that became slower gets a longer timeout next time
+        load_times.record(key, timeout)
+        raise PageNotReady(f"fewer than {min_count} '{selector}' after {timeout:.1f} seconds")
+
+    elapsed = time.monotonic() - start
+    load_times.record(key, elapsed)
+    return elapsed
+
+
+def looks_rate_limited(page_title):
+    """Determines if a page title is one of a vendor's bot check or rate limit pages
+
+    :param page_title: the loaded page's title
+    :return: True if the vendor is blocking the scraper
+    """
+    page_title = (page_title or "").lower()
+    return any(marker in page_title for marker in rate_limit_title_markers)
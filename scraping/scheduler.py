@@ -0,0 +1,207 @@
+"""This module contains a per-vendor scheduler deciding when each vendor is scanned next
+
+Every vendor has its own interval, jitter and priority. Intervals shrink while a vendor recently had stock
+or is inside a known drop window, and grow after errors or rate-limit pages. Each deadline is measured
+from when the previous scan started, so the time a scrape takes does not push later scans back. A vendor
+watched some other way, e.g. by a hot watch, can be held out of the schedule until that stops working.
+A vendor that keeps failing is skipped altogether while its CircuitBreaker is open.
+
+Classes:
+    VendorSchedule
+    Scheduler
+"""
+
+import datetime
+import random
+import threading
+import time
+from scraping.circuit_breaker import CircuitBreaker, OPEN
+
+
+# Interval multipliers
+recent_stock_factor = 0.5  # While a vendor had stock in the last recent_stock_duration seconds
+drop_window_factor = 0.5  # While inside one of the vendor's drop windows
+rate_limited_factor = 4  # After a bot check or HTTP 429, on top of the error backoff
+recent_stock_duration = 600
+# Errors in a row double the interval, up to this many times
+max_error_doublings = 5
+# No vendor is scanned more often than this, in seconds
+min_interval = 3
+
+
+class VendorSchedule:
+    """How often one vendor is scanned"""
+
+    def __init__(self, vendor_name, interval, jitter=0, priority=0, drop_windows=()):
+        """
+        :param vendor_name: the vendor name, as in vendors_to_scrape
+        :param interval: the usual seconds between the start of two scans
+        :param jitter: up to this many random seconds are added to each interval
+        :param priority: vendors with a higher priority are started first when several are due
+        :param drop_windows: a list of (weekday, "HH:MM", "HH:MM") local times when restocks are likely.
+            weekday is 0 for Monday to 6 for Sunday, or None for every day.
+        """
+        self.vendor_name = vendor_name
+        self.interval = interval
+        self.jitter = jitter
+        self.priority = priority
+        self.drop_windows = drop_windows
+
+    def in_drop_window(self, now):
+        """Determines if a local datetime falls inside one of the vendor's drop windows"""
+        current_time = now.strftime("%H:%M")
+        for weekday, start, end in self.drop_windows:
+            if (weekday is None or weekday == now.weekday()) and start <= current_time < end:
+                return True
+        return False
+
+
+class Scheduler:
+    """Tracks when each vendor is next due, adapting to how its recent scans went"""
+
+    def __init__(self, schedules):
+        """
+        :param schedules: a list of VendorSchedule, one per vendor
+        """
+        self._schedules = {schedule.vendor_name: schedule for schedule in schedules}
+        # Notified when a scan finishes, for hold()
+        self._lock = threading.Condition()
+        now = time.monotonic()
+        self._next_due = {vendor_name: now for vendor_name in self._schedules}
+        self._errors_in_a_row = {vendor_name: 0 for vendor_name in self._schedules}
+        self._rate_limited = {vendor_name: False for vendor_name in self._schedules}
+        self._last_stock_at = {}
+        self._active = set(self._schedules)
+        self._held = set()
+        self._scanning = set()
+        self._breakers = {vendor_name: CircuitBreaker(vendor_name) for vendor_name in self._schedules}
+
+    def set_active(self, vendor_names):
+        """Limits scans to some vendors, e.g. the ones this worker holds a lease on when running sharded.
+        Inactive vendors are never due, and keep their adapted intervals for when they become active again.
+
+        :param vendor_names: the vendor names to scan from now on
+        """
+        with self._lock:
+            self._active = set(vendor_names) & set(self._schedules)
+
+    def hold(self, vendor_name):
+        """Stops scanning a vendor on its schedule, e.g. while a hot watch is keeping up with it. Waits for a scan
+        of the vendor that already started to finish, so nothing else reports the vendor once this returns.
+
+        :param vendor_name: the vendor to hold
+        """
+        with self._lock:
+            self._held.add(vendor_name)
+            while vendor_name in self._scanning:
+                self._lock.wait()
+
+    def release(self, vendor_name):
+        """Puts a held vendor back on its schedule, due straight away since nothing has been watching it
+
+        :param vendor_name: the vendor to release
+        """
+        with self._lock:
+            if vendor_name in self._held:
+                self._held.discard(vendor_name)
+                self._next_due[vendor_name] = time.monotonic()
+
+    def due_vendors(self, now=None):
+        """Returns the vendors whose next scan is due, highest priority first
+
+        :param now: the current time.monotonic(), read if not given
+        :return: a list of vendor names
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for breaker in self._breakers.values():
+                breaker.check(now)
+            due = [vendor_name for vendor_name in self._next_due
+                   if self._due_at(vendor_name) <= now and self._is_scheduled(vendor_name)]
+        return sorted(due, key=lambda vendor_name: (-self._schedules[vendor_name].priority, self._next_due[vendor_name]))
+
+    def seconds_until_next_due(self, exclude=(), now=None):
+        """Returns how long until the next vendor is due, 0 if one already is
+
+        :param exclude: vendor names to ignore, e.g. ones currently being scanned
+        :param now: the current time.monotonic(), read if not given
+        :return: seconds, or None if every vendor is excluded, inactive or held
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            deadlines = [self._due_at(vendor_name) for vendor_name in self._next_due
+                         if vendor_name not in exclude and self._is_scheduled(vendor_name)]
+        if len(deadlines) == 0:
+            return None
+        return max(0, min(deadlines) - now)
+
+    def start_scan(self, vendor_name):
+        """Marks a vendor as being scanned until its record_scan()
+
+        :param vendor_name: the vendor whose scan is starting
+        """
+        with self._lock:
+            self._scanning.add(vendor_name)
+
+    def record_scan(self, vendor_name, started_at, found_stock=False, error=False, rate_limited=False):
+        """Schedules a vendor's next scan from the outcome of the one that just finished
+
+        :param vendor_name: the vendor that was scanned
+        :param started_at: the time.monotonic() when the scan started
+        :param found_stock: True if anything was in stock
+        :param error: True if the scan failed
+        :param rate_limited: True if the vendor answered with a bot check or too many requests page
+        :return: the seconds until the vendor's next scan, measured from started_at
+        """
+        with self._lock:
+            self._scanning.discard(vendor_name)
+            self._lock.notify_all()
+            breaker = self._breakers[vendor_name]
+            if error or rate_limited:
+                self._errors_in_a_row[vendor_name] += 1
+                breaker.record_failure()
+            else:
+                self._errors_in_a_row[vendor_name] = 0
+                breaker.record_success()
+            self._rate_limited[vendor_name] = rate_limited
+            if found_stock:
+                self._last_stock_at[vendor_name] = started_at
+
+            interval = self._effective_interval(vendor_name, started_at)
+            if breaker.state == OPEN:
+                interval = max(interval, breaker.open_until - started_at)
+            self._next_due[vendor_name] = started_at + interval
+        return interval
+
+    def breaker_state(self, vendor_name):
+        """Returns the state of a vendor's circuit breaker, circuit_breaker.CLOSED, HALF_OPEN or OPEN"""
+        with self._lock:
+            return self._breakers[vendor_name].check()
+
+    def _due_at(self, vendor_name):
+        """The time.monotonic() a vendor is next due, no sooner than its open breaker allows.
+        Called with the lock held."""
+        breaker = self._breakers[vendor_name]
+        if breaker.state == OPEN:
+            return max(self._next_due[vendor_name], breaker.open_until)
+        return self._next_due[vendor_name]
+
+    def _is_scheduled(self, vendor_name):
+        """True if the vendor is active and not held. Called with the lock held."""
+        return vendor_name in self._active and vendor_name not in self._held
+
+    def _effective_interval(self, vendor_name, started_at):
+        schedule = self._schedules[vendor_name]
+        interval = schedule.interval
+
+        last_stock_at = self._last_stock_at.get(vendor_name)
+        if last_stock_at is not None and started_at - last_stock_at < recent_stock_duration:
+            interval *= recent_stock_factor
+        if schedule.in_drop_window(datetime.datetime.now()):
+            interval *= drop_window_factor
+
+        interval *= 2 ** min(self._errors_in_a_row[vendor_name], max_error_doublings)
+        if self._rate_limited[vendor_name]:
+            interval *= rate_limited_factor
+
+        return max(min_interval, interval + random.uniform(0, schedule.jitter))
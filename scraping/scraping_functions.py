@@ -1,561 +1,646 @@
 """This module contains the functions necessary to scan computer supplier webpages and send messages
 
+Listing pages are read the same way for every vendor, following the vendor's definition in scraping/vendors/.
+Only product pages with store inventory, which need clicks and tables, have their own parsing functions.
+
 Functions:
     initialize_webdriver()
     scrape_vendors()
-    scrape_newegg()
-    scrape_bestbuy()
-    scrape_memoryexpress()
-    scrape_canada_computers()
-    scrape_amazon()
-    scrape_pc_canada()
+    scrape_vendor_http()
+    scrape_vendor_api()
+    scrape_availability_api()
+    stock_dict_from_availability()
+    scrape_page_with_cache()
+    scrape_listing_page()
+    scrape_listing_page_http()
+    parse_memory_express_product_page()
+    add_memory_express_item()
+    parse_canada_computers_product_page()
+    parse_canada_computers_product_page_http()
+    add_canada_computers_item()
+    select_stores()
+    canada_computers_stores()
+    add_store_stock()
+    generate_email_body()
+    report_stock()
     maybe_send_email()
-    send_email()
-    send_discord_message()
     title_line()
-    make_beep_noise()
 """
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from email.mime.text import MIMEText
-from fake_useragent import UserAgent
 import os.path
 from os import path
 import requests
-from discord import Webhook, RequestsWebhookAdapter, Embed
-import smtplib
-import dotenv
-import os
-import sys
-
-# Beep style based on system type
-if sys.platform == "win32":
-    import winsound
-elif sys.platform == "linux":
-    from beepy import beep
-
-
-# Set to True to turn on
-discord_message_enabled = True
-email_enabled = False
-beep_enabled = True
-
-
-def initialize_webdriver():
+from scraping.http_fetch import (fetch_page, fetch_response, parse_response, region_html, select_elements,
+                                 PageNeedsJavaScript)
+from scraping.availability_api import sku_catalog, availability_client, poll_availability
+from scraping.browser_extraction import region_html_in_browser
+from scraping.detail_pages import scrape_detail_pages_in_tabs, scrape_detail_pages_http
+from scraping.page_cache import page_cache, content_hash
+from scraping.pagination import iter_listings_http, iter_listings_in_browser
+from scraping.rate_limits import wait_for_turn, report_success, report_blocked
+from scraping.readiness import wait_until_ready, looks_rate_limited, PageNotReady, RateLimited
+from scraping.store_inventory import read_store_inventory, read_store_inventory_in_browser, selected_stores
+from scraping.stock_records import (Availability, observations_from_stock_dict, diff_observations,
+                                    keep_unread_observations)
+from scraping.lean_browsing import lean_chrome_options, lean_capabilities, enable_request_blocking, block_vendor_requests
+from scraping.notifications import get_dispatcher
+from scraping.vendor_registry import vendor_plan
+from scraping.user_agents import random_user_agent
+from scraping.metrics import (timed, page_load_duration, extraction_duration, detail_pages_duration,
+                              page_timeouts)
+
+
+# Set to True to turn on. Notification types are turned on in notifications.py
+# Scrapes server-rendered vendors without a browser, falling back to the webdriver when that fails
+http_fetch_enabled = True
+# Reuses the previous scan's results for pages whose listings have not changed. Vendors whose later pages are
+# followed are always scraped in full, since a change on a later page does not show on the first.
+page_cache_enabled = True
+# Skips images, fonts, media and trackers, and reads pages as soon as their DOM is ready
+lean_browsing_enabled = True
+# Polls vendors with a JSON availability API through it, once their listing page has been scraped for SKUs
+availability_api_enabled = True
+
+# Add or comment/uncomment desired store location names here, case sensitive
+memory_express_stores_to_check = [
+    "Vancouver",
+    # "Victoria",
+    "Burnaby",
+    "Richmond",
+]
+canada_computers_stores_to_check = [
+    # Ontario
+    "Markham",
+    "Midtown Toronto",
+    "Richmond Hill",
+    "Etobicoke",
+    "Newmarket",
+    "North York",
+    "Vaughan",
+    "Downtown Toronto",
+    "Ajax",
+    "Mississauga",
+    "Brampton",
+    "Scarborough",
+
+    # BC
+    "Vancouver Broadway",
+    "East Vancouver",
+    "Burnaby",
+    "Richmond",
+]
+# Also checks every store in scraping/stores.json within store_search_radius_km of this postal code, e.g. "V5K 0A1",
+# or of "latitude,longitude". Overridable with the STORE_POSTAL_CODE environment variable. None for only the stores above.
+store_search_postal_code = os.getenv("STORE_POSTAL_CODE")
+store_search_radius_km = 25
+
+
+def initialize_webdriver(proxy=None, background_tabs=False):
     """Initializes a chrome webdriver for use in the scraping functions.
-    Generates a random user agent and run in a headless browser.
+    Picks a random user agent from the local user agent file and runs in a headless browser.
     Compatible with both Windows and Linux once chromedriver paths are set.
 
+    :param proxy: the proxy URL every page load goes through, e.g. from rate_limits.next_browser_proxy(),
+        None to connect directly
+    :param background_tabs: True to keep timers running at full speed in tabs other than the current one,
+        e.g. for a hot watch's pollers. Chrome otherwise slows them to once a second, then once a minute.
     :return: the initialized webdriver, ready to accept URLs
     """
+    # Imported here so runs that only scrape vendors over HTTP never load selenium.webdriver
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
     # Manually set the paths to Windows and/or Linux chromedriver location
     # Chrome Drivers found here: https://sites.google.com/a/chromium.org/chromedriver/downloads
     WINDOWS_PATH = './chromedriver.exe'
     LINUX_PATH = './chromedriver'
     DOCKER_PATH = '/usr/local/bin/chromedriver'
 
-    # Operates as a random user agent in a headless browser
+    # Operates as a random user agent in a headless browser. A Chrome webdriver claiming to be Firefox or Safari
+    # is easy for a vendor to spot, so only Chromium user agents are used.
     chromeOptions = Options()
-    ua = UserAgent()
-    userAgent = ua.random
+    userAgent = random_user_agent(browsers=("chrome", "edge"))
     chromeOptions.add_experimental_option('excludeSwitches', ['enable-logging'])
     chromeOptions.add_argument(f'user-agent={userAgent}')
     chromeOptions.headless = True
+    if proxy is not None:
+        chromeOptions.add_argument(f'--proxy-server={proxy}')
+    if background_tabs:
+        chromeOptions.add_argument('--disable-background-timer-throttling')
+        chromeOptions.add_argument('--disable-backgrounding-occluded-windows')
+        chromeOptions.add_argument('--disable-renderer-backgrounding')
+
+    # Only loads the parts of each page the scrapers read
+    capabilities = None
+    if lean_browsing_enabled:
+        lean_chrome_options(chromeOptions)
+        capabilities = lean_capabilities()
 
     if (path.exists(WINDOWS_PATH)):
-        driver = webdriver.Chrome(executable_path=WINDOWS_PATH, options=chromeOptions)
+        driver = webdriver.Chrome(executable_path=WINDOWS_PATH, options=chromeOptions, desired_capabilities=capabilities)
     elif (path.exists(LINUX_PATH)):
-        driver = webdriver.Chrome(executable_path=LINUX_PATH, options=chromeOptions)
+        driver = webdriver.Chrome(executable_path=LINUX_PATH, options=chromeOptions, desired_capabilities=capabilities)
     else:
         chromeOptions.add_argument('--no-sandbox')
         chromeOptions.add_argument('--headless')
         chromeOptions.add_argument('--disable-gpu')
-        driver = webdriver.Chrome(executable_path=DOCKER_PATH, options=chromeOptions)
+        driver = webdriver.Chrome(executable_path=DOCKER_PATH, options=chromeOptions, desired_capabilities=capabilities)
         
     driver.get('chrome://settings/clearBrowserData')
 
+    if lean_browsing_enabled:
+        enable_request_blocking(driver)
+
+    # Pages are waited for with each vendor's ready_when instead, so missing elements fail straight away
+    driver.implicitly_wait(0)
+
     return driver
 
 
-def scrape_vendors(vendor_name, URL, driver, item, email_bodies):
-    """Scrapes respective vendor URL to detect any stock for the given item
+def scrape_vendors(vendor_name, URL, driver, previous_observations=None):
+    """Scrapes respective vendor URL to detect any stock
 
     :param vendor_name: a given vendor name, specified in main.py
     :param URL: a respective URL to scrape, attached to vendor_name
     :param driver: an initialized webdriver
-    :param item: the name of the item to check stock for
-    :param email_bodies: the email body from the previous email sent, "" if no previous body
-    :return: email_body if vendor_name is valid
+    :param previous_observations: the vendor's observations from the previous scan, keyed by SKU, kept for the
+        items on the page that could not be read
+    :return: the page's observations keyed by SKU, or None if the page was not ready in time
     """
+    plan = vendor_plan(vendor_name)
+    if plan is None:
+        raise ValueError("Vendor specified does not match existing vendors.")
+    vendor_key = plan.key
+
     title_line(vendor_name)
 
-    driver.get(URL)
-    driver.implicitly_wait(10)
-
-    # Scrape all vendors specified in main.py. Sends email if stock is detected.
-    if vendor_name.lower().strip() == "newegg":
-        email_body = scrape_newegg(driver, vendor_name)
-        maybe_send_email(item, email_body, email_bodies, vendor_name)
-        return email_body
-    elif vendor_name.lower().strip() == "best buy":
-        email_body = scrape_bestbuy(driver, vendor_name)
-        maybe_send_email(item, email_body, email_bodies, vendor_name)
-        return email_body
-    elif vendor_name.lower().strip() == "memory express":
-        email_body = scrape_memory_express(driver, vendor_name)
-        maybe_send_email(item, email_body, email_bodies, vendor_name)
-        return email_body
-    elif vendor_name.lower().strip() == "canada computers":
-        email_body = scrape_canada_computers(driver, vendor_name)
-        maybe_send_email(item, email_body, email_bodies, vendor_name)
-        return email_body
-    elif vendor_name.lower().strip() == "amazon":
-        email_body = scrape_amazon(driver, vendor_name)
-        maybe_send_email(item, email_body, email_bodies, vendor_name)
-        return email_body
-            
-    elif vendor_name.lower().strip() == "pc canada":
-        email_body = scrape_pc_canada(driver, vendor_name)
-        maybe_send_email(item, email_body, email_bodies, vendor_name)
-        return email_body
-    else:
-        raise ValueError("Vendor specified does not match existing vendors.")
+    if lean_browsing_enabled:
+        block_vendor_requests(driver, vendor_key)
+
+    try:
+        wait_for_turn(URL)
+        with timed(page_load_duration, vendor_name):
+            driver.get(URL)
+            wait_until_ready(driver, vendor_key, *plan.ready_when)
+        report_success(URL)
+        with timed(extraction_duration, vendor_name):
+            if page_cache_enabled and not plan.paginated:
+                stock_dict, unread_URLs = scrape_page_with_cache(
+                    URL, region_html_in_browser(driver, plan.cache_region),
+                    lambda: scrape_listing_page(plan, URL, driver, vendor_name))
+            else:
+                stock_dict, unread_URLs = scrape_listing_page(plan, URL, driver, vendor_name)
+    except PageNotReady as e:
+        if looks_rate_limited(driver.title):
+            report_blocked(URL)
+            raise RateLimited(f"{vendor_name} showed '{driver.title}'")
+        page_timeouts.inc(vendor_name)
+        # Not the same as "no stock": the previous results stand until the page can be read again
+        print(f"Page not ready, keeping previous results: {e}")
+        return None
 
+    return keep_unread_observations(observations_from_stock_dict(vendor_name, stock_dict),
+                                    previous_observations or {}, unread_URLs)
 
-def scrape_newegg(driver, vendor_name):
-    """Scrapes a single newegg.ca webpage with multiple listings for any in-stock items.
 
-    :param driver: an initialized webdriver
-    :param vendor_name: the name of the vendor for the respective webpage
-    :return: email_body
-    """
-    # Check all listings on page for stock
-    stock_dict = {}
+def scrape_vendor_http(vendor_name, URL, previous_observations=None):
+    """Scrapes respective vendor URL without a browser, for vendors whose pages are rendered server-side
 
-    listings = driver.find_elements_by_class_name("item-cell")
-    for listing in listings:
-        item_name = listing.find_element_by_class_name("item-title").text
-        item_URL = listing.find_element_by_class_name("item-title").get_attribute("href")
-        price = listing.find_element_by_class_name("price-current").text
-        stock_status = listing.find_element_by_class_name("item-promo").text
-        secondary_stock_status = listing.find_element_by_class_name("item-button-area").text
-        if ("OUT OF STOCK" not in stock_status 
-            and "SOLD OUT" not in stock_status
-            and "AUTO NOTIFY" not in secondary_stock_status):
-                stock_dict[item_name] = {}
-                stock_dict[item_name]["url"] = item_URL
-                stock_dict[item_name]["price"] = price
-                print(f"Online stock found: \n{item_URL} for {price}")
-                stock_dict[item_name]["online stock status"] = "In stock"
-                stock_dict[item_name]["in store status"] = "Not checked"
-                stock_dict[item_name]["backorder status"] = "Not checked"
+    :param vendor_name: a given vendor name, specified in main.py
+    :param URL: a respective URL to scrape, attached to vendor_name
+    :param previous_observations: the vendor's observations from the previous scan, keyed by SKU, kept for the
+        items on the page that could not be read
+    :return: the page's observations keyed by SKU, or None if the page has to be scraped with a webdriver instead
+    """
+    plan = vendor_plan(vendor_name)
+    if (not http_fetch_enabled or plan is None or not plan.http_fetch
+            or (plan.detail_parser is not None and plan.detail_parser not in http_detail_parsers)):
+        return None
 
-    email_body = generate_email_body(stock_dict, vendor_name)
+    title_line(vendor_name)
+    try:
+        if page_cache_enabled and not plan.paginated:
+            # A 304 means the page is unchanged, so the last scan's results still hold
+            cached_page = page_cache.get(URL)
+            with timed(page_load_duration, vendor_name):
+                response = fetch_response(URL, headers=page_cache.conditional_headers(URL))
+            if response.status_code == 304 and cached_page is not None:
+                print("Page not modified since last scan.")
+                stock_dict, unread_URLs = cached_page.stock_dict, []
+            else:
+                with timed(extraction_duration, vendor_name):
+                    tree = parse_response(response)
+                    stock_dict, unread_URLs = scrape_page_with_cache(URL, region_html(tree, plan.cache_region),
+                                                        lambda: scrape_listing_page_http(plan, URL, tree, vendor_name),
+                                                        response.headers.get("ETag"),
+                                                        response.headers.get("Last-Modified"))
+        else:
+            with timed(page_load_duration, vendor_name):
+                tree = fetch_page(URL)
+            with timed(extraction_duration, vendor_name):
+                stock_dict, unread_URLs = scrape_listing_page_http(plan, URL, tree, vendor_name)
+    except (requests.RequestException, PageNeedsJavaScript) as e:
+        # RateLimited is left to the caller, since retrying the same page in a browser would only make the block
+        # last longer
+        print(f"Falling back to browser for {vendor_name}: {e}")
+        return None
 
-    return email_body
+    return keep_unread_observations(observations_from_stock_dict(vendor_name, stock_dict),
+                                    previous_observations or {}, unread_URLs)
 
 
-def scrape_bestbuy(driver, vendor_name):
-    """Scrapes a single bestbuy.ca webpage with multiple listings for any in-stock items.
+def scrape_vendor_api(vendor_name, URL, previous_observations=None):
+    """Checks the items last seen on a vendor's listing page through the vendor's JSON availability API
 
-    :param vendor_name: the name of the webpage vendor
-    :param driver: an initialized webdriver
-    :return: the email message body
+    :param vendor_name: a given vendor name, specified in main.py
+    :param URL: a respective URL to scrape, attached to vendor_name
+    :param previous_observations: the vendor's observations from the previous scan, keyed by SKU, kept for the
+        items that could not be read
+    :return: the page's observations keyed by SKU, or None if the listing page has to be scraped instead
     """
-    # Check all listings on page for stock
-    stock_dict = {} 
-
-    listings = driver.find_elements_by_xpath("//a[@itemprop='url']")
-    for listing in listings:
-        item_URL = listing.get_attribute("href")
-        item_name = listing.find_element_by_class_name("productItemName_3IZ3c").text
-        price = listing.find_element_by_class_name("price_FHDfG").text
-        if ("Available to ship" in listing.text
-            or "Available online only" in listing.text
-            or "Available at nearby stores" in listing.text
-            or "Available for backorder" in listing.text):
-            stock_dict[item_name] = {}
-            stock_dict[item_name]["url"] = item_URL
-            stock_dict[item_name]["price"] = price
-        
-            # Online
-            if "Available to ship" in listing.text or "Available online only" in listing.text:
-                print(f"Online stock found: \n{item_URL} for {price}")
-                stock_dict[item_name]["online stock status"] = "In stock"
-            else:
-                stock_dict[item_name]["online stock status"] = "Out of stock"
+    plan = vendor_plan(vendor_name)
+    if not availability_api_enabled or plan is None or plan.api_client is None:
+        return None
+    listings_by_sku = sku_catalog.listings(URL)
+    if listings_by_sku is None or availability_client(plan.api_client) is None:
+        return None
 
-            # In store    
-            if "Available at nearby stores" in listing.text:
-                stock_dict[item_name]["in store status"] = "In store"
-                stock_dict[item_name]["store location"] = "Store location unspecified"
-            else:
-                stock_dict[item_name]["in store status"] = "Unavailable in store"
+    title_line(vendor_name)
+    try:
+        with timed(page_load_duration, vendor_name):
+            stock_dict, unread_URLs = scrape_availability_api(plan, listings_by_sku)
+    except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+        # RateLimited is left to the caller, as in scrape_vendor_http()
+        print(f"Falling back to the listing page for {vendor_name}: {e}")
+        sku_catalog.pause(URL)
+        return None
+
+    return keep_unread_observations(observations_from_stock_dict(vendor_name, stock_dict),
+                                    previous_observations or {}, unread_URLs)
 
-            # Backorder
-            if "Available for backorder" in listing.text:
-                print(f"Backorder stock found: \n{item_URL} for {price}")
-                stock_dict[item_name]["backorder status"] = "Available for backorder"
-            else:
-                stock_dict[item_name]["backorder status"] = "Unavailable for backorder"
 
-    email_body = generate_email_body(stock_dict, vendor_name)
+def scrape_availability_api(plan, listings_by_sku):
+    """Looks up the availability of a vendor's known listings through its JSON API, in as few requests as it allows
 
-    return email_body
+    :param plan: the vendor's ExtractionPlan, with an api_client
+    :param listings_by_sku: a dictionary of the vendor's SKUs to their listings, from ExtractionPlan.api_skus()
+    :return: (stock_dict, unread_URLs), as ExtractionPlan.read_api_stock() returns
+    """
+    availability = poll_availability(availability_client(plan.api_client), list(listings_by_sku), plan.api_batch_size)
+    return stock_dict_from_availability(plan, listings_by_sku, availability)
 
 
-def scrape_memory_express(driver, vendor_name):
-    """Scrapes a single memoryexpress.com webpage with multiple listings for any in-stock items.
+def stock_dict_from_availability(plan, listings_by_sku, availability):
+    """Builds the stock dictionary of a vendor's known listings from their availability through its API,
+    and the price limits and other conditions in its availability_api's stock_rules
 
+    :param plan: the vendor's ExtractionPlan
+    :param listings_by_sku: a dictionary of the vendor's SKUs to their listings, from ExtractionPlan.api_skus()
+    :param availability: a dictionary of SKUs to availability, as AvailabilityClient.fetch() returns
+    :return: (stock_dict, unread_URLs), as ExtractionPlan.read_api_stock() returns
+    """
+    listings_and_availability = []
+    for sku, listing in listings_by_sku.items():
+        if sku not in availability:
+            continue
+        # The API's price is more recent than the one on the listing page the SKU was found on
+        if "price" in availability[sku] and "price" in plan.item_fields:
+            listing = dict(listing, **{plan.item_fields["price"]: availability[sku]["price"]})
+        listings_and_availability.append((listing, availability[sku]))
+    return plan.read_api_stock(listings_and_availability)
+
+
+def scrape_page_with_cache(URL, page_region_html, scrape_page, etag=None, last_modified=None):
+    """Reuses the last scan's stock dictionary for URL if the hashed page region is unchanged,
+    otherwise scrapes the page and caches the result. A page with items that could not be read is not cached,
+    so they are read again next scan.
+
+    :param URL: the page URL
+    :param page_region_html: the HTML of the page's cache region, see cache_region in the vendor definitions
+    :param scrape_page: a function with no arguments that scrapes the page and returns (stock_dict, unread_URLs)
+    :param etag: the ETag response header, if the page was downloaded without a browser
+    :param last_modified: the Last-Modified response header, if the page was downloaded without a browser
+    :return: (stock_dict, unread_URLs)
+    """
+    page_hash = content_hash(page_region_html)
+    cached_page = page_cache.get(URL)
+    if page_hash is not None and cached_page is not None and cached_page.content_hash == page_hash:
+        print("Listings unchanged since last scan.")
+        # So are the SKUs found on it, for vendors polled through an availability API
+        sku_catalog.renew(URL)
+        return cached_page.stock_dict, []
+
+    stock_dict, unread_URLs = scrape_page()
+    # An empty region means the listings did not render, so there is nothing worth comparing against later
+    if page_hash is not None and len(unread_URLs) == 0:
+        page_cache.store(URL, page_hash, stock_dict, etag, last_modified)
+    return stock_dict, unread_URLs
+
+
+def scrape_listing_page(plan, URL, driver, vendor_name):
+    """Scrapes a vendor's listing page loaded in the webdriver, the pages after it that are worth reading,
+    and the product pages they link to, for any in-stock items.
+
+    :param plan: the vendor's ExtractionPlan
+    :param URL: the listing page URL
+    :param driver: an initialized webdriver with the listing page loaded
     :param vendor_name: the name of the webpage vendor
-    :param driver: an initialized webdriver
-    :return: email_body
+    :return: (stock_dict, unread_URLs), where unread_URLs are the product URLs of items that could not be read
+    """
+    # Check all listings on every page read for stock
+    listings = list(iter_listings_in_browser(plan, URL, driver, vendor_name))
+    stock_dict, unread_URLs = plan.read_stock(listings)
+    # Later scans poll these SKUs through the vendor's availability API instead, if it has one
+    if plan.api_client is not None:
+        sku_catalog.remember(URL, plan.api_skus(listings))
+
+    # Loads the individual pages for where stock may have been detected side by side
+    detail_urls = plan.detail_urls(listings)
+    if len(detail_urls) != 0:
+        with timed(detail_pages_duration, vendor_name):
+            detail_stock_dict, unread_detail_URLs = scrape_detail_pages_in_tabs(
+                driver, detail_urls, browser_detail_parsers[plan.detail_parser], vendor_name)
+        stock_dict.update(detail_stock_dict)
+        unread_URLs += unread_detail_URLs
+
+    return stock_dict, unread_URLs
+
+
+def scrape_listing_page_http(plan, URL, tree, vendor_name):
+    """Scrapes a vendor's listing page downloaded without a browser, the pages after it that are worth reading,
+    and the product pages they link to, for any in-stock items.
+
+    :param plan: the vendor's ExtractionPlan
+    :param URL: the listing page URL
+    :param tree: the parsed webpage, from fetch_page()
+    :param vendor_name: the name of the webpage vendor
+    :return: (stock_dict, unread_URLs), where unread_URLs are the product URLs of items that could not be read
     """
-    # Add or comment/uncomment desired store location names here, case sensitive
-    stores_to_check = [
-        "Vancouver",
-        # "Victoria",
-        "Burnaby",
-        "Richmond",
-    ]
-
-    # Check all listings on page for stock
-    memory_express_urls = []
-    
-    stock_status_elements = driver.find_elements_by_class_name("c-shca-add-product-button")  # Contains stock information text
-    for stock_status in stock_status_elements:
-        if "Buy this item" in stock_status.get_attribute('title'):
-            item_URL_element = stock_status.find_element_by_xpath('./../../../div[1]/div[2]/div[2]/a')
-            item_URL = item_URL_element.get_attribute("href")
-            memory_express_urls.append(item_URL)
-
-    # Iterates through individual pages for where stock may have been detected
+    listings = list(iter_listings_http(plan, URL, tree, vendor_name))
+    if len(listings) == 0:
+        raise PageNeedsJavaScript(f"no {vendor_name} listings in page")
+    stock_dict, unread_URLs = plan.read_stock(listings)
+    if plan.api_client is not None:
+        sku_catalog.remember(URL, plan.api_skus(listings))
+
+    # Downloads the individual pages for where stock may have been detected in parallel
+    detail_urls = plan.detail_urls(listings)
+    if len(detail_urls) != 0:
+        with timed(detail_pages_duration, vendor_name):
+            detail_stock_dict, unread_detail_URLs = scrape_detail_pages_http(
+                detail_urls, http_detail_parsers[plan.detail_parser], vendor_name, use_cache=page_cache_enabled)
+        stock_dict.update(detail_stock_dict)
+        unread_URLs += unread_detail_URLs
+
+    return stock_dict, unread_URLs
+
+
+def parse_memory_express_product_page(driver, URL):
+    """Reads online and in-store stock from a memoryexpress.com product page
+
+    :param driver: an initialized webdriver with the product page loaded in the current tab
+    :param URL: the product page URL
+    :return: a stock dictionary for the product
+    """
+    plan = vendor_plan("memory express")
+    wait_until_ready(driver, "memory express product", *plan.detail_ready_when)
+
+    # The online store is a row of the store table, so one read covers online and in-store stock
+    item_name = driver.title.rstrip("- Memory Express Inc.")
+    inventory = read_store_inventory_in_browser(driver, *plan.store_inventory)
+
     stock_dict = {}
-    for URL in memory_express_urls:
-        driver.get(URL)
-        driver.implicitly_wait(10)
-
-        # Stores item and link details
-        item_name = driver.title.rstrip("- Memory Express Inc.")
-        stock_dict[item_name] = {}
-        stock_dict[item_name]["url"] = URL
-        
-        # Checks online stock status before proceeding
-        stores_inventory = driver.find_elements_by_class_name('c-capr-inventory-store__name')
-        for store_location in stores_inventory:
-            if "Online Store" in store_location.text:
-                store_stock = (store_location.find_element_by_xpath('./../span[2]')).text
-                if (store_stock != "Out of Stock" 
-                    and store_stock != "Backorder"
-                    and int(store_stock.rstrip("+")) > 0):
-                    print(f"Online stock found: \n{URL}")
-                    stock_dict[item_name]["online stock status"] = "In stock"
-                else:
-                    stock_dict[item_name]["online stock status"] = "Out of stock"
-
-        if len(stores_to_check) != 0:
-            # Expand the stores availability frame
-            all_stores_toggle = driver.find_element_by_css_selector(".c-capr-inventory-selector__toggle")
-            driver.execute_script("arguments[0].setAttribute('class','c-capr-inventory-selector__toggle c-capr-inventory-selector__toggle--opened')", all_stores_toggle)
-            second_stores_toggle = driver.find_element_by_css_selector(".c-capr-inventory-selector__dropdown-container")
-            driver.execute_script("arguments[0].setAttribute('class','c-capr-inventory-selector__dropdown-container')", second_stores_toggle)
-            stores_inventory = driver.find_elements_by_class_name('c-capr-inventory-store__name')
-
-            # Checks and stores local store stock status for item
-            stock_dict[item_name]["in store status"] = "No store stock"
-            for store_location in stores_inventory:
-                store_stock = (store_location.find_element_by_xpath('./../span[2]')).text
-                if (store_stock != "Out of Stock" 
-                    and store_stock != "Backorder" 
-                    and int(store_stock.rstrip("+*")) > 0):
-                    store = (store_location.text).rstrip(':')
-                    if store in stores_to_check:
-                        print(f"In-store stock found at {store}: \n{URL}")
-                        stock_dict[item_name]["in store status"] = "In store"
-                        if "store location" in stock_dict[item_name]:
-                            stock_dict[item_name]["store location"] += f", {store}"
-                        else:
-                            stock_dict[item_name]["store location"] = store 
+    add_memory_express_item(stock_dict, item_name, URL, inventory)
+    return stock_dict
+
+
+def add_memory_express_item(stock_dict, item_name, URL, inventory):
+    """Adds a memoryexpress.com product page's online and in-store stock to the stock dictionary
+
+    :param stock_dict: the stock summary dictionary being built by the scraping function
+    :param item_name: the product name, from the page title
+    :param URL: the product page URL
+    :param inventory: a dictionary of store names, including "Online Store", to quantities
+    """
+    stock_dict[item_name] = {}
+    stock_dict[item_name]["url"] = URL
+
+    # Checks online stock status
+    if "Online Store" in inventory:
+        if inventory["Online Store"] > 0:
+            print(f"Online stock found: \n{URL}")
+            stock_dict[item_name]["online stock status"] = "In stock"
         else:
-            stock_dict[item_name]["in store status"] = "Not checked" 
+            stock_dict[item_name]["online stock status"] = "Out of stock"
 
-        stock_dict[item_name]["backorder status"] = "Not checked"
-        
-    email_body = generate_email_body(stock_dict, vendor_name)
+    # Checks and stores local store stock status for item
+    stores_to_check = selected_stores("Memory Express", memory_express_stores_to_check, store_search_postal_code,
+                                      store_search_radius_km)
+    if len(stores_to_check) != 0:
+        add_store_stock(stock_dict[item_name], URL, inventory, stores_to_check)
+    else:
+        stock_dict[item_name]["in store status"] = "Not checked"
 
-    return email_body
+    stock_dict[item_name]["backorder status"] = "Not checked"
 
 
-def scrape_canada_computers(driver, vendor_name):
-    """Scrapes a single canadacomputers.com webpage with multiple listings for any in-stock items.
+def parse_canada_computers_product_page(driver, URL):
+    """Reads online and in-store stock from a canadacomputers.com product page
 
-    :param vendor_name: the name of the webpage vendor
-    :param driver: an initialized webdriver
-    :return: email_body
+    :param driver: an initialized webdriver with the product page loaded in the current tab
+    :param URL: the product page URL
+    :return: a stock dictionary for the product
     """
-    # Add or comment/uncomment desired store location names here, case sensitive
-    stores_to_check = [
-        # Ontario
-        "Markham",
-        "Midtown Toronto",
-        "Richmond Hill",
-        "Etobicoke",
-        "Newmarket",
-        "North York",
-        "Vaughan",
-        "Downtown Toronto",
-        "Ajax",
-        "Mississauga",
-        "Brampton",
-        "Scarborough",
-
-        # BC
-        "Vancouver Broadway",
-        "East Vancouver",
-        "Burnaby",
-        "Richmond",
-    ]
-
-    # Check all listings on page for stock
-    canada_computer_urls = []
+    plan = vendor_plan("canada computers")
+    wait_until_ready(driver, "canada computers product", *plan.detail_ready_when)
     stock_dict = {}
 
-    listings = driver.find_elements_by_class_name("stocklevel-pop")
-    for listing in listings:
-        listing_info = listing.find_element_by_xpath("following-sibling::div[1]")
-        try:
-            driver.implicitly_wait(0.01) # Give the scraper 10 ms to look for the element below
-            item_URL = ((listing_info.find_element_by_class_name("productImageSearch")).find_element_by_tag_name("a")).get_attribute("href")
-            # pq-hdr-bolder contains stock information text if the item is in stock at all, otherwise does not appear on page
-            stock_status_element = listing_info.find_elements_by_class_name('pq-hdr-bolder') 
-            if (len(stock_status_element) != 0
-                and "not available" not in stock_status_element.text.lower() 
-                and "back order" not in stock_status_element.text.lower()):
-                    canada_computer_urls.append(item_URL)
-        except:  # When stock_status_element is not on the page for that listing, move on to the next listing
-            pass
-       
-
-    # Iterates through individual pages for where stock may have been detected
-    for URL in canada_computer_urls:
-        driver.get(URL)
-        driver.implicitly_wait(10)
-        # Looks for items in stock online vs in store
-        for elements in driver.find_elements_by_class_name('pi-prod-availability'):
-            item_name = driver.title.rstrip("| Canada Computers & Electronics")
-            stock_dict[item_name] = {}
-            stock_dict[item_name]["url"] = URL
-            # Checks and stores online stock status for item
-            if "Online In Stock" in elements.text:
-                print(f"Online stock found: \n{URL}")
-                stock_dict[item_name]["online stock status"] = "In stock"
-            else:
-                stock_dict[item_name]["online stock status"] = "Out of stock"
-
-            # Checks and stores local store stock status for item
-            if len(stores_to_check) != 0:
-                if "Available In Stores" in elements.text:
-                    # Opens inventory view for all stores
-                    other_stores = driver.find_element_by_css_selector(".stocklevel-pop")
-                    driver.execute_script("arguments[0].setAttribute('class','stocklevel-pop d-block')", other_stores)
-
-                    # Only changes if stock at desired store is detected
-                    stock_dict[item_name]["in store status"] = "No store stock"
-
-                    for store in stores_to_check:
-                        # Finds store's name on webpage
-                        store_element = driver.find_element_by_link_text(store)
-                        # Finds stock value by xpath relative to store name
-                        stock = store_element.find_element_by_xpath('./../../../div[2]/div/p/span').text
-
-                        # Converts stock value into integer
-                        if stock == "-":
-                            stock = 0
-                        else:
-                            stock = int(stock[0:1])  # Truncates 5+ to 5
-                        
-                        if stock > 0:
-                            print(f"In-store stock found at {store}: \n{URL}")
-                            stock_dict[item_name]["in store status"] = "In store"
-                            if "store location" in stock_dict[item_name]:
-                                stock_dict[item_name]["store location"] += f", {store}"
-                            else:
-                                stock_dict[item_name]["store location"] = store 
-                else:
-                    stock_dict[item_name]["in store status"] = "No store stock"
-            else:
-                stock_dict[item_name]["in store status"] = "Not checked"
-            
-            stock_dict[item_name]["backorder status"] = "Not checked"
-            
-    email_body = generate_email_body(stock_dict, vendor_name)
+    # Looks for items in stock online vs in store
+    for elements in driver.find_elements_by_class_name('pi-prod-availability'):
+        item_name = driver.title.rstrip("| Canada Computers & Electronics")
+        availability_text = elements.text
 
-    return email_body
+        # The whole store table is read at once, without opening its popup
+        inventory = {}
+        if "Available In Stores" in availability_text and len(canada_computers_stores()) != 0:
+            inventory = read_store_inventory_in_browser(driver, *plan.store_inventory)
 
+        add_canada_computers_item(stock_dict, item_name, URL, availability_text, inventory)
 
-def scrape_amazon(driver, vendor_name):
-    """Scrapes a single amazon.ca webpage with multiple listings for any in-stock items.
+    return stock_dict
 
-    :param driver: an initialized webdriver
-    :param vendor_name: the name of the vendor for the respective webpage
-    :return: email_body
+
+def parse_canada_computers_product_page_http(product_page, URL):
+    """Reads online and in-store stock from a canadacomputers.com product page downloaded without a browser
+
+    :param product_page: the parsed product page, from fetch_page()
+    :param URL: the product page URL
+    :return: a stock dictionary for the product
     """
-    # Check all listings on page for stock
+    plan = vendor_plan("canada computers")
     stock_dict = {}
-    price_limit = 1400
+    item_name = product_page.findtext(".//title", "").strip().rstrip("| Canada Computers & Electronics")
+    for elements in select_elements(product_page, ".pi-prod-availability"):
+        availability_text = " ".join(elements.text_content().split())
 
-    listings = driver.find_elements_by_class_name("ProductGridItem__itemOuter__5ow0w")
-    for listing in listings:
-        item_URL = listing.find_element_by_class_name("ProductGridItem__overlay__1ncmn").get_attribute("href")
-        item_name = listing.find_element_by_class_name("ProductGridItem__title__2C1kS").text
-        price_div_element = listing.find_element_by_class_name("ProductGridItem__price__2H_kW") 
-        if price_div_element.text != "":  # If out of stock, no price will be shown in this div element
-            price = float((listing.find_element_by_class_name("style__whole__3EZEk").text).replace(",", "")) # Formats the price to float
-            # Set price limits here
-            if price < price_limit:
-                stock_dict[item_name] = {}
-                stock_dict[item_name]["url"] = item_URL
-                stock_dict[item_name]["price"] = price
-                print(f"Online stock found: \n{item_URL} for {price}")
-                stock_dict[item_name]["online stock status"] = "In stock"
-                stock_dict[item_name]["in store status"] = "Not checked"
-                stock_dict[item_name]["backorder status"] = "Not checked"
+        # The store inventory table is in the page source even while it is hidden
+        inventory = {}
+        if "Available In Stores" in availability_text and len(canada_computers_stores()) != 0:
+            inventory = read_store_inventory(product_page, *plan.store_inventory)
 
-    email_body = generate_email_body(stock_dict, vendor_name)
+        add_canada_computers_item(stock_dict, item_name, URL, availability_text, inventory)
 
-    return email_body
+    return stock_dict
 
 
-def scrape_pc_canada(driver, vendor_name):
-    """Scrapes a single pc-canada.com webpage with multiple listings for any in-stock items.
+def add_canada_computers_item(stock_dict, item_name, URL, availability_text, inventory):
+    """Adds a canadacomputers.com product page's online and in-store stock to the stock dictionary
 
-    :param vendor_name: the name of the webpage vendor
-    :param driver: an initialized webdriver
-    :return: email_body
+    :param stock_dict: the stock summary dictionary being built by the scraping function
+    :param item_name: the product name, from the page title
+    :param URL: the product page URL
+    :param availability_text: the text of the product's pi-prod-availability element
+    :param inventory: a dictionary of store names to quantities, empty if the stores were not read
     """
+    stock_dict[item_name] = {}
+    stock_dict[item_name]["url"] = URL
+    # Checks and stores online stock status for item
+    if "Online In Stock" in availability_text:
+        print(f"Online stock found: \n{URL}")
+        stock_dict[item_name]["online stock status"] = "In stock"
+    else:
+        stock_dict[item_name]["online stock status"] = "Out of stock"
 
-    # Check all listings on page for stock
-    stock_dict = {}
+    # Checks and stores local store stock status for item
+    if len(canada_computers_stores()) != 0:
+        add_store_stock(stock_dict[item_name], URL, inventory, canada_computers_stores())
+    else:
+        stock_dict[item_name]["in store status"] = "Not checked"
 
-    stock_status_elements = driver.find_elements_by_css_selector("p.text-theme-shipping")  # Contains stock information text
-    for stock_status in stock_status_elements:
-        if "On Backorder" not in stock_status.text and "" != stock_status.text:
-            item_URL_element = stock_status.find_element_by_xpath('./../../../../div[5]/div[1]/p/a')
-            item_URL = item_URL_element.get_attribute("href")
-            item_name = item_URL_element.text
-            print(item_name)
-            stock_dict[item_name] = {}
-            stock_dict[item_name]["url"] = item_URL
-            print(f"Online stock found: \n{item_URL}")
-            stock_dict[item_name]["online stock status"] = "In stock"
-            stock_dict[item_name]["in store status"] = "Not checked"
-            stock_dict[item_name]["backorder status"] = "Not checked"
+    stock_dict[item_name]["backorder status"] = "Not checked"
+
+
+def select_stores(vendor_names):
+    """Works out the stores checked for each vendor with store inventory, once at startup, so a postal code is
+    looked up before the first scan instead of from inside one
+
+    :param vendor_names: the names of the vendors being scanned
+    """
+    if "Memory Express" in vendor_names:
+        selected_stores("Memory Express", memory_express_stores_to_check, store_search_postal_code,
+                        store_search_radius_km)
+    if "Canada Computers" in vendor_names:
+        canada_computers_stores()
 
-    email_body = generate_email_body(stock_dict, vendor_name)
 
-    return email_body
+def canada_computers_stores():
+    """Returns the Canada Computers stores to check, from canada_computers_stores_to_check and the postal code"""
+    return selected_stores("Canada Computers", canada_computers_stores_to_check, store_search_postal_code,
+                           store_search_radius_km)
 
 
-def generate_email_body(stock_dict, vendor_name):
-    """Generates an email body based on passed stock dictionary and vendor
+def add_store_stock(item_stock, URL, inventory, stores_to_check):
+    """Sets an item's in-store status from its store inventory
 
-    :param stock_dict: a stock summary dictionary created in the scraping function
+    :param item_stock: the item's entry in the stock dictionary
+    :param URL: the product page URL
+    :param inventory: a dictionary of store names to quantities
+    :param stores_to_check: a set of the store names wanted
+    """
+    stores_in_stock = [store for store, quantity in inventory.items() if quantity > 0 and store in stores_to_check]
+    if len(stores_in_stock) == 0:
+        item_stock["in store status"] = "No store stock"
+        return
+    for store in stores_in_stock:
+        print(f"In-store stock found at {store}: \n{URL}")
+    item_stock["in store status"] = "In store"
+    item_stock["store location"] = ", ".join(stores_in_stock)
+
+
+# Product page parsing functions, keyed by the parser names used in the detail_pages of vendor definitions
+browser_detail_parsers = {
+    "memory express product": parse_memory_express_product_page,
+    "canada computers product": parse_canada_computers_product_page,
+}
+http_detail_parsers = {
+    "canada computers product": parse_canada_computers_product_page_http,
+}
+
+
+def generate_email_body(observations, vendor_name):
+    """Generates an email body based on passed stock observations and vendor
+
+    :param observations: a list of StockObservation to include
     :param vendor_name: the name of the vendor that was scraped
     """
     # Creates a summary list of items in stock, differentiating online vs in store
     stock_summary = []
-    for item, details in stock_dict.items():
-        if details["online stock status"] == "In stock":
-            stock_summary.append(f"{item} is in stock ONLINE at {vendor_name} for {details['price']}\n"
-                                 f"{details['url']}\n\n")
-        if details["in store status"] == "In store":
-            stock_summary.append(f"{item} is in stock IN STORE at {vendor_name} for {details['price']}\n"
-                                 f"{details['store location'].upper()}\n"
-                                 f"{details['url']}\n\n")
-        if details["backorder status"] == "Available for backorder":
-            stock_summary.append(f"{item} is AVAILABLE FOR BACKORDER at {vendor_name} for {details['price']}\n"
-                                 f"{details['url']}\n\n")                        
+    for observation in observations:
+        price = f" for {observation.price}" if observation.price is not None else ""
+        if observation.online is Availability.AVAILABLE:
+            stock_summary.append(f"{observation.name} is in stock ONLINE at {vendor_name}{price}\n"
+                                 f"{observation.url}\n\n")
+        if observation.in_store is Availability.AVAILABLE:
+            store_location = ", ".join(observation.store_locations) or "Store location unspecified"
+            stock_summary.append(f"{observation.name} is in stock IN STORE at {vendor_name}{price}\n"
+                                 f"{store_location.upper()}\n"
+                                 f"{observation.url}\n\n")
+        if observation.backorder is Availability.AVAILABLE:
+            stock_summary.append(f"{observation.name} is AVAILABLE FOR BACKORDER at {vendor_name}{price}\n"
+                                 f"{observation.url}\n\n")
 
     # Generates an email message from the summary list
-    email_body = ""
-    for hits in stock_summary:
-        email_body += hits
+    return "".join(stock_summary)
 
-    return email_body
 
+def report_stock(watch_index, vendor_name, observations, previous_observations):
+    """Alerts on anything new since the last scan, once for each watch it matches
 
-def maybe_send_email(item, email_body, email_bodies, vendor_name):
-    """Sends an email if the email body is not blank and is not the same as the previous email body
-    Prevents spamming emails. Optionally sends a discord message too.
+    :param watch_index: a WatchIndex of every watch
+    :param vendor_name: the vendor name
+    :param observations: this scan's observations of every page of the vendor, keyed by SKU
+    :param previous_observations: the vendor's observations from the previous scan, keyed by SKU
+    :return: none
+    """
+    stock_diff = diff_observations(previous_observations, observations)
+    alerts_by_watch = watch_index.group(stock_diff.alerts())
+    for watch, alerts in alerts_by_watch.items():
+        maybe_send_email(watch.name, alerts, vendor_name)
+
+    if len(alerts_by_watch) == 0:
+        if len(watch_index.group(stock_diff.in_stock())) != 0:
+            print("Previous email items still in stock.")
+        else:
+            print("No stock found")
+
+
+def maybe_send_email(item, alerts, vendor_name):
+    """Queues an alert for items that came into stock, or became available through another channel or store,
+    since the previous scan. Prevents spamming emails. The alert is sent by the notification dispatcher.
 
-    :param item: the name of the item being checked for
-    :param email_body: a string containing in-stock items
-    :param email_bodies: the email body from the previous email sent, "" if no previous body
+    :param item: the name of the watch the items matched
+    :param alerts: the watch's StockObservation worth alerting on, from StockDiff.alerts()
     :param vendor_name: the vendor name
     :return: none
     """
-    # Only sends if the email body does not start the same as the last email sent
-    if email_body != "" and email_body[:20] not in email_bodies[vendor_name]:
-        print("Stock detected. Sending selected message types.")
-        
+    if len(alerts) != 0:
+        print(f"{item} stock detected. Sending selected message types.")
+        email_body = generate_email_body(alerts, vendor_name)
+
         # Comes up with the subject line based on availability type
-        if "online" in email_body.lower() and "in store" in email_body.lower():
+        online = any(observation.online is Availability.AVAILABLE for observation in alerts)
+        in_store = any(observation.in_store is Availability.AVAILABLE for observation in alerts)
+        if online and in_store:
             subject = f"{item} in Stock ONLINE and IN STORE at {vendor_name}"
-        elif "online" in email_body.lower():
+        elif online:
             subject = f"{item} in Stock ONLINE at {vendor_name}"
-        elif "in store" in email_body.lower():
+        elif in_store:
             subject = f"{item} in Stock IN STORE at {vendor_name}"
-        elif "backorder" in email_body.lower():
+        else:
             subject = f"{item} available for BACKORDER at {vendor_name}"
 
-        # Sends different notification types
-        if beep_enabled:
-            make_beep_noise()
-        if discord_message_enabled:
-            try:
-                send_discord_message(subject, email_body)
-            except:
-                print("Error with sending discord message.")
-        if send_email:
-            send_email(subject, email_body) 
-
-    elif email_body != "":
-        print("Previous email items still in stock.")
-    else:
-        print("No stock found")
-
-
-def send_email(subject, email_body):
-    """Sends an email containing the in-stock item details and link to the desired recipients
-
-    :param subject: a string containing the in-stock status type and which website
-    :param email_body: a string containing in-stock model details and website link
-    :return: none
-    """
-    # Load sensitive login data from local .env file
-    dotenv.load_dotenv()
-    GMAIL_LOGIN = os.getenv('EMAIL')
-    GMAIL_PASSWORD = os.getenv('PASSWORD')
-    RECIPIENTS = []
-    if os.getenv("RECIPIENT1") is not None:
-        RECIPIENTS.append(os.getenv("RECIPIENT1"))
-    if os.getenv("RECIPIENT2") is not None:
-        RECIPIENTS.append(os.getenv("RECIPIENT2"))
-    
-    to_addr = RECIPIENTS
-    from_addr = GMAIL_LOGIN
-    
-    msg = MIMEText(email_body)
-    msg['Subject'] = subject
-
-    server = smtplib.SMTP('smtp.gmail.com', 587)
-    server.ehlo()
-    server.starttls()
-    server.ehlo()
-    server.login(GMAIL_LOGIN, GMAIL_PASSWORD)
-    server.sendmail(from_addr, to_addr, msg.as_string())
-    server.close()
+        # Sends different notification types in the background
+        get_dispatcher().submit(item, vendor_name, subject, email_body)
 
 
 def title_line(vendor_name):
@@ -564,30 +649,3 @@ def title_line(vendor_name):
     while len(vendor_name) < 30:
         vendor_name += "-"
     print(vendor_name)
-
-
-def send_discord_message(subject, email_body):
-    """Sends an embedded message to your specific discord channel
-    
-    :param subject: the subject line of an email message
-    :param email_body: the email body of an email message
-    """
-    dotenv.load_dotenv()
-    webhook_url = os.getenv('DISCORD_WEBHOOK')
-    webhook = Webhook.from_url(webhook_url, adapter=RequestsWebhookAdapter())
-    embed = Embed(title=subject, description=email_body)
-    webhook.send(embed=embed, tts=True)
-
-
-def make_beep_noise():
-    """Makes an audible beep sound. Supports Windows and Linux."""
-    if beep_enabled:
-        if sys.platform == "win32":
-            duration = 1000
-            freq = 1000
-            winsound.Beep(freq, duration)
-        elif sys.platform == "linux":
-            # Documentation here: https://docs.python.org/3/library/sys.html#sys.platform 
-            beep(sound=1)
-        else:
-            print("Platform not supported for make_beep_noise().")
\ No newline at end of file
@@ -0,0 +1,222 @@
+"""This module contains typed stock records and the diff engine that decides what to alert on
+
+Each scan produces one StockObservation per item a vendor lists as available, keyed by SKU. Comparing a
+vendor's observations with the previous scan's gives the items that were added, removed or changed,
+so alerts go out exactly when something new comes into stock, regardless of listing order.
+
+Classes:
+    Availability
+    StockObservation
+    StockDiff
+
+Functions:
+    observations_from_stock_dict()
+    diff_observations()
+    keep_unread_observations()
+    sku_from_url()
+    parse_price()
+    observation_to_json()
+    observation_from_json()
+"""
+
+from dataclasses import dataclass
+from enum import Enum
+from urllib.parse import urlsplit
+import re
+
+
+class Availability(Enum):
+    """Whether an item can be bought through a given channel"""
+    AVAILABLE = "available"
+    UNAVAILABLE = "unavailable"
+    NOT_CHECKED = "not checked"
+
+
+@dataclass(frozen=True)
+class StockObservation:
+    """A single item's stock at a single vendor, as seen in one scan"""
+    __slots__ = ("vendor", "sku", "name", "url", "price", "online", "in_store", "backorder", "store_locations")
+    vendor: str
+    sku: str
+    name: str
+    url: str
+    price: float  # None when the vendor page shows no price
+    online: Availability
+    in_store: Availability
+    backorder: Availability
+    store_locations: tuple
+
+    @property
+    def in_stock(self):
+        """True if the item can be bought online, in store or on backorder"""
+        return (self.online is Availability.AVAILABLE
+                or self.in_store is Availability.AVAILABLE
+                or self.backorder is Availability.AVAILABLE)
+
+    def gained_availability(self, previous):
+        """Determines if this observation is worth alerting on compared to the same item's previous one
+
+        :param previous: the item's StockObservation from the previous scan
+        :return: True if a channel became available, or new stores have stock
+        """
+        return ((self.online is Availability.AVAILABLE and previous.online is not Availability.AVAILABLE)
+                or (self.in_store is Availability.AVAILABLE and previous.in_store is not Availability.AVAILABLE)
+                or (self.backorder is Availability.AVAILABLE and previous.backorder is not Availability.AVAILABLE)
+                or not set(self.store_locations) <= set(previous.store_locations))
+
+
+class StockDiff:
+    """The difference between two scans of the same vendor"""
+    __slots__ = ("added", "removed", "changed", "current")
+
+    def __init__(self, added, removed, changed, current):
+        """
+        :param added: observations for SKUs that were not in the previous scan
+        :param removed: previous observations for SKUs missing from this scan
+        :param changed: (previous, current) pairs for SKUs whose details changed
+        :param current: every observation in this scan, keyed by SKU
+        """
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.current = current
+
+    def alerts(self):
+        """Returns the observations worth notifying about: new in-stock items, and items that gained a
+        channel or store since the previous scan. Price-only changes and items going out of stock are not alerted.
+
+        :return: a list of StockObservation
+        """
+        alerts = [observation for observation in self.added if observation.in_stock]
+        alerts += [current for previous, current in self.changed
+                   if current.in_stock and current.gained_availability(previous)]
+        return alerts
+
+    def in_stock(self):
+        """Returns every observation in this scan that can be bought"""
+        return [observation for observation in self.current.values() if observation.in_stock]
+
+
+def diff_observations(previous, current):
+    """Compares two scans of the same vendor
+
+    :param previous: the previous scan's observations, keyed by SKU
+    :param current: this scan's observations, keyed by SKU
+    :return: a StockDiff
+    """
+    added = [observation for sku, observation in current.items() if sku not in previous]
+    removed = [observation for sku, observation in previous.items() if sku not in current]
+    changed = [(previous[sku], observation) for sku, observation in current.items()
+               if sku in previous and previous[sku] != observation]
+    return StockDiff(added, removed, changed, current)
+
+
+def keep_unread_observations(observations, previous_observations, unread_URLs):
+    """Keeps the previous observation of each item that could not be read this scan, e.g. because its product
+    page failed to load, so it isn't taken as removed now and alerted on as new once it can be read again
+
+    :param observations: this scan's observations, keyed by SKU, updated in place
+    :param previous_observations: the previous scan's observations, keyed by SKU
+    :param unread_URLs: the product URLs of the items that could not be read
+    :return: observations
+    """
+    for URL in unread_URLs:
+        sku = sku_from_url(URL)
+        if sku in previous_observations and sku not in observations:
+            observations[sku] = previous_observations[sku]
+    return observations
+
+
+# Stock dictionary status strings, as written by the scraping functions
+_ONLINE_STATUSES = {"In stock": Availability.AVAILABLE, "Not checked": Availability.NOT_CHECKED}
+_IN_STORE_STATUSES = {"In store": Availability.AVAILABLE, "Not checked": Availability.NOT_CHECKED}
+_BACKORDER_STATUSES = {"Available for backorder": Availability.AVAILABLE, "Not checked": Availability.NOT_CHECKED}
+
+
+def observations_from_stock_dict(vendor_name, stock_dict):
+    """Converts a scraping function's stock dictionary into StockObservations
+
+    :param vendor_name: the vendor that was scraped
+    :param stock_dict: a stock summary dictionary created in the scraping function
+    :return: a dictionary of SKUs to StockObservation
+    """
+    observations = {}
+    for item_name, details in stock_dict.items():
+        store_location = details.get("store location")
+        observation = StockObservation(
+            vendor=vendor_name,
+            sku=sku_from_url(details["url"]) or item_name,
+            name=item_name,
+            url=details["url"],
+            price=parse_price(details.get("price")),
+            online=_ONLINE_STATUSES.get(details["online stock status"], Availability.UNAVAILABLE),
+            in_store=_IN_STORE_STATUSES.get(details["in store status"], Availability.UNAVAILABLE),
+            backorder=_BACKORDER_STATUSES.get(details["backorder status"], Availability.UNAVAILABLE),
+            store_locations=tuple(store_location.split(", ")) if store_location else (),
+        )
+        observations[observation.sku] = observation
+    return observations
+
+
+def sku_from_url(URL):
+    """Identifies an item by its product URL, ignoring query strings and fragments that vary between scans
+
+    :param URL: a product URL
+    :return: the SKU, "" if URL is blank
+    """
+    if not URL:
+        return ""
+    parts = urlsplit(URL)
+    return f"{parts.netloc.lower()}{parts.path.rstrip('/')}"
+
+
+def parse_price(price):
+    """Reads a price like "$1,299.99" or 1299.99 as a float
+
+    :param price: the price as shown on the vendor page, or a number
+    :return: the price as a float, None if there is no price
+    """
+    if price is None or isinstance(price, (int, float)):
+        return price
+    match = re.search(r"\d[\d,]*(?:\.\d+)?", price)
+    if match is None:
+        return None
+    return float(match.group().replace(",", ""))
+
+
+def observation_to_json(observation):
+    """Converts an observation to a dictionary json.dumps() accepts, e.g. to pass it between processes
+
+    :param observation: a StockObservation
+    :return: a dictionary of its fields
+    """
+    return {
+        "vendor": observation.vendor,
+        "sku": observation.sku,
+        "name": observation.name,
+        "url": observation.url,
+        "price": observation.price,
+        "online": observation.online.value,
+        "in_store": observation.in_store.value,
+        "backorder": observation.backorder.value,
+        "store_locations": list(observation.store_locations),
+    }
+
+
+def observation_from_json(observation_json):
+    """Rebuilds an observation from observation_to_json()
+
+    :param observation_json: the dictionary observation_to_json() returned
+    :return: a StockObservation
+    """
+    return StockObservation(
+        vendor=observation_json["vendor"],
+        sku=observation_json["sku"],
+        name=observation_json["name"],
+        url=observation_json["url"],
+        price=observation_json["price"],
+        online=Availability(observation_json["online"]),
+        in_store=Availability(observation_json["in_store"]),
+        backorder=Availability(observation_json["backorder"]),
+        store_locations=tuple(observation_json["store_locations"]),
+    )
@@ -0,0 +1,178 @@
+"""This module contains the functions necessary to read a product page's store inventory, and to choose the stores checked
+
+A product page's whole store table is read in one pass, in a single webdriver call or lxml query, into a dictionary
+of store names to quantities. Whether a store is wanted is then a set lookup, so checking every store costs the
+same as checking one, and a store missing from a page is simply not in the dictionary.
+
+The stores checked are the ones listed in scraping_functions.py, plus, when a postal code is set, every store in
+scraping/stores.json within a radius of it. A postal code is looked up once, at startup, and remembered in
+scraping/postal_codes.json.
+
+Functions:
+    read_store_inventory()
+    read_store_inventory_in_browser()
+    parse_quantity()
+    selected_stores()
+    stores_within()
+    postal_code_coordinates()
+    distance_km()
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import requests
+from scraping.browser_extraction import extract_listings_in_browser
+from scraping.http_fetch import extract_listings
+
+
+# Store locations for each vendor, overridable with the STORE_LOCATIONS_FILE environment variable
+store_locations_path = os.getenv("STORE_LOCATIONS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "stores.json"))
+# Postal codes already looked up, next to stores.json wherever the scraper is run from. Overridable with the
+# POSTAL_CODE_CACHE environment variable.
+postal_code_cache_path = os.path.abspath(os.getenv(
+    "POSTAL_CODE_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "postal_codes.json")))
+# Looks up a Canadian postal code's coordinates
+postal_code_lookup_url = "https://geocoder.ca/?locate={postal_code}&json=1"
+
+_selected_stores = {}
+_selected_stores_lock = threading.Lock()
+
+
+def read_store_inventory(tree, store_selector, quantity_selector):
+    """Reads every store's quantity from a product page downloaded without a browser
+
+    :param tree: the root lxml.html element of the product page
+    :param store_selector: a CSS selector or XPath matching the element holding each store's name
+    :param quantity_selector: a selector relative to the store name element, for its quantity, e.g. "./../span[2]"
+    :return: a dictionary of store names to quantities, in page order
+    """
+    return _inventory_from_rows(extract_listings(tree, store_selector, _inventory_fields(quantity_selector)))
+
+
+def read_store_inventory_in_browser(driver, store_selector, quantity_selector):
+    """Reads every store's quantity from the product page loaded in the webdriver, in a single round trip.
+    Stores in a collapsed or hidden part of the page are read too, without opening it.
+
+    :param driver: an initialized webdriver with the product page loaded in the current tab
+    :param store_selector: a CSS selector matching the element holding each store's name
+    :param quantity_selector: a selector relative to the store name element, for its quantity, e.g. "./../span[2]"
+    :return: a dictionary of store names to quantities, in page order
+    """
+    return _inventory_from_rows(extract_listings_in_browser(driver, store_selector, _inventory_fields(quantity_selector)))
+
+
+def parse_quantity(quantity):
+    """Reads a store's quantity as shown on a product page, e.g. "5+", "3+*", "-" or "Out of Stock"
+
+    :param quantity: the quantity text
+    :return: the quantity as an int, 0 if the store has none
+    """
+    match = re.match(r"\s*(\d+)", quantity)
+    return int(match.group(1)) if match is not None else 0
+
+
+def selected_stores(vendor_name, stores_to_check, postal_code=None, radius_km=None):
+    """Works out the stores to check for a vendor, once per process
+
+    :param vendor_name: the vendor's name in scraping/stores.json, e.g. "Memory Express"
+    :param stores_to_check: store names to always check, as shown on the vendor's product pages
+    :param postal_code: a postal code, or "latitude,longitude", to also check the stores around. None for none.
+    :param radius_km: the distance from postal_code stores are checked within
+    :return: a frozenset of store names
+    """
+    key = (vendor_name, tuple(stores_to_check), postal_code, radius_km)
+    with _selected_stores_lock:
+        if key not in _selected_stores:
+            stores = set(stores_to_check)
+            if postal_code is not None and radius_km is not None:
+                coordinates = postal_code_coordinates(postal_code)
+                if coordinates is not None:
+                    nearby_stores = stores_within(vendor_name, coordinates, radius_km)
+                    print(f"Checking {vendor_name} stores within {radius_km} km of {postal_code}: "
+                          f"{', '.join(nearby_stores) or 'none'}")
+                    stores.update(nearby_stores)
+            _selected_stores[key] = frozenset(stores)
+        return _selected_stores[key]
+
+
+def stores_within(vendor_name, coordinates, radius_km):
+    """Finds a vendor's stores within a distance, from scraping/stores.json
+
+    :param vendor_name: the vendor's name in scraping/stores.json
+    :param coordinates: (latitude, longitude) to measure from
+    :param radius_km: the greatest distance in km
+    :return: a list of store names, nearest first
+    """
+    with open(store_locations_path, encoding="utf-8") as store_locations_file:
+        stores = json.load(store_locations_file).get(vendor_name, [])
+    distances = [(distance_km(coordinates, (store["latitude"], store["longitude"])), store["name"]) for store in stores]
+    return [name for distance, name in sorted(distances) if distance <= radius_km]
+
+
+def postal_code_coordinates(postal_code):
+    """Looks up a postal code's coordinates, online the first time and from postal_codes.json after that
+
+    :param postal_code: a Canadian postal code, e.g. "V5K 0A1", or coordinates as "latitude,longitude"
+    :return: (latitude, longitude), None if the postal code could not be looked up
+    """
+    try:
+        latitude, longitude = (float(part) for part in postal_code.split(","))
+        return latitude, longitude
+    except ValueError:
+        pass
+
+    postal_code = postal_code.replace(" ", "").upper()
+    cache = {}
+    if os.path.exists(postal_code_cache_path):
+        with open(postal_code_cache_path, encoding="utf-8") as cache_file:
+            cache = json.load(cache_file)
+    if postal_code in cache:
+        return tuple(cache[postal_code])
+
+    try:
+        response = requests.get(postal_code_lookup_url.format(postal_code=postal_code), timeout=10)
+        response.raise_for_status()
+        result = response.json()
+        coordinates = (float(result["latt"]), float(result["longt"]))
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f"Could not look up postal code {postal_code}, only checking the stores listed: {e}")
+        return None
+
+    cache[postal_code] = coordinates
+    try:
+        with open(postal_code_cache_path, "w", encoding="utf-8") as cache_file:
+            json.dump(cache, cache_file, indent=2)
+    except OSError as e:
+        # e.g. a read-only install, the coordinates are looked up online again next start
+        print(f"Could not remember postal code {postal_code} in {postal_code_cache_path}: {e}")
+    return coordinates
+
+
+def distance_km(start, end):
+    """Measures the great-circle distance between two (latitude, longitude) points
+
+    :return: the distance in km
+    """
+    latitude_1, longitude_1 = (math.radians(degrees) for degrees in start)
+    latitude_2, longitude_2 = (math.radians(degrees) for degrees in end)
+    a = (math.sin((latitude_2 - latitude_1) / 2) ** 2
+         + math.cos(latitude_1) * math.cos(latitude_2) * math.sin((longitude_2 - longitude_1) / 2) ** 2)
+    return 2 * 6371 * math.asin(math.sqrt(a))
+
+
+def _inventory_fields(quantity_selector):
+    return {"store": (None, "text"), "quantity": (quantity_selector, "text")}
+
+
+def _inventory_from_rows(rows):
+    """Builds the store dictionary from the store table's rows, skipping rows without a quantity"""
+    inventory = {}
+    for row in rows:
+        store = row["store"].strip().rstrip(":").strip()
+        if store == "" or row["quantity"].strip() == "":
+            continue
+        inventory.setdefault(store, parse_quantity(row["quantity"]))
+    return inventory
@@ -0,0 +1,123 @@
+"""This module contains the user agents webdrivers and HTTP requests present to the vendors
+
+User agents are read once from a local JSON file, scraping/user_agents.json by default, and held in memory, so
+starting a webdriver or an HTTP session never waits on the network. The file is checked for changes at most
+every user_agent_refresh_interval seconds, so it can be refreshed without a restart. Every entry has a weight:
+each webdriver picks one at random by weight, and HTTP requests to a vendor always use the one picked by weight
+for that vendor's host, so a vendor sees one consistent browser until the file changes.
+
+Classes:
+    UserAgentPool
+
+Functions:
+    user_agent_pool()
+    random_user_agent()
+    user_agent_for()
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+from scraping.metrics import user_agent_load_duration
+
+
+# User agent file, overridable with the USER_AGENT_FILE environment variable
+user_agent_path = os.getenv("USER_AGENT_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_agents.json"))
+# Seconds between checks of the file for changes
+user_agent_refresh_interval = 3600
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class UserAgentPool:
+    """Weighted user agents, with one fixed choice per vendor host"""
+
+    def __init__(self, entries):
+        """
+        :param entries: a list of dictionaries with a user_agent, a weight and a browser, e.g. "chrome"
+        """
+        if len(entries) == 0:
+            raise ValueError("The user agent file has no user agents.")
+        self.entries = entries
+        self._weights = [entry["weight"] for entry in entries]
+        # Chosen once per pool, so each host's user agent differs between runs but not within one
+        self._seed = random.getrandbits(64)
+        self._by_host = {}
+        self._lock = threading.Lock()
+        # Set by user_agent_pool(), to tell when the file needs loading again
+        self.modified_at = None
+        self.checked_at = 0
+
+    def random(self, browsers=None):
+        """Picks a user agent at random by weight
+
+        :param browsers: only pick from these browsers, e.g. ("chrome", "edge"), any if None
+        :return: the user agent string
+        """
+        entries, weights = self.entries, self._weights
+        if browsers is not None:
+            entries = [entry for entry in self.entries if entry["browser"] in browsers] or self.entries
+            weights = [entry["weight"] for entry in entries]
+        return random.choices(entries, weights)[0]["user_agent"]
+
+    def for_host(self, host):
+        """Picks a user agent by weight for a host, the same one every time for this pool
+
+        :param host: the host name, e.g. "www.newegg.ca"
+        :return: the user agent string
+        """
+        with self._lock:
+            if host not in self._by_host:
+                host_random = random.Random(f"{self._seed}:{host}")
+                self._by_host[host] = host_random.choices(self.entries, self._weights)[0]["user_agent"]
+            return self._by_host[host]
+
+
+def user_agent_pool(reload=False):
+    """Returns the user agent pool, loading the file on first use and again if it has changed since
+
+    :param reload: True to load the file again now
+    :return: a UserAgentPool
+    """
+    global _pool
+    with _pool_lock:
+        now = time.monotonic()
+        if _pool is None or reload or now - _pool.checked_at > user_agent_refresh_interval:
+            try:
+                modified_at = os.stat(user_agent_path).st_mtime
+                if _pool is None or reload or modified_at != _pool.modified_at:
+                    start = time.monotonic()
+                    with open(user_agent_path, encoding="utf-8") as user_agent_file:
+                        pool = UserAgentPool(json.load(user_agent_file))
+                    pool.modified_at = modified_at
+                    user_agent_load_duration.observe(time.monotonic() - start)
+                    _pool = pool
+            except (OSError, ValueError, KeyError) as e:
+                # A file caught halfway through being replaced is tried again next time, keeping the loaded pool
+                if _pool is None:
+                    raise
+                print(f"Keeping the loaded user agents, could not reload {user_agent_path}: {e}")
+            _pool.checked_at = now
+        return _pool
+
+
+def random_user_agent(browsers=None):
+    """Picks a user agent at random by weight, e.g. for a new webdriver
+
+    :param browsers: only pick from these browsers, e.g. ("chrome", "edge"), any if None
+    :return: the user agent string
+    """
+    return user_agent_pool().random(browsers)
+
+
+def user_agent_for(URL):
+    """Picks the user agent for requests to URL's host, the same one until the user agent file changes
+
+    :param URL: any URL on the vendor's host
+    :return: the user agent string
+    """
+    return user_agent_pool().for_host(urlparse(URL).netloc.lower())
@@ -0,0 +1,414 @@
+"""This module contains the vendor registry, built from the vendor definitions in scraping/vendors/
+
+Each vendor is a JSON file declaring its listing selector, the fields read from each listing, the rules
+that decide whether a listing is in stock online, in store or on backorder, which listings have their
+product page scraped, and what a ready page looks like. Definitions are compiled once into an
+ExtractionPlan: selectors are compiled for lxml, rules become Python functions, and mistakes in a
+definition are reported when it is loaded rather than in the middle of a scan. When a vendor changes its
+markup, only its JSON file needs to change.
+
+Vendors with more than one page of results can have their later pages followed, by a link or a page number
+in the URL. Pages stop being followed once one has nothing available, or everything on it matches stop_when:
+    "pagination": {"next_page": ["a.next", "href"], "max_pages": 5}
+    "pagination": {"page_parameter": "page", "max_pages": 3, "stop_when": {"not": {"field": "price", "below": 1400}}}
+
+Vendors whose product pages list stock by store declare the store table, read in one pass by store_inventory:
+    "detail_pages": {..., "store_inventory": {"store": ".store-name", "quantity": "./../span[2]"}}
+
+Vendors with a JSON availability API, see availability_api, are polled through it once their SKUs have been read
+from the listing page, by matching sku_pattern's first group against each listing's URL:
+    "availability_api": {"client": "best buy", "sku_pattern": "/(\\d{8})(?:[/?#]|$)", "batch_size": 100}
+The API only reports availability, so any other condition of stock_rules, like a price limit, is repeated in its
+own stock_rules. They are applied to the listing with the API's price, and a channel is only available if both
+the API and its rule say so:
+    "availability_api": {..., "stock_rules": {"online": {"field": "whole price", "below": 1400}}}
+
+Rules are JSON objects, combined with "all", "any", "none" and "not":
+    {"field": "stock status", "contains": ["In Stock", "Limited"], "ignore_case": true}
+    {"field": "stock status", "not_empty": true}
+    {"field": "whole price", "below": 1400}
+
+Classes:
+    VendorConfigError
+    ExtractionPlan
+
+Functions:
+    compile_rule()
+    load_vendor_plans()
+    vendor_plans()
+    vendor_plan()
+"""
+
+import json
+import os
+import re
+import threading
+from scraping.availability_api import availability_clients
+from scraping.http_fetch import compile_selector, iter_listings
+from scraping.metrics import record_partial_error
+from scraping.stock_records import parse_price
+
+
+# Vendor definition files, overridable with the VENDOR_CONFIG_DIR environment variable
+vendor_config_directory = os.getenv("VENDOR_CONFIG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vendors"))
+
+_CONFIG_KEYS = {"name", "listing_selector", "fields", "item", "stock_rules", "store_location", "detail_pages",
+                "ready_when", "cache_region", "http_fetch", "pagination", "availability_api"}
+_DETAIL_PAGE_KEYS = {"when", "url_field", "parser", "ready_when", "store_inventory"}
+_PAGINATION_KEYS = {"next_page", "page_parameter", "max_pages", "stop_when"}
+_AVAILABILITY_API_KEYS = {"client", "sku_pattern", "batch_size", "stock_rules"}
+_CHANNELS = {"online", "in_store", "backorder"}
+# Stock dictionary status strings for each channel, as (available, unavailable)
+_CHANNEL_STATUSES = {
+    "online": ("In stock", "Out of stock"),
+    "in_store": ("In store", "Unavailable in store"),
+    "backorder": ("Available for backorder", "Unavailable for backorder"),
+}
+_STOCK_DICT_KEYS = {"online": "online stock status", "in_store": "in store status", "backorder": "backorder status"}
+
+_plans = None
+_plans_lock = threading.Lock()
+
+
+class VendorConfigError(ValueError):
+    """Raised when a vendor definition is missing something or has a rule or selector that cannot be compiled"""
+
+
+class ExtractionPlan:
+    """A vendor definition compiled for scraping"""
+
+    def __init__(self, config, source="<config>"):
+        """
+        :param config: the vendor definition, as loaded from its JSON file
+        :param source: where the definition came from, for error messages
+        """
+        unknown_keys = set(config) - _CONFIG_KEYS
+        if unknown_keys:
+            raise VendorConfigError(f"{source}: unknown keys {sorted(unknown_keys)}")
+        try:
+            self.name = config["name"]
+            self.listing_selector = config["listing_selector"]
+            self.fields = {field: (selector, attribute) for field, (selector, attribute) in config["fields"].items()}
+            self.ready_when = (config["ready_when"]["selector"], config["ready_when"].get("min_count", 1))
+            self.cache_region = config["cache_region"]
+        except (KeyError, TypeError, ValueError) as e:
+            raise VendorConfigError(f"{source}: missing or malformed {e}")
+        self.key = self.name.lower().strip()
+        self.http_fetch = config.get("http_fetch", False)
+        self.item_fields = config.get("item", {"name": "name", "url": "url"})
+        self.store_location = config.get("store_location")
+
+        unknown_channels = set(config.get("stock_rules", {})) - _CHANNELS
+        if unknown_channels:
+            raise VendorConfigError(f"{source}: unknown stock channels {sorted(unknown_channels)}")
+        self.stock_rules = {channel: compile_rule(rule, self.fields, source)
+                            for channel, rule in config.get("stock_rules", {}).items()}
+
+        detail_pages = config.get("detail_pages")
+        self.detail_rule = None
+        self.detail_url_field = None
+        self.detail_parser = None
+        self.detail_ready_when = None
+        self.store_inventory = None
+        if detail_pages is not None:
+            unknown_keys = set(detail_pages) - _DETAIL_PAGE_KEYS
+            if unknown_keys:
+                raise VendorConfigError(f"{source}: unknown detail_pages keys {sorted(unknown_keys)}")
+            try:
+                self.detail_rule = compile_rule(detail_pages["when"], self.fields, source)
+                self.detail_url_field = detail_pages.get("url_field", "url")
+                self.detail_parser = detail_pages["parser"]
+                self.detail_ready_when = (detail_pages["ready_when"]["selector"],
+                                          detail_pages["ready_when"].get("min_count", 1))
+                if "store_inventory" in detail_pages:
+                    self.store_inventory = (detail_pages["store_inventory"]["store"],
+                                            detail_pages["store_inventory"]["quantity"])
+            except (KeyError, TypeError) as e:
+                raise VendorConfigError(f"{source}: missing or malformed detail_pages {e}")
+
+        if not self.stock_rules and self.detail_rule is None:
+            raise VendorConfigError(f"{source}: needs stock_rules, detail_pages or both")
+
+        pagination = config.get("pagination")
+        self.next_page = None
+        self.page_parameter = None
+        self.max_pages = 1
+        self.stop_rule = None
+        if pagination is not None:
+            unknown_keys = set(pagination) - _PAGINATION_KEYS
+            if unknown_keys:
+                raise VendorConfigError(f"{source}: unknown pagination keys {sorted(unknown_keys)}")
+            if ("next_page" in pagination) == ("page_parameter" in pagination):
+                raise VendorConfigError(f"{source}: pagination needs either next_page or page_parameter")
+            try:
+                if "next_page" in pagination:
+                    selector, attribute = pagination["next_page"]
+                    self.next_page = (selector, attribute)
+                self.page_parameter = pagination.get("page_parameter")
+                self.max_pages = int(pagination["max_pages"])
+            except (KeyError, TypeError, ValueError) as e:
+                raise VendorConfigError(f"{source}: missing or malformed pagination {e}")
+            if "stop_when" in pagination:
+                self.stop_rule = compile_rule(pagination["stop_when"], self.fields, source)
+
+        availability_api = config.get("availability_api")
+        self.api_client = None
+        self.api_sku_pattern = None
+        self.api_batch_size = None
+        self.api_stock_rules = {}
+        if availability_api is not None:
+            unknown_keys = set(availability_api) - _AVAILABILITY_API_KEYS
+            if unknown_keys:
+                raise VendorConfigError(f"{source}: unknown availability_api keys {sorted(unknown_keys)}")
+            try:
+                self.api_client = availability_api["client"]
+                self.api_sku_pattern = re.compile(availability_api["sku_pattern"])
+                self.api_batch_size = int(availability_api["batch_size"])
+            except (KeyError, TypeError, ValueError, re.error) as e:
+                raise VendorConfigError(f"{source}: missing or malformed availability_api {e}")
+            if self.api_client not in availability_clients:
+                raise VendorConfigError(f"{source}: unknown availability_api client {self.api_client!r}")
+            unknown_channels = set(availability_api.get("stock_rules", {})) - set(self.stock_rules)
+            if unknown_channels:
+                raise VendorConfigError(f"{source}: availability_api stock_rules for channels without stock_rules "
+                                        f"{sorted(unknown_channels)}")
+            self.api_stock_rules = {channel: compile_rule(rule, self.fields, source)
+                                    for channel, rule in availability_api.get("stock_rules", {}).items()}
+
+        # Compiled now so a bad selector fails at startup, and every page reuses the compiled version
+        try:
+            selectors = [self.listing_selector, self.cache_region] + [selector for selector, _ in self.fields.values()]
+            if self.next_page is not None:
+                selectors.append(self.next_page[0])
+            if self.store_inventory is not None:
+                selectors.extend(self.store_inventory)
+            for selector in selectors:
+                if selector is not None:
+                    compile_selector(selector)
+        except Exception as e:
+            raise VendorConfigError(f"{source}: cannot compile selector: {e}")
+
+    @property
+    def paginated(self):
+        """True if pages after the first are followed"""
+        return self.max_pages > 1 and (self.next_page is not None or self.page_parameter is not None)
+
+    def iter_http(self, tree):
+        """Reads the listings from a page downloaded without a browser, one at a time
+
+        :param tree: the root lxml.html element of the page
+        :return: a generator of dictionaries of field values
+        """
+        return iter_listings(tree, self.listing_selector, self.fields)
+
+    def read_stock(self, listings):
+        """Applies the stock rules to every listing. A listing the rules cannot read, e.g. one missing a field
+        after a layout change, is skipped without losing the others, and returned so its item can keep its
+        previous results.
+
+        :param listings: a list of dictionaries of field values
+        :return: (stock_dict, unread_URLs), where stock_dict holds the listings available through any channel
+            and unread_URLs the product URLs of the listings that could not be read
+        """
+        if not self.stock_rules:
+            return {}, []
+        listings_and_availability = []
+        unread_URLs = []
+        for listing in listings:
+            try:
+                listings_and_availability.append(
+                    (listing, {channel: rule(listing) for channel, rule in self.stock_rules.items()}))
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                print(f"Skipped a listing from {self.name} that could not be read: {e!r}")
+                record_partial_error(self.name, "listing")
+                if listing.get(self.item_fields["url"]):
+                    unread_URLs.append(listing[self.item_fields["url"]])
+        return self.availability_stock_dict(listings_and_availability), unread_URLs
+
+    def read_api_stock(self, listings_and_availability):
+        """Applies availability_api's stock_rules to listings polled through the availability API. A listing the
+        rules cannot read is skipped without losing the others, as in read_stock().
+
+        :param listings_and_availability: a list of (listing, availability) pairs, where the listing has the API's
+            price and availability is a dictionary of channels to True or False, as AvailabilityClient.fetch()
+            returns
+        :return: (stock_dict, unread_URLs), as read_stock() returns
+        """
+        checked = []
+        unread_URLs = []
+        for listing, available in listings_and_availability:
+            try:
+                available = {channel: available.get(channel, False)
+                             and (channel not in self.api_stock_rules or self.api_stock_rules[channel](listing))
+                             for channel in self.stock_rules}
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                print(f"Skipped a listing from {self.name} that could not be read: {e!r}")
+                record_partial_error(self.name, "listing")
+                if listing.get(self.item_fields["url"]):
+                    unread_URLs.append(listing[self.item_fields["url"]])
+                continue
+            checked.append((listing, available))
+        return self.availability_stock_dict(checked), unread_URLs
+
+    def availability_stock_dict(self, listings_and_availability):
+        """Builds the stock dictionary from availability already known, e.g. from an availability API
+
+        :param listings_and_availability: a list of (listing, availability) pairs, where availability is a
+            dictionary of channels to True or False, with the channels of stock_rules
+        :return: a stock dictionary of the listings available through any channel
+        """
+        stock_dict = {}
+        for listing, available in listings_and_availability:
+            available = {channel: available.get(channel, False) for channel in self.stock_rules}
+            if not any(available.values()):
+                continue
+
+            item_name = listing[self.item_fields["name"]]
+            item_URL = listing[self.item_fields["url"]]
+            stock_dict[item_name] = {"url": item_URL}
+            price_text = ""
+            if "price" in self.item_fields:
+                stock_dict[item_name]["price"] = listing[self.item_fields["price"]]
+                price_text = f" for {listing[self.item_fields['price']]}"
+            for channel, stock_dict_key in _STOCK_DICT_KEYS.items():
+                if channel not in available:
+                    stock_dict[item_name][stock_dict_key] = "Not checked"
+                    continue
+                available_status, unavailable_status = _CHANNEL_STATUSES[channel]
+                stock_dict[item_name][stock_dict_key] = available_status if available[channel] else unavailable_status
+            if available.get("online"):
+                print(f"Online stock found: \n{item_URL}{price_text}")
+            if available.get("backorder"):
+                print(f"Backorder stock found: \n{item_URL}{price_text}")
+            if available.get("in_store") and self.store_location is not None:
+                stock_dict[item_name]["store location"] = self.store_location
+        return stock_dict
+
+    def worth_next_page(self, listing):
+        """Determines if a listing makes the page after it worth reading: it matches no stop_when, or without
+        stop_when, it is available. A page is the last one read when none of its new listings is.
+
+        :param listing: a dictionary of field values
+        :return: True if the next page should be read
+        """
+        if self.stop_rule is not None:
+            return not self.stop_rule(listing)
+        return self.listing_available(listing)
+
+    def listing_available(self, listing):
+        """True if a listing is available through any channel, or has its product page scraped to find out"""
+        return (any(rule(listing) for rule in self.stock_rules.values())
+                or (self.detail_rule is not None and self.detail_rule(listing)))
+
+    def detail_urls(self, listings):
+        """Picks the listings whose product pages are worth scraping
+
+        :param listings: a list of dictionaries of field values
+        :return: the product page URLs, in listing order
+        """
+        if self.detail_rule is None:
+            return []
+        return [listing[self.detail_url_field] for listing in listings
+                if listing[self.detail_url_field] != "" and self.detail_rule(listing)]
+
+    def api_skus(self, listings):
+        """Finds each listing's SKU for the availability API, from its URL
+
+        :param listings: a list of dictionaries of field values
+        :return: a dictionary of SKUs to listings, leaving out listings without one
+        """
+        listings_by_sku = {}
+        for listing in listings:
+            match = self.api_sku_pattern.search(listing[self.item_fields["url"]])
+            if match is not None:
+                listings_by_sku.setdefault(match.group(1), listing)
+        return listings_by_sku
+
+
+def compile_rule(rule, fields, source="<config>"):
+    """Compiles a stock rule into a function of a listing
+
+    :param rule: the rule, as a dictionary loaded from JSON
+    :param fields: the vendor's fields, so rules on fields that do not exist are caught
+    :param source: where the rule came from, for error messages
+    :return: a function taking a dictionary of field values and returning True or False
+    """
+    if not isinstance(rule, dict):
+        raise VendorConfigError(f"{source}: a rule must be an object, not {rule!r}")
+
+    for combinator in ("all", "any", "none"):
+        if combinator in rule:
+            rules = [compile_rule(inner_rule, fields, source) for inner_rule in rule[combinator]]
+            if combinator == "all":
+                return lambda listing: all(inner_rule(listing) for inner_rule in rules)
+            if combinator == "any":
+                return lambda listing: any(inner_rule(listing) for inner_rule in rules)
+            return lambda listing: not any(inner_rule(listing) for inner_rule in rules)
+    if "not" in rule:
+        inner_rule = compile_rule(rule["not"], fields, source)
+        return lambda listing: not inner_rule(listing)
+
+    field = rule.get("field")
+    if field not in fields:
+        raise VendorConfigError(f"{source}: rule {rule!r} is on a field that is not defined")
+    if "contains" in rule:
+        if rule.get("ignore_case"):
+            substrings = [substring.lower() for substring in rule["contains"]]
+            return lambda listing: any(substring in listing[field].lower() for substring in substrings)
+        substrings = list(rule["contains"])
+        return lambda listing: any(substring in listing[field] for substring in substrings)
+    if "not_empty" in rule:
+        expected = bool(rule["not_empty"])
+        return lambda listing: (listing[field] != "") == expected
+    if "below" in rule:
+        limit = rule["below"]
+
+        def below(listing):
+            price = parse_price(listing[field])
+            return price is not None and price < limit
+        return below
+    raise VendorConfigError(f"{source}: rule {rule!r} has no condition")
+
+
+def load_vendor_plans(directory=None):
+    """Loads and compiles every vendor definition in a directory
+
+    :param directory: the directory of JSON files, vendor_config_directory if None
+    :return: a dictionary of lower case vendor names to their ExtractionPlan
+    """
+    directory = vendor_config_directory if directory is None else directory
+    plans = {}
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".json"):
+            continue
+        config_path = os.path.join(directory, file_name)
+        with open(config_path, encoding="utf-8") as config_file:
+            try:
+                config = json.load(config_file)
+            except ValueError as e:
+                raise VendorConfigError(f"{config_path}: {e}")
+        plan = ExtractionPlan(config, config_path)
+        plans[plan.key] = plan
+    return plans
+
+
+def vendor_plans(reload=False):
+    """Returns every vendor's ExtractionPlan, loading the definitions on first use
+
+    :param reload: True to load the definitions again, e.g. after editing them
+    :return: a dictionary of lower case vendor names to their ExtractionPlan
+    """
+    global _plans
+    with _plans_lock:
+        if _plans is None or reload:
+            _plans = load_vendor_plans()
+        return _plans
+
+
+def vendor_plan(vendor_name):
+    """Finds a vendor's ExtractionPlan
+
+    :param vendor_name: the vendor name, in any case
+    :return: the ExtractionPlan, None if no vendor definition has that name
+    """
+    return vendor_plans().get(vendor_name.lower().strip())
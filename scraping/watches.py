@@ -0,0 +1,128 @@
+"""This module contains watches: the products or searches stock is alerted on
+
+A watch has a name, keywords a listing's name must contain, keywords it must not contain, a price limit,
+and the vendor pages to look on. Every vendor page shared by several watches is fetched once per scan, and
+each item found is matched against every watch through a keyword index, so watching more products costs
+little more than watching one.
+
+Classes:
+    Watch
+    WatchIndex
+
+Functions:
+    watches_from_config()
+    vendor_urls()
+    keyword_tokens()
+"""
+
+import re
+
+
+class Watch:
+    """A product or search to alert on"""
+
+    def __init__(self, name, vendors, keywords=(), exclude=(), max_price=None):
+        """
+        :param name: the name used in alert subjects, e.g. "RTX 3080"
+        :param vendors: a dictionary of vendor names to a listing page URL or a list of them
+        :param keywords: every word of every keyword must appear in a listing's name, e.g. ["rtx 3080"].
+            A watch with no keywords matches every listing on its vendor pages and any other watch's.
+        :param exclude: listings whose name contains every word of any of these are ignored, e.g. ["3080 ti"]
+        :param max_price: listings above this price are ignored. Listings without a price are kept.
+        """
+        self.name = name
+        self.vendors = {vendor_name: [URLs] if isinstance(URLs, str) else list(URLs)
+                        for vendor_name, URLs in vendors.items()}
+        self.keywords = [keyword_tokens(keyword) for keyword in keywords]
+        self.exclude = [keyword_tokens(keyword) for keyword in exclude]
+        self.max_price = max_price
+
+    def matches(self, name_tokens, price):
+        """Determines if a listing belongs to this watch
+
+        :param name_tokens: the set of keyword_tokens() of the listing's name
+        :param price: the listing's price as a float, None if it has none
+        :return: True if the listing matches
+        """
+        if self.max_price is not None and price is not None and price > self.max_price:
+            return False
+        if any(tokens <= name_tokens for tokens in self.exclude):
+            return False
+        return all(tokens <= name_tokens for tokens in self.keywords)
+
+
+class WatchIndex:
+    """Finds the watches an item matches without checking every watch against every item"""
+
+    def __init__(self, watches):
+        """
+        :param watches: a list of Watch
+        """
+        self.watches = watches
+        # Each watch is indexed under the longest word of its first keyword, the one fewest item names are likely
+        # to share. An item has to contain every word of every keyword, so it can only match watches indexed
+        # under one of its own words.
+        self._by_token = {}
+        self._match_all = []
+        for watch in watches:
+            if len(watch.keywords) == 0 or len(watch.keywords[0]) == 0:
+                self._match_all.append(watch)
+            else:
+                token = max(sorted(watch.keywords[0]), key=len)
+                self._by_token.setdefault(token, []).append(watch)
+
+    def matching_watches(self, observation):
+        """Finds every watch an observed item belongs to
+
+        :param observation: a StockObservation
+        :return: a list of Watch, in the order they were given
+        """
+        name_tokens = keyword_tokens(observation.name)
+        candidates = list(self._match_all)
+        for token in name_tokens:
+            candidates.extend(self._by_token.get(token, ()))
+        matches = [watch for watch in candidates if watch.matches(name_tokens, observation.price)]
+        return sorted(set(matches), key=self.watches.index)
+
+    def group(self, observations):
+        """Splits observations by the watches they match. An observation can be in several groups.
+
+        :param observations: a list of StockObservation
+        :return: a dictionary of Watch to the list of its observations, in the order watches were given
+        """
+        groups = {}
+        for observation in observations:
+            for watch in self.matching_watches(observation):
+                groups.setdefault(watch, []).append(observation)
+        return {watch: groups[watch] for watch in self.watches if watch in groups}
+
+
+def watches_from_config(watch_configs):
+    """Builds watches from the watches list in main.py
+
+    :param watch_configs: a list of dictionaries with a name, vendors, and optionally keywords, exclude and max_price
+    :return: a list of Watch
+    """
+    return [Watch(config["name"], config["vendors"], config.get("keywords", ()), config.get("exclude", ()),
+                  config.get("max_price")) for config in watch_configs]
+
+
+def vendor_urls(watches):
+    """Merges every watch's vendor pages, so a page several watches share is only fetched once per scan
+
+    :param watches: a list of Watch
+    :return: a dictionary of vendor names to their distinct listing page URLs, in the order first given
+    """
+    URLs_by_vendor = {}
+    for watch in watches:
+        for vendor_name, URLs in watch.vendors.items():
+            vendor_URLs = URLs_by_vendor.setdefault(vendor_name, [])
+            for URL in URLs:
+                if URL not in vendor_URLs:
+                    vendor_URLs.append(URL)
+    return URLs_by_vendor
+
+
+def keyword_tokens(text):
+    """Splits a name or keyword into lower case words and numbers, e.g. "RTX3080 Ti" to {"rtx", "3080", "ti"}"""
+    return set(re.findall(r"[a-z]+|[0-9]+", text.lower()))
@@ -0,0 +1,50 @@
+"""Tests that items polled through an availability API read the same as on their listing page"""
+
+import contextlib
+import io
+import unittest
+from scraping.availability_api import AvailabilityClient, AmazonOffers
+from scraping.scraping_functions import stock_dict_from_availability
+from scraping.vendor_registry import vendor_plan
+
+
+def _amazon_listing(asin, whole_price):
+    return {"url": f"https://www.amazon.ca/dp/{asin}", "name": f"RTX 3080 {asin}",
+            "price": f"${whole_price}.99", "whole price": whole_price}
+
+
+class AmazonPriceLimitTest(unittest.TestCase):
+
+    def test_api_applies_the_listing_page_price_limit(self):
+        plan = vendor_plan("amazon")
+        listings_by_sku = {"B000000001": _amazon_listing("B000000001", "1,199"),
+                           "B000000002": _amazon_listing("B000000002", "1,199")}
+        availability = {"B000000001": {"online": True, "price": "$1,249.99"},
+                        "B000000002": {"online": True, "price": "$2,399.99"}}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            stock_dict, unread_URLs = stock_dict_from_availability(plan, listings_by_sku, availability)
+
+        self.assertEqual(list(stock_dict), ["RTX 3080 B000000001"])
+        self.assertEqual(stock_dict["RTX 3080 B000000001"]["price"], "$1,249.99")
+        self.assertEqual(unread_URLs, [])
+
+
+class AvailabilityClientTest(unittest.TestCase):
+
+    def test_client_without_fetch_cannot_be_created(self):
+        class _NoFetch(AvailabilityClient):
+            items_key = "availabilities"
+
+        with self.assertRaises(TypeError):
+            _NoFetch()
+
+    def test_hot_watch_hooks_are_optional(self):
+        client = AmazonOffers()
+        self.assertIsNone(client.items_key)
+        self.assertIsNone(client.request_url(["B000000001"]))
+        self.assertIsNone(client.read_items([]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Tests for the circuit breaker states in scraping/circuit_breaker.py"""
+
+import contextlib
+import io
+import unittest
+from scraping import circuit_breaker
+from scraping.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker("Newegg")
+        output = contextlib.redirect_stdout(io.StringIO())
+        output.__enter__()
+        self.addCleanup(output.__exit__, None, None, None)
+
+    def open_breaker(self, now=0):
+        """Fails scans until the closed breaker opens
+
+        :return: the seconds it opened for
+        """
+        for _ in range(circuit_breaker.failure_threshold - 1):
+            self.assertEqual(self.breaker.record_failure(now), 0)
+            self.assertEqual(self.breaker.check(now), CLOSED)
+        return self.breaker.record_failure(now)
+
+    def test_opens_after_failure_threshold_failures_in_a_row(self):
+        self.assertEqual(circuit_breaker.failure_threshold, 3)
+        self.assertEqual(self.open_breaker(), circuit_breaker.open_seconds)
+        self.assertEqual(self.breaker.check(0), OPEN)
+        self.assertEqual(self.breaker.open_until, circuit_breaker.open_seconds)
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure(0)
+        self.breaker.record_failure(0)
+        self.breaker.record_success()
+        self.assertEqual(self.open_breaker(), circuit_breaker.open_seconds)
+
+    def test_half_open_once_its_time_is_up(self):
+        self.open_breaker()
+        self.assertEqual(self.breaker.check(circuit_breaker.open_seconds - 1), OPEN)
+        self.assertEqual(self.breaker.check(circuit_breaker.open_seconds), HALF_OPEN)
+
+    def test_trial_that_works_closes_it(self):
+        self.open_breaker()
+        self.breaker.check(circuit_breaker.open_seconds)
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.check(circuit_breaker.open_seconds), CLOSED)
+        # Closed again, so the next failures are counted from the start
+        self.assertEqual(self.open_breaker(circuit_breaker.open_seconds), circuit_breaker.open_seconds)
+
+    def test_failed_trials_double_the_open_time_up_to_max_open_seconds(self):
+        now = 0
+        durations = [self.open_breaker(now)]
+        for _ in range(6):
+            now = self.breaker.open_until
+            self.assertEqual(self.breaker.check(now), HALF_OPEN)
+            durations.append(self.breaker.record_failure(now))
+            self.assertEqual(self.breaker.check(now), OPEN)
+        self.assertEqual(circuit_breaker.max_open_seconds, 1800)
+        self.assertEqual(durations, [60, 120, 240, 480, 960, 1800, 1800])
+
+    def test_failure_while_open_does_not_extend_it(self):
+        self.open_breaker()
+        # A scan that started before the breaker opened
+        self.assertEqual(self.breaker.record_failure(20), circuit_breaker.open_seconds - 20)
+        self.assertEqual(self.breaker.open_until, circuit_breaker.open_seconds)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+"""Tests for sharding vendors between several workers through scraping/coordination.py, against a temporary
+SQLite database, with workers in this process on their own connections or in separate processes"""
+
+import contextlib
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from scraping import coordination
+from scraping.coordination import SQLiteCoordinator, ShardedWorker
+
+SHARDS = ["Newegg", "Best Buy", "Memory Express", "Canada Computers", "Amazon", "PC Canada", "Visions"]
+# Short enough for an expired lease to be waited out
+LEASE_SECONDS = 1
+
+
+def _heartbeat_in_process(path, worker_id, rounds, barrier, results):
+    """Heartbeats in step with the other processes, then reports what this worker ended up with"""
+    coordinator = SQLiteCoordinator(path)
+    for _ in range(rounds):
+        barrier.wait()
+        leased_shards, is_leader = coordinator.heartbeat(worker_id, SHARDS, LEASE_SECONDS)
+    results.put((worker_id, leased_shards, is_leader))
+
+
+class CoordinationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "coordination.db")
+
+    def heartbeat_rounds(self, coordinators, rounds=4):
+        """Heartbeats each worker in turn until the shares have settled
+
+        :param coordinators: a dictionary of worker ids to their own SQLiteCoordinator
+        :return: a dictionary of worker ids to the result of their last heartbeat
+        """
+        results = {}
+        for _ in range(rounds):
+            for worker_id, coordinator in coordinators.items():
+                results[worker_id] = coordinator.heartbeat(worker_id, SHARDS, LEASE_SECONDS)
+        return results
+
+    def assert_sharded(self, results):
+        """Checks every shard is leased to exactly one worker, each with its fair share, and there is one leader"""
+        leased = [shard for leased_shards, _ in results.values() for shard in leased_shards]
+        self.assertCountEqual(leased, SHARDS)
+        fair_share = -(-len(SHARDS) // len(results))
+        for leased_shards, _ in results.values():
+            self.assertLessEqual(len(leased_shards), fair_share)
+        self.assertEqual(sum(is_leader for _, is_leader in results.values()), 1)
+
+
+class LeaseTest(CoordinationTestCase):
+
+    def test_every_shard_is_leased_exactly_once(self):
+        coordinators = {worker_id: SQLiteCoordinator(self.path) for worker_id in ("worker-1", "worker-2", "worker-3")}
+        self.assert_sharded(self.heartbeat_rounds(coordinators))
+
+    def test_stopped_workers_shards_are_leased_again(self):
+        coordinators = {worker_id: SQLiteCoordinator(self.path) for worker_id in ("worker-1", "worker-2", "worker-3")}
+        results = self.heartbeat_rounds(coordinators)
+        leader = next(worker_id for worker_id, (_, is_leader) in results.items() if is_leader)
+
+        # The leader stops heartbeating, as if its process died, and its leases run out
+        del coordinators[leader]
+        time.sleep(LEASE_SECONDS + 0.2)
+        results = self.heartbeat_rounds(coordinators)
+        self.assert_sharded(results)
+        self.assertNotIn(leader, results)
+
+    def test_released_shards_are_leased_again_straight_away(self):
+        coordinators = {worker_id: SQLiteCoordinator(self.path) for worker_id in ("worker-1", "worker-2")}
+        self.heartbeat_rounds(coordinators)
+
+        coordinators.pop("worker-1").release("worker-1")
+        results = self.heartbeat_rounds(coordinators, rounds=1)
+        self.assertEqual(results["worker-2"], (SHARDS, True))
+
+    def test_workers_in_separate_processes(self):
+        worker_ids = ["worker-1", "worker-2", "worker-3"]
+        SQLiteCoordinator(self.path)
+        barrier = multiprocessing.Barrier(len(worker_ids))
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_heartbeat_in_process,
+                                             args=(self.path, worker_id, 5, barrier, results))
+                     for worker_id in worker_ids]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+            self.assertEqual(process.exitcode, 0)
+
+        self.assert_sharded({worker_id: (leased_shards, is_leader)
+                             for worker_id, leased_shards, is_leader in (results.get() for _ in worker_ids)})
+
+
+class ReportTest(CoordinationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patches = [mock.patch.object(coordination, "lease_seconds", LEASE_SECONDS),
+                   mock.patch.object(coordination, "report_poll_interval", 0.05)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.handled = []
+        self.handled_lock = threading.Lock()
+
+    def start_worker(self, worker_id, on_report=None):
+        def record_report(vendor_name, observations, observed_at):
+            with self.handled_lock:
+                self.handled.append((worker_id, vendor_name))
+
+        worker = ShardedWorker(SQLiteCoordinator(self.path), worker_id, SHARDS, lambda shards: None,
+                               lambda is_leader: None, on_report or record_report)
+        with contextlib.redirect_stdout(io.StringIO()):
+            worker.start()
+        self.addCleanup(worker.stop)
+        return worker
+
+    def wait_for_reports(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.handled_lock:
+                if len(self.handled) >= count:
+                    return
+            time.sleep(0.05)
+
+    def test_only_the_leader_handles_reports(self):
+        workers = [self.start_worker("worker-1"), self.start_worker("worker-2")]
+        self.assertEqual([worker.is_leader for worker in workers], [True, False])
+
+        workers[0].report("Newegg", {})
+        workers[1].report("Best Buy", {})
+        self.wait_for_reports(2)
+        self.assertEqual(self.handled, [("worker-1", "Newegg"), ("worker-1", "Best Buy")])
+
+    def test_report_that_fails_is_retried_without_losing_the_rest(self):
+        failures = []
+
+        def on_report(vendor_name, observations, observed_at):
+            if vendor_name == "Best Buy" and len(failures) == 0:
+                failures.append(vendor_name)
+                raise OSError("observation store unavailable")
+            with self.handled_lock:
+                self.handled.append(("worker-1", vendor_name))
+
+        coordinator = SQLiteCoordinator(self.path)
+        for vendor_name in ("Newegg", "Best Buy", "Amazon"):
+            coordinator.report("worker-2", vendor_name, {})
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.start_worker("worker-1", on_report)
+            self.wait_for_reports(3)
+
+        self.assertEqual([vendor_name for _, vendor_name in self.handled], ["Newegg", "Best Buy", "Amazon"])
+        self.assertEqual(coordinator.pending_reports(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
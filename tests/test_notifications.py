@@ -0,0 +1,62 @@
+"""Tests for the notification dispatcher in scraping/notifications.py"""
+
+import unittest
+from unittest import mock
+from scraping import notifications
+
+
+class _RecordingSender:
+    sent = []
+
+    def send(self, subject, email_body):
+        _RecordingSender.sent.append((subject, email_body))
+
+
+class _BrokenSender:
+    def __init__(self):
+        raise ModuleNotFoundError("No module named 'discord'")
+
+
+class NotificationDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        _RecordingSender.sent = []
+        self.beeps = []
+        patches = [
+            mock.patch.object(notifications, "beep_enabled", True),
+            mock.patch.object(notifications, "discord_message_enabled", True),
+            mock.patch.object(notifications, "email_enabled", True),
+            mock.patch.object(notifications, "max_send_attempts", 1),
+            mock.patch.object(notifications, "_DiscordSender", _BrokenSender),
+            mock.patch.object(notifications, "_EmailSender", _RecordingSender),
+            mock.patch.object(notifications, "make_beep_noise", lambda: self.beeps.append(True)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_channel_that_cannot_start_does_not_stop_the_others(self):
+        dispatcher = notifications.NotificationDispatcher()
+        dispatcher.submit("RTX 3080", "Newegg", "RTX 3080 in Stock ONLINE at Newegg", "body")
+        dispatcher.end_scan()
+        dispatcher.close()
+
+        self.assertEqual(_RecordingSender.sent, [("RTX 3080 in Stock ONLINE at Newegg", "body")])
+        self.assertEqual(self.beeps, [True])
+
+    def test_alerts_for_different_watches_are_sent_separately(self):
+        dispatcher = notifications.NotificationDispatcher()
+        dispatcher.submit("RTX 3080", "Newegg", "RTX 3080 in Stock ONLINE at Newegg", "3080 at Newegg\n")
+        dispatcher.submit("RTX 3070", "Best Buy", "RTX 3070 in Stock ONLINE at Best Buy", "3070 at Best Buy\n")
+        dispatcher.submit("RTX 3080", "Amazon", "RTX 3080 in Stock ONLINE at Amazon", "3080 at Amazon\n")
+        dispatcher.end_scan()
+        dispatcher.close()
+
+        self.assertEqual(_RecordingSender.sent, [
+            ("RTX 3080 in Stock at Newegg, Amazon", "3080 at Newegg\n3080 at Amazon\n"),
+            ("RTX 3070 in Stock ONLINE at Best Buy", "3070 at Best Buy\n"),
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
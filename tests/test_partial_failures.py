@@ -0,0 +1,58 @@
+"""Tests that a part of a scan that fails keeps its previous results, against the benchmark fixtures"""
+
+import contextlib
+import io
+import unittest
+from unittest import mock
+from benchmarks.fixture_server import FixtureServer
+from scraping import scraping_functions
+from scraping.page_cache import page_cache
+from scraping.stock_records import diff_observations
+
+
+class ProductPageFailureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FixtureServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        self.URL = self.server.url("canada computers", "in_stock")
+        page_cache.clear()
+        self.addCleanup(page_cache.clear)
+        self.failing_URLs = set()
+
+        parse_product_page = scraping_functions.http_detail_parsers["canada computers product"]
+
+        def flaky_parse_product_page(product_page, URL):
+            if URL in self.failing_URLs:
+                self.failing_URLs.discard(URL)
+                raise ValueError("product page layout not recognized")
+            return parse_product_page(product_page, URL)
+
+        patch = mock.patch.dict(scraping_functions.http_detail_parsers,
+                                {"canada computers product": flaky_parse_product_page})
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def scan(self, previous_observations):
+        # Every scan reads the pages again, as it would once they change
+        page_cache.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            return scraping_functions.scrape_vendor_http("Canada Computers", self.URL, previous_observations)
+
+    def test_product_page_that_fails_once_does_not_alert_again(self):
+        first = self.scan({})
+        self.assertEqual(len(first), 2)
+
+        self.failing_URLs.add(next(iter(first.values())).url)
+        second = self.scan(first)
+        self.assertEqual(second, first)
+        self.assertEqual(diff_observations(first, second).alerts(), [])
+
+        third = self.scan(second)
+        self.assertEqual(third, first)
+        self.assertEqual(diff_observations(second, third).alerts(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
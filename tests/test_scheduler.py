@@ -0,0 +1,115 @@
+"""Tests for the adaptive per-vendor intervals in scraping/scheduler.py"""
+
+import contextlib
+import io
+import time
+import unittest
+from unittest import mock
+from scraping import circuit_breaker, scheduler
+from scraping.scheduler import Scheduler, VendorSchedule
+
+# Every day, all day, so the test does not depend on when it runs
+ALWAYS = [(None, "00:00", "24:00")]
+
+
+class IntervalTest(unittest.TestCase):
+
+    def setUp(self):
+        # The breaker's own pauses are tested in test_circuit_breaker.py
+        patch = mock.patch.object(circuit_breaker, "failure_threshold", 100)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def record_scans(self, schedule, outcomes):
+        """Records one scan of the vendor per outcome, each a dictionary of record_scan() arguments
+
+        :return: the interval returned for each scan
+        """
+        vendor_scheduler = Scheduler([schedule])
+        started_at = time.monotonic()
+        intervals = []
+        for outcome in outcomes:
+            intervals.append(vendor_scheduler.record_scan(schedule.vendor_name, started_at, **outcome))
+            started_at += intervals[-1]
+        return intervals
+
+    def test_usual_interval(self):
+        self.assertEqual(self.record_scans(VendorSchedule("Newegg", 10), [{}]), [10])
+
+    def test_errors_double_the_interval_up_to_max_error_doublings(self):
+        intervals = self.record_scans(VendorSchedule("Newegg", 10), [{"error": True}] * 7)
+        self.assertEqual(scheduler.max_error_doublings, 5)
+        self.assertEqual(intervals, [20, 40, 80, 160, 320, 320, 320])
+
+    def test_success_resets_the_error_backoff(self):
+        intervals = self.record_scans(VendorSchedule("Newegg", 10), [{"error": True}, {"error": True}, {}])
+        self.assertEqual(intervals, [20, 40, 10])
+
+    def test_rate_limited_on_top_of_the_error_backoff(self):
+        intervals = self.record_scans(VendorSchedule("Newegg", 10), [{"error": True, "rate_limited": True}])
+        self.assertEqual(intervals, [10 * 2 * scheduler.rate_limited_factor])
+
+    def test_recent_stock_halves_the_interval(self):
+        intervals = self.record_scans(VendorSchedule("Newegg", 10), [{"found_stock": True}, {}])
+        self.assertEqual(intervals, [5, 5])
+
+    def test_drop_window_halves_the_interval(self):
+        intervals = self.record_scans(VendorSchedule("Newegg", 10, drop_windows=ALWAYS), [{}])
+        self.assertEqual(intervals, [5])
+
+    def test_interval_never_below_min_interval(self):
+        intervals = self.record_scans(VendorSchedule("Newegg", 4, drop_windows=ALWAYS), [{"found_stock": True}])
+        self.assertEqual(intervals, [scheduler.min_interval])
+
+    def test_jitter_is_added(self):
+        for interval in self.record_scans(VendorSchedule("Newegg", 10, jitter=5), [{}] * 20):
+            self.assertTrue(10 <= interval <= 15)
+
+
+class DueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler([VendorSchedule("Newegg", 10), VendorSchedule("Best Buy", 20, priority=1)])
+        self.started_at = time.monotonic()
+
+    def test_every_vendor_is_due_at_first_highest_priority_first(self):
+        self.assertEqual(self.scheduler.due_vendors(self.started_at), ["Best Buy", "Newegg"])
+        self.assertEqual(self.scheduler.seconds_until_next_due(now=self.started_at), 0)
+
+    def test_vendor_is_due_again_after_its_interval(self):
+        self.scheduler.record_scan("Newegg", self.started_at)
+        self.scheduler.record_scan("Best Buy", self.started_at)
+        self.assertEqual(self.scheduler.due_vendors(self.started_at + 9), [])
+        self.assertEqual(self.scheduler.seconds_until_next_due(now=self.started_at + 9), 1)
+        self.assertEqual(self.scheduler.seconds_until_next_due(exclude=["Newegg"], now=self.started_at + 9), 11)
+        self.assertEqual(self.scheduler.due_vendors(self.started_at + 10), ["Newegg"])
+
+    def test_held_vendor_is_not_due_until_released(self):
+        self.scheduler.hold("Newegg")
+        self.assertEqual(self.scheduler.due_vendors(self.started_at), ["Best Buy"])
+        self.assertEqual(self.scheduler.seconds_until_next_due(exclude=["Best Buy"], now=self.started_at), None)
+
+        self.scheduler.record_scan("Newegg", self.started_at)
+        self.scheduler.release("Newegg")
+        # Nothing was watching it, so it is due straight away rather than after its interval
+        self.assertIn("Newegg", self.scheduler.due_vendors())
+
+    def test_inactive_vendor_is_not_due(self):
+        self.scheduler.set_active(["Newegg"])
+        self.assertEqual(self.scheduler.due_vendors(self.started_at), ["Newegg"])
+
+    def test_open_circuit_breaker_skips_the_vendor(self):
+        vendor_scheduler = Scheduler([VendorSchedule("Newegg", 1)])
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(circuit_breaker.failure_threshold):
+                vendor_scheduler.record_scan("Newegg", self.started_at, error=True)
+        self.assertEqual(vendor_scheduler.breaker_state("Newegg"), circuit_breaker.OPEN)
+
+        # The error backoff alone would have made it due after 8 seconds
+        self.assertEqual(vendor_scheduler.due_vendors(self.started_at + circuit_breaker.open_seconds - 1), [])
+        self.assertEqual(vendor_scheduler.due_vendors(time.monotonic() + circuit_breaker.open_seconds), ["Newegg"])
+        self.assertEqual(vendor_scheduler.breaker_state("Newegg"), circuit_breaker.HALF_OPEN)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Tests for the diff engine in scraping/stock_records.py that decides what to alert on"""
+
+import dataclasses
+import unittest
+from scraping.stock_records import Availability, StockObservation, diff_observations
+
+AVAILABLE = Availability.AVAILABLE
+UNAVAILABLE = Availability.UNAVAILABLE
+
+
+def _observation(sku, online=UNAVAILABLE, in_store=UNAVAILABLE, backorder=UNAVAILABLE, store_locations=(),
+                 price=699.99):
+    return StockObservation(vendor="Newegg", sku=sku, name=f"RTX 3080 {sku}", url=f"https://www.newegg.ca/p/{sku}",
+                            price=price, online=online, in_store=in_store, backorder=backorder,
+                            store_locations=store_locations)
+
+
+def _keyed(*observations):
+    return {observation.sku: observation for observation in observations}
+
+
+class DiffObservationsTest(unittest.TestCase):
+
+    def test_added_removed_and_changed(self):
+        kept, dropped, restocked = _observation("A"), _observation("B"), _observation("C")
+        new = _observation("D", online=AVAILABLE)
+        current = _keyed(kept, dataclasses.replace(restocked, online=AVAILABLE), new)
+        diff = diff_observations(_keyed(kept, dropped, restocked), current)
+
+        self.assertEqual(diff.added, [new])
+        self.assertEqual(diff.removed, [dropped])
+        self.assertEqual(diff.changed, [(restocked, current["C"])])
+        self.assertEqual(diff.current, current)
+        self.assertEqual(diff.in_stock(), [current["C"], new])
+
+    def test_listing_order_does_not_matter(self):
+        first, second = _observation("A", online=AVAILABLE), _observation("B", online=AVAILABLE)
+        diff = diff_observations(_keyed(first, second), _keyed(second, first))
+        self.assertEqual((diff.added, diff.removed, diff.changed), ([], [], []))
+        self.assertEqual(diff.alerts(), [])
+
+
+class AlertsTest(unittest.TestCase):
+
+    def alerts(self, previous, current):
+        return diff_observations(_keyed(*previous), _keyed(*current)).alerts()
+
+    def test_new_item_in_stock_is_alerted(self):
+        in_stock = _observation("A", online=AVAILABLE)
+        self.assertEqual(self.alerts([], [in_stock, _observation("B")]), [in_stock])
+
+    def test_each_channel_becoming_available_is_alerted(self):
+        for channel in ("online", "in_store", "backorder"):
+            restocked = dataclasses.replace(_observation("A"), **{channel: AVAILABLE})
+            self.assertEqual(self.alerts([_observation("A")], [restocked]), [restocked], channel)
+
+    def test_second_channel_becoming_available_is_alerted(self):
+        online = _observation("A", online=AVAILABLE)
+        both = dataclasses.replace(online, in_store=AVAILABLE, store_locations=("Toronto",))
+        self.assertEqual(self.alerts([online], [both]), [both])
+
+    def test_new_store_location_is_alerted(self):
+        one_store = _observation("A", in_store=AVAILABLE, store_locations=("Toronto",))
+        two_stores = dataclasses.replace(one_store, store_locations=("Toronto", "Ottawa"))
+        self.assertEqual(self.alerts([one_store], [two_stores]), [two_stores])
+        self.assertEqual(self.alerts([two_stores], [one_store]), [])
+
+    def test_price_change_is_not_alerted(self):
+        in_stock = _observation("A", online=AVAILABLE)
+        self.assertEqual(self.alerts([in_stock], [dataclasses.replace(in_stock, price=649.99)]), [])
+
+    def test_going_out_of_stock_is_not_alerted(self):
+        in_stock = _observation("A", online=AVAILABLE)
+        self.assertEqual(self.alerts([in_stock], [_observation("A")]), [])
+        self.assertEqual(self.alerts([in_stock], []), [])
+
+    def test_not_checked_is_not_alerted(self):
+        not_checked = _observation("A", online=Availability.NOT_CHECKED)
+        self.assertEqual(self.alerts([_observation("A")], [not_checked]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()